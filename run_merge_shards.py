@@ -0,0 +1,32 @@
+"""Merges the partial states saved by the nodes of a sharded run of steps 2 and 4 (NUM_SHARDS > 1 in config.py), then
+saves the results as a single node would. Run once all the nodes are done.
+
+Partial states are found in SHARDS_PATH, see lib/models/partial_state.py. The results are identical to those of a
+single node run on the whole corpus, including the shuffled cooccurrence refs.
+"""
+
+from srs.config import RESULTS_PATH, SHARDS_PATH
+from srs.lib.models.partial_state import find_partial_states, merge_partial_states
+from run_step_2_cooccurrences import save_coocs_results
+from run_step_4_lexcounts import save_lexcounts
+
+
+def merge_shards_main():
+
+    print(f'Merging the partial states found in {SHARDS_PATH}')
+    coocs_states = find_partial_states(SHARDS_PATH, 'coocs')
+    if coocs_states:
+        save_coocs_results(merge_partial_states(coocs_states))
+    else:
+        print('No partial states found for step 2 (coocs)')
+
+    lexcounts_states = find_partial_states(SHARDS_PATH, 'lexcounts')
+    if lexcounts_states:
+        save_lexcounts(merge_partial_states(lexcounts_states), RESULTS_PATH / 'LEXCOUNTS_DF.p')
+    else:
+        print('No partial states found for step 4 (lexcounts)')
+    print('Merge done!')
+
+
+if __name__ == '__main__':
+    merge_shards_main()
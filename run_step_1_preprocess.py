@@ -2,12 +2,17 @@ import sys
 import os
 
 from srs.lib.utils.io_utils import read_y_n_input, load_json
-from srs.config import LEGACY_MODE, DOCMODELS_PATH, CORPUS_PATH, RESULTS_PATH, LEGACY_IDS_PATH, LEGACY_DOCTERM_LABELS
+from srs.config import LEGACY_MODE, DOCMODELS_PATH, CORPUS_PATH, RESULTS_PATH, LEGACY_IDS_PATH, LEGACY_DOCTERM_LABELS, \
+    N_WORKERS, TAG_BATCH_SIZE, TAG_CACHE_PATH, TAG_CACHE_MAX_ENTRIES, TAGGER_BACKEND, TOKEN_VOCAB_PATH, \
+    CORPUS_STORE_PATH, CATALOG_PATH, SPARSE_DOCTERM
 from srs.lib.preprocess.extraction import extract_and_tag_docmodel_texts, create_docmodels_from_xml_corpus
-from srs.lib.utils.generators import generate_all_docmodels, generate_ids_abs_tags
+from srs.lib.preprocess.compaction import compact_docmodel_tags
+from srs.lib.corpus_store import build_corpus_store
+from srs.lib.catalog import DocCatalog
+from srs.lib.utils.generators import generate_all_docmodels, generate_ids_abs_tags, PosFilter
 from srs.lib.nlp_params import TT_NVA_TAGS, SPECIAL_CHARACTERS_BASE, TRASH_SECTIONS, LEGACY_TRASH_SECTIONS
-from srs.lib.models.tagcounts import TagCountsModel
 from srs.lib.models.docterm import DocTermModel
+from srs.lib.models.vocab import VocabularyBuilder
 
 
 def step_1_setup():
@@ -33,7 +38,7 @@ def step_1_extraction():
 
     print('Starting extraction step.')
     print('This will create and pickle DocModel objects from the source XML files.')
-    create_docmodels_from_xml_corpus(CORPUS_PATH, DOCMODELS_PATH)
+    create_docmodels_from_xml_corpus(CORPUS_PATH, DOCMODELS_PATH, n_workers=N_WORKERS, catalog_path=CATALOG_PATH)
 
 
 def step_1_tagging(legacy: bool):
@@ -42,7 +47,9 @@ def step_1_tagging(legacy: bool):
     print('Starting tagging step')
     print('This will load and update DocModels, extracting the textual contents and generating tags')
     trash_sections = LEGACY_TRASH_SECTIONS if legacy else TRASH_SECTIONS
-    extract_and_tag_docmodel_texts(DOCMODELS_PATH, trash_sections)
+    extract_and_tag_docmodel_texts(DOCMODELS_PATH, trash_sections, n_workers=N_WORKERS, batch_size=TAG_BATCH_SIZE,
+                                   cache_path=TAG_CACHE_PATH, cache_max_entries=TAG_CACHE_MAX_ENTRIES,
+                                   tagger_backend=TAGGER_BACKEND, catalog_path=CATALOG_PATH)
 
     # If the TT bug persists, on legacy mode use a mapping to transform the problematic lemmas directly on the DocModels
 
@@ -63,20 +70,57 @@ y
         filter_fct = lambda x: x.abs_words >= min_abs_len and x.text_words >= min_text_len
     print('Warning: Filtered DocModels will be deleted!')
     print('Filtering docmodels...')
-    files_to_delete = []
-    for dm in generate_all_docmodels(DOCMODELS_PATH):
-        if not filter_fct(dm):
-            files_to_delete.append(dm.filename)
+    if CATALOG_PATH is not None:
+        # Same filters, evaluated by the catalog without opening the DocModels
+        catalog = DocCatalog(CATALOG_PATH)
+        if legacy:
+            legacy_ids = set(legacy_ids)  # Too many ids for a sql IN clause
+            kept = {row['filename'] for row in catalog.rows() if row['id'] in legacy_ids}
+        else:
+            kept = set(catalog.filenames({'abs_words': ('>=', min_abs_len), 'text_words': ('>=', min_text_len)}))
+        files_to_delete = [f for f in catalog.filenames() if f not in kept]
+    else:
+        files_to_delete = []
+        for dm in generate_all_docmodels(DOCMODELS_PATH):
+            if not filter_fct(dm):
+                files_to_delete.append(dm.filename)
     print('Deleting filtered docmodels...')
     for f in files_to_delete:
         os.remove(DOCMODELS_PATH / f)
+    if CATALOG_PATH is not None:
+        catalog.remove(files_to_delete)
+        catalog.close()
     print(f'Deleted {len(files_to_delete)} docmodels, {len(os.listdir(DOCMODELS_PATH))} were kept')
 
 
+def step_1_compaction():
+    """Stores the DocModels' tags as integer ids into a corpus-wide token vocab, if TOKEN_VOCAB_PATH is set"""
+
+    if TOKEN_VOCAB_PATH is None:
+        return
+    print('\nStarting compaction step')
+    print(f'Tags will be stored as integer ids, the token vocab will be saved to {TOKEN_VOCAB_PATH}')
+    compact_docmodel_tags(DOCMODELS_PATH, TOKEN_VOCAB_PATH, n_workers=N_WORKERS, catalog_path=CATALOG_PATH)
+
+
+def step_1_store():
+    """Packs the DocModels' tags and metadata into a corpus store, if CORPUS_STORE_PATH is set"""
+
+    if CORPUS_STORE_PATH is None:
+        return
+    print('\nStarting corpus store step')
+    build_corpus_store(DOCMODELS_PATH, CORPUS_STORE_PATH, n_workers=N_WORKERS)
+
+
+def is_vocab_word(value: str) -> bool:
+    return (len(value) >= 3) and (not any(char in SPECIAL_CHARACTERS_BASE for char in value))
+
+
 def step_1_docterm(legacy: bool):
     """Builds a docterm matrix based on the DocModels' abstracts
 
     If legacy mode is enabled, the matrix' rows and columns will be reordered to match the original configuration.
+    If SPARSE_DOCTERM is set, the matrix is built and saved as a sparse matrix, see SparseDocTerm.
     """
 
     if legacy:
@@ -84,29 +128,26 @@ def step_1_docterm(legacy: bool):
         labels = load_json(LEGACY_DOCTERM_LABELS)
         vocab = labels['columns']
         dt = DocTermModel(update_filter_fct=lambda x: x.pos in TT_NVA_TAGS)
-        for doc_id, tags in generate_ids_abs_tags(DOCMODELS_PATH):
+        for doc_id, tags in generate_ids_abs_tags(CORPUS_STORE_PATH or DOCMODELS_PATH):
             dt.update(doc_id, tags)
 
     else:
-        # TODO use named functions so object can be pickled
-        tc = TagCountsModel(update_filter_fct=lambda x: x.pos in TT_NVA_TAGS)
-        dt = DocTermModel(update_filter_fct=lambda x: x.pos in TT_NVA_TAGS)
-
-        for doc_id, tags in generate_ids_abs_tags(DOCMODELS_PATH):
-            tc.update(tags)
+        # Select the vocab in two passes: words with at least 50 article counts (and at most 30% of the number of
+        # distinct words) are found without counting every word, see models/vocab.py. Only the candidate words are
+        # counted in the DocTermModel.
+        builder = VocabularyBuilder(min_df=50, max_df_ratio=0.3, update_filter_fct=PosFilter(TT_NVA_TAGS),
+                                    value_filter_fct=is_vocab_word)
+        for _, tags in generate_ids_abs_tags(CORPUS_STORE_PATH or DOCMODELS_PATH):
+            builder.update_sketch(tags)
+
+        dt = DocTermModel(update_filter_fct=builder.is_candidate)
+        for doc_id, tags in generate_ids_abs_tags(CORPUS_STORE_PATH or DOCMODELS_PATH):
+            builder.update_counts(tags)
             dt.update(doc_id, tags)
-
-        # Make word list
-        tc.filter_values(lambda x: (len(x) >= 3) and (not any(char in SPECIAL_CHARACTERS_BASE for char in x)))
-        tc_df = tc.as_df()  # cols: total_counts article_counts
-        tc_df = tc_df[(tc_df['article_counts'] <= 0.3*len(tc_df)) & (tc_df['article_counts'] >= 50)]  # TODO check filters
+        builder.print_report()
 
         # Make vocab
-        vocab = tc_df.index
-
-        # Save TagCountsModel for future reference
-        # tc.to_pickle(RESULTS_PATH / 'abstracts_tagcounts_model.p')
-
+        vocab = set(builder.vocabulary())
 
     # Filter DocTermModel to only keep vocab words before building the dataframe
     dt.filter_words(lambda x: x in vocab)
@@ -115,7 +156,14 @@ def step_1_docterm(legacy: bool):
     # dt.to_pickle(RESULTS_PATH / 'abstracts_docterm_model.p')
 
     # Build, normalize and save docterm matrix. If legacy, reorder labels to match original configuration
-    dt_df = dt.as_df(log_norm=True)
+    if SPARSE_DOCTERM:
+        sdt = dt.as_sparse(sort=True).log1p()
+        if legacy:
+            sdt = sdt.reindex(index=labels['index'], columns=labels['columns'])
+        sdt.save_npz(RESULTS_PATH / 'abstracts_docterm.npz')
+        return
+
+    dt_df = dt.as_df(log_norm=True, sort=True)
     if legacy:
         dt_df = dt_df.reindex(index=labels['index'], columns=labels['columns'])
 
@@ -128,6 +176,8 @@ def step_1_main():
     step_1_extraction()
     step_1_tagging(LEGACY_MODE)
     step_1_filtering(LEGACY_MODE)
+    step_1_compaction()
+    step_1_store()
     print('Done extracting the data and building the working corpus.')
 
     print('Building the docterm matrix from the abstracts')
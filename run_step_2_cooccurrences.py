@@ -1,30 +1,79 @@
 """"""
 
 from srs.lib.utils.io_utils import load_csv_values_as_single_list
-from srs.config import LEXICON_PATH, DOCMODELS_PATH, RESULTS_PATH, RND_SEED
+from srs.config import LEXICON_PATH, DOCMODELS_PATH, CORPUS_STORE_PATH, RESULTS_PATH, RND_SEED, N_WORKERS, \
+    SHARD_INDEX, NUM_SHARDS, SHARDS_PATH, REF_SAMPLE_SIZE, COOC_WINDOWS, COOC_TOP_K, COOC_TOP_K_EXACT
 from srs.lib.nlp_params import TT_NVA_TAGS
-from srs.lib.utils.generators import generate_ids_text_tags_filtered
+from srs.lib.utils.generators import generate_ids_text_tags_filtered, PosFilter
 from srs.lib.models.coocs import CoocsModel
+from srs.lib.models.partial_state import save_shard_state
+
+
+def make_coocs_model(window: int = 5) -> CoocsModel:
+    """Loads the lexicon and inits the CoocsModel, also counting the COOC_WINDOWS if set, or only the COOC_TOP_K
+    collocates"""
+
+    lexicon = load_csv_values_as_single_list(LEXICON_PATH)
+    print(f'Lexicon loaded, cooccurrences will be computed on {len(lexicon)} words with a window of {window}...')
+    if COOC_WINDOWS is not None:
+        print(f'Also counting cooccurrences for windows {sorted(set(COOC_WINDOWS))}')
+    if COOC_TOP_K is not None:
+        print(f'Only keeping the top {COOC_TOP_K} collocates of each word')
+    return CoocsModel(lexicon, window=window, tag_attr='lemma', ref_sample_size=REF_SAMPLE_SIZE, ref_seed=RND_SEED,
+                      windows=COOC_WINDOWS, top_k=COOC_TOP_K)
 
 
 def step_2_main(window: int = 5):
-    """Runs step 2. Pretty straight forward since everything is handled by the CoocsModel"""
+    """Runs step 2. Pretty straight forward since everything is handled by the CoocsModel
+
+    If NUM_SHARDS > 1, only this node's shard is processed and the partial state of the model is saved, to be merged
+    with run_merge_shards.py.
+    """
 
     # Load lexicon, init and update CoocsModel
     print('Starting step 2: corpus-wide cooccurrences')
-    lexicon = load_csv_values_as_single_list(LEXICON_PATH)
-    print(f'Lexicon loaded, cooccurrences will be computed on {len(lexicon)} words with a window of {window}...')
-    cm = CoocsModel(lexicon, window=window, tag_attr='lemma')
-    for para_id, tags in generate_ids_text_tags_filtered(DOCMODELS_PATH, filter_fct=lambda x: x.pos in TT_NVA_TAGS, flatten=False):
+    cm = make_coocs_model(window)
+    for para_id, tags in generate_ids_text_tags_filtered(CORPUS_STORE_PATH or DOCMODELS_PATH, filter_fct=PosFilter(TT_NVA_TAGS),
+                                                         flatten=False, n_workers=N_WORKERS,
+                                                         shard_index=SHARD_INDEX, num_shards=NUM_SHARDS):
         cm.update(para_id, tags)
+    if NUM_SHARDS > 1:
+        save_shard_state(cm, SHARDS_PATH, 'coocs', SHARD_INDEX, NUM_SHARDS)
+    else:
+        save_coocs_results(cm)
+    print('Step 2 done!')
+
+
+def count_exact_collocates(cm: CoocsModel):
+    """Second pass over the whole corpus, recovering the exact counts of the collocates kept by a top_k CoocsModel"""
+
+    print('Counting the exact cooccurrences of the top collocates...')
+    for para_id, tags in generate_ids_text_tags_filtered(CORPUS_STORE_PATH or DOCMODELS_PATH, filter_fct=PosFilter(TT_NVA_TAGS),
+                                                         flatten=False, n_workers=N_WORKERS):
+        cm.update_exact(para_id, tags)
 
+
+def save_coocs_results(cm: CoocsModel):
+    """Shuffles the refs, then exports and saves the cooc df. With top_k, exact counts are recovered first if
+    COOC_TOP_K_EXACT is set."""
+
+    if cm.top_k is not None:
+        if COOC_TOP_K_EXACT:
+            count_exact_collocates(cm)
+        else:
+            print(f'Approximate collocate counts, at most {max(cm.collocate_error_bounds().values(), default=0):.0f} '
+                  f'below the true counts')
     # Save model, export and save df
     cm.shuffle_refs(rnd_seed=RND_SEED)
     # cm.to_pickle(RESULTS_PATH / 'cooc_model_corpus.p')
-    cm_df = cm.as_df()
+    cm_df = cm.as_df(sort=True)
     cm_df.to_pickle(RESULTS_PATH / 'cooc_df_corpus.p')
+    # Sparse counts and totals, to rank the cooccurrences by association measures (see result_export_utils.cooc_summary)
+    cm.as_cooc_counts(sort=True).save_npz(RESULTS_PATH / 'cooc_counts.npz')
+    for window in cm.windows or []:
+        cm.as_df(sort=True, window=window).to_pickle(RESULTS_PATH / f'cooc_df_corpus_w{window}.p')
+        cm.as_cooc_counts(sort=True, window=window).save_npz(RESULTS_PATH / f'cooc_counts_w{window}.npz')
     print('Cooccurrences computed, cooc dataframe saved in results directory.')
-    print('Step 2 done!')
 
 
 if __name__ == '__main__':
@@ -1,15 +1,19 @@
 from sklearn.cluster import MiniBatchKMeans
 import pandas as pd
 
-from srs.config import RESULTS_PATH, RND_SEED
+from srs.config import RESULTS_PATH, RND_SEED, SPARSE_DOCTERM
+from srs.lib.models.docterm import SparseDocTerm
 from srs.lib.models.lda import LdaModel
 
 
 def step_3_lda_clusters():
 
     print('Running LDA topic modeling and Kmeans clustering from the abstracts docterm matrix.')
-    # Load docterm
-    dt_df = pd.read_pickle(RESULTS_PATH / 'abstracts_docterm_df.p')
+    # Load docterm, as a dataframe or a SparseDocTerm (same results)
+    if SPARSE_DOCTERM:
+        dt_df = SparseDocTerm.load_npz(RESULTS_PATH / 'abstracts_docterm.npz')
+    else:
+        dt_df = pd.read_pickle(RESULTS_PATH / 'abstracts_docterm_df.p')
 
     print('DocTerm matrix loaded, proceeding to topic modeling.')
     # create LdaModel: params
@@ -1,34 +1,76 @@
 from srs.lib.models.lexcount import LexCounter
 from srs.lib.utils.generators import generate_para_lemmas
 from srs.lib.utils.io_utils import make_list_mapping_from_csv_path
-from srs.config import DOCMODELS_PATH, LEXICON_PATH, RESULTS_PATH
+from srs.lib.models.partial_state import save_shard_state
+from srs.config import DOCMODELS_PATH, CORPUS_STORE_PATH, LEXICON_PATH, RESULTS_PATH, N_WORKERS, SHARD_INDEX, \
+    NUM_SHARDS, SHARDS_PATH, LEXCOUNT_STATS_ONLY, SPARSE_DOCTERM
 
 
 
-def run_lexcounts(lexcount_df_save_path, lexcount_model_save_path=None):
+def make_lexcounter():
 
     # Load lexicon from csv fil as a {'category_name': ['words']} mapping
     lexicon = make_list_mapping_from_csv_path(LEXICON_PATH)
 
     # Initiate the LexCounts object with the lexicon.
     # Will throw an error or a warning if a problem is detected with the lexicon, i.e. if some categories contain no words
-    lc = LexCounter(lex_mapping=lexicon)
+    if LEXCOUNT_STATS_ONLY:
+        # Only accumulates the stats of each cluster found in step 3, see lib/models/lexstats.py. The clusters are
+        # passed as a path, so worker processes load them once instead of receiving a copy with each chunk
+        return LexCounter(lex_mapping=lexicon, group_mapping=doc_clusters_path(), keep_counts=False)
+    return LexCounter(lex_mapping=lexicon)
+
+
+def doc_clusters_path():
+
+    # With LEXCOUNT_STATS_ONLY, step 3 must have been run on the current docterm matrix before step 4
+    clusters_path = RESULTS_PATH / 'doc_cluster_series.p'
+    docterm_path = RESULTS_PATH / ('abstracts_docterm.npz' if SPARSE_DOCTERM else 'abstracts_docterm_df.p')
+    if not clusters_path.exists():
+        raise FileNotFoundError(f'LEXCOUNT_STATS_ONLY groups the lexcounts by the clusters of step 3, but '
+                                f'{clusters_path} was not found: run step 3 before step 4')
+    if docterm_path.exists() and clusters_path.stat().st_mtime < docterm_path.stat().st_mtime:
+        raise RuntimeError(f'{clusters_path} is older than {docterm_path}, the clusters are those of a previous run: '
+                           f'run step 3 again before step 4')
+    return clusters_path
+
+
+def run_lexcounts(lexcount_df_save_path, lexcount_model_save_path=None):
+
+    lc = make_lexcounter()
 
     # Iterate through the DocModels and call .update() for each paragraph
     # doc_para_id consists of the doc id stored in each DocModel and the paragraph number, split by an underscore: '[doc_id]_[para_num]'
     # lemmas is a list of lemmas (str) within each paragraph
-    for doc_para_id, lemmas in generate_para_lemmas(DOCMODELS_PATH):
+    # If NUM_SHARDS > 1, only this node's shard is processed, and the partial state of the LexCounter is saved to be
+    # merged with run_merge_shards.py
+    for doc_para_id, lemmas in generate_para_lemmas(CORPUS_STORE_PATH or DOCMODELS_PATH, n_workers=N_WORKERS,
+                                                    shard_index=SHARD_INDEX, num_shards=NUM_SHARDS):
         lc.update(doc_para_id, lemmas)
 
+    if NUM_SHARDS > 1:
+        save_shard_state(lc, SHARDS_PATH, 'lexcounts', SHARD_INDEX, NUM_SHARDS)
+    else:
+        save_lexcounts(lc, lexcount_df_save_path, lexcount_model_save_path)
+
+
+def save_lexcounts(lc, lexcount_df_save_path, lexcount_model_save_path=None):
 
     # If a path was specified, store the LexCounter object as a pickle
     if lexcount_model_save_path is not None:
         lc.to_pickle(lexcount_model_save_path)
 
+    # Without counts, only the stats used in step 5 are saved
+    if not lc.keep_counts:
+        lc.stats.to_pickle(RESULTS_PATH / 'LEXCOUNT_STATS.p')
+        print(lc.stats)
+        print(lc.stats.mean())
+        return
+
     # Exports the LexCount results as a pandas DataFrame and stor as pickle
     # Represents the number of occurrences of reach word of the lexicon (columns) in each paragraph (rows)
     # Unless specified otherwise, words (columns) belogning to the same lexical category will be merged 
-    lc_df = lc.as_df(merge_categories=True)
+    lc_df = lc.as_df(merge_categories=True, sort_index=True)
     lc_df.to_pickle(lexcount_df_save_path)
     print(lc_df)
     print(lc_df.sum())
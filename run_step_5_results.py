@@ -1,4 +1,5 @@
-from srs.config import RESULTS_PATH
+from srs.config import RESULTS_PATH, LEXCOUNT_STATS_ONLY
+from srs.lib.models.lexstats import LexStats
 import pandas as pd
 
 
@@ -23,6 +24,25 @@ def make_means_series(lexcounts_df_path):
     return lc_df.mean()
 
 
+def make_corrs_df_from_stats(stats, cluster=None):
+
+    # Same as make_corrs_df(), from the stats of the whole corpus or of a single cluster
+    corrs_df = stats.corr(None if cluster is None else [cluster])
+    return corrs_df.where(corrs_df != 1, 0)
+
+
+def results_from_stats_main(lexcount_stats_path):
+    # Saves the same results as results_main(), from the stats saved by step 4 with LEXCOUNT_STATS_ONLY
+
+    stats = LexStats.read_pickle(lexcount_stats_path)
+    stats.mean().to_pickle(RESULTS_PATH / 'word_counts_means_series.p')
+    make_corrs_df_from_stats(stats).to_pickle(RESULTS_PATH / 'lex_corrs_df_corpus.p')
+
+    cluster_series = pd.read_pickle(RESULTS_PATH / 'doc_cluster_series.p')
+    for cluster in cluster_series.unique():
+        make_corrs_df_from_stats(stats, cluster).to_pickle(RESULTS_PATH / f'lex_corrs_df_{cluster}.p')
+
+
 def results_main(lexcounts_df_path):
     # Saves all results data in RESULTS_PATH
 
@@ -43,4 +63,7 @@ def results_main(lexcounts_df_path):
 
 
 if __name__ == '__main__':
-    results_main(RESULTS_PATH / 'LEXCOUNTS_DF.p')
+    if LEXCOUNT_STATS_ONLY:
+        results_from_stats_main(RESULTS_PATH / 'LEXCOUNT_STATS.p')
+    else:
+        results_main(RESULTS_PATH / 'LEXCOUNTS_DF.p')
@@ -0,0 +1,37 @@
+"""Runs steps 2 and 4 with a single pass over the corpus, instead of one full scan per step (see lib/corpus_pass.py).
+
+Gives the same results as running run_step_2_cooccurrences.py then run_step_4_lexcounts.py. If NUM_SHARDS > 1, only
+this node's shard is read and the partial states of both models are saved, to be merged with run_merge_shards.py.
+With LEXCOUNT_STATS_ONLY, the lexcounts are grouped by the clusters of step 3, which must then be run first.
+"""
+
+from srs.config import DOCMODELS_PATH, CORPUS_STORE_PATH, RESULTS_PATH, N_WORKERS, SHARD_INDEX, NUM_SHARDS, SHARDS_PATH
+from srs.lib.corpus_pass import CorpusPass
+from srs.lib.models.partial_state import save_shard_state
+from srs.lib.nlp_params import TT_NVA_TAGS
+from srs.lib.utils.generators import PosFilter
+from run_step_2_cooccurrences import make_coocs_model, save_coocs_results
+from run_step_4_lexcounts import make_lexcounter, save_lexcounts
+
+
+def steps_2_4_main(window: int = 5):
+
+    print('Starting steps 2 and 4: corpus-wide cooccurrences and lexcounts, in a single corpus pass')
+    # Made first, so a missing step 3 is reported before counting the cooccurrences
+    lexcounter = make_lexcounter()
+    corpus_pass = CorpusPass(CORPUS_STORE_PATH or DOCMODELS_PATH, shard_index=SHARD_INDEX, num_shards=NUM_SHARDS)
+    corpus_pass.register('coocs', make_coocs_model(window), 'text_paras', tags_filter_fct=PosFilter(TT_NVA_TAGS))
+    corpus_pass.register('lexcounts', lexcounter, 'text_paras', tag_attr='lemma')
+    models = corpus_pass.run(n_workers=N_WORKERS)
+
+    if NUM_SHARDS > 1:
+        for name, model in models.items():
+            save_shard_state(model, SHARDS_PATH, name, SHARD_INDEX, NUM_SHARDS)
+    else:
+        save_coocs_results(models['coocs'])
+        save_lexcounts(models['lexcounts'], RESULTS_PATH / 'LEXCOUNTS_DF.p')
+    print('Steps 2 and 4 done!')
+
+
+if __name__ == '__main__':
+    steps_2_4_main()
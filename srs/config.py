@@ -27,3 +27,71 @@ LEGACY_DOCTERM_LABELS = DATA_PATH / 'legacy/legacy_docterm_labels.json'
 # Other settings
 # Random seed (set to 2112 to reproduce the original results)
 RND_SEED = 2112
+
+# Number of processes used by the steps that can run in parallel. 1 runs everything in the main process, None uses
+# one process per core
+N_WORKERS = 1
+
+# Max number of paragraphs sent to TreeTagger in a single call during step 1. Gives the same tags with far fewer calls
+# than tagging each paragraph on its own (None)
+TAG_BATCH_SIZE = None
+
+# Tagger used in step 1: 'treetagger' (used for the published results) or 'local', a fast pure-Python stand-in which can
+# be used to run and profile the pipeline where TreeTagger isn't installed (tags will differ)
+TAGGER_BACKEND = 'treetagger'
+
+# Optional path to a persistent cache of paragraph tags (sqlite file), used to avoid tagging repeated paragraphs again,
+# e.g. when running step 1 a second time. Tags are cached per TAGGER_BACKEND, so switching backends never reuses the
+# other backend's tags. None disables the cache
+TAG_CACHE_PATH = None
+TAG_CACHE_MAX_ENTRIES = 2_000_000
+
+# Optional path to a token vocab file (outside of DOCMODELS_PATH). If set, step 1 ends by storing the DocModels' tags as
+# integer ids into this vocab (see lib/compact_tags.py), which makes DocModels smaller and much faster to load in the
+# later steps. The vocab file must then be kept alongside the DocModels. None keeps the tags as lists of Tags
+TOKEN_VOCAB_PATH = None
+
+# Optional path to a corpus store folder (outside of DOCMODELS_PATH). If set, step 1 packs the tags and metadata of all
+# DocModels into a few large memory-mapped files (see lib/corpus_store.py), which the following steps read instead of
+# the individual DocModels. None reads the DocModels
+CORPUS_STORE_PATH = None
+
+# Optional path to a metadata catalog (sqlite file, outside of DOCMODELS_PATH). If set, step 1 records the metadata and
+# token counts of the DocModels in this catalog (see lib/catalog.py), so documents can be filtered and selected without
+# unpickling them. None disables the catalog
+CATALOG_PATH = None
+
+# Set this to True to keep the abstracts docterm matrix sparse: step 1 saves it as abstracts_docterm.npz instead of a
+# dense dataframe (abstracts_docterm_df.p), and step 3 fits the LDA on it directly. Gives the same LDA results with far
+# less memory
+SPARSE_DOCTERM = False
+
+# Sharding, to split steps 2 and 4 across several machines sharing a file system (see lib/utils/sharding.py). With
+# NUM_SHARDS > 1, each machine runs the steps on its own shard of the corpus (SHARD_INDEX from 0 to NUM_SHARDS - 1) and
+# saves the partial state of its models in SHARDS_PATH. run_merge_shards.py then merges them and saves the results
+SHARD_INDEX = 0
+NUM_SHARDS = 1
+SHARDS_PATH = RESULTS_PATH / 'shards'
+
+# Number of paragraph ids sampled for each pair of cooccurring lexicon words in step 2, instead of keeping all of them.
+# Samples are drawn with RND_SEED and take a fixed amount of memory per pair. None keeps every id. Either way the refs
+# are deterministic for a given RND_SEED, but pairs and refs are sorted before shuffling (see CoocsModel.shuffle_refs),
+# so they differ from the samples of the original results
+REF_SAMPLE_SIZE = None
+
+# Window sizes of a window sweep in step 2, e.g. range(2, 11). The cooccurrences of every window are counted in the same
+# pass as the main window (5), and saved in results as cooc_df_corpus_w[size].p and cooc_counts_w[size].npz. None only
+# counts the main window
+COOC_WINDOWS = None
+
+# Number of collocates kept for each lexicon word in step 2, with approximate counts in bounded memory, instead of
+# counting every term found near each word (see lib/models/coocs.py). With COOC_TOP_K_EXACT, the exact counts of the
+# kept collocates are recovered by a second pass over the whole corpus before saving the results. None counts everything
+COOC_TOP_K = None
+COOC_TOP_K_EXACT = True
+
+# Set this to True to only accumulate the sufficient statistics of the lexcounts in step 4, for the whole corpus and
+# each cluster of step 3 (see lib/models/lexstats.py), instead of the paragraph x category dataframe. Step 4 then saves
+# LEXCOUNT_STATS.p instead of LEXCOUNTS_DF.p, and step 5 computes the same means and correlations from it. Step 3 must
+# then be run before step 4 (or run_steps_2_4_single_pass.py), which fails if the clusters are missing or out of date
+LEXCOUNT_STATS_ONLY = False
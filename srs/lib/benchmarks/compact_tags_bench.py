@@ -0,0 +1,82 @@
+"""Benchmark: pickle size and load time of DocModels holding Tag lists vs CompactTags"""
+import os
+import pickle
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from srs.lib.benchmarks.synthetic import generate_documents
+from srs.lib.compact_tags import TokenVocab
+from srs.lib.docmodel import DocModel
+from srs.lib.preprocess.tagging import make_tagger
+
+
+def make_synthetic_docmodels(n_docs: int = 500) -> list[DocModel]:
+    """Builds DocModels (without tree nor metadata) holding synthetic paragraphs tagged by the local tagger"""
+
+    tagger = make_tagger('local')
+    dms = []
+    for doc_id, paras in generate_documents(n_docs):
+        dm = DocModel(f'{doc_id}.xml', None, Path(), save_on_init=False, extract_metadata_on_init=False)
+        dm.raw_abs_paragraphs, dm.raw_text_paragraphs = paras[:3], paras[3:]
+        dm.treetag_abstract(tagger)
+        dm.treetag_text(tagger)
+        dms.append(dm)
+    return dms
+
+
+def sample_docmodels(dm_path: Path, n_docs: int = 500, seed: int = 2112) -> list[DocModel]:
+    """Loads a random sample of the DocModels in dm_path"""
+
+    filenames = sorted(f for f in os.listdir(dm_path) if f.endswith('.p'))
+    sample = random.Random(seed).sample(filenames, min(n_docs, len(filenames)))
+    return [DocModel.read_pickle(dm_path / f) for f in sample]
+
+
+def measure(dms: list[DocModel]) -> tuple[int, float]:
+    """Returns the total pickled size of the DocModels (bytes) and the time needed to unpickle them all (seconds)"""
+
+    dumps = [pickle.dumps(dm) for dm in dms]
+    start = time.perf_counter()
+    for d in dumps:
+        pickle.loads(d)
+    return sum(len(d) for d in dumps), time.perf_counter() - start
+
+
+def benchmark_compact_tags(dm_path: Optional[Path] = None, n_docs: int = 500) -> dict:
+    """Compares the size and load time of DocModels before and after converting their tags to CompactTags.
+
+    Args:
+        dm_path: Folder holding the pickled DocModels to sample. If None, synthetic DocModels are used.
+        n_docs: Number of DocModels to sample
+
+    Returns:
+        A dict with the measured sizes (bytes) and load times (seconds), before and after.
+    """
+
+    dms = sample_docmodels(dm_path, n_docs) if dm_path is not None else make_synthetic_docmodels(n_docs)
+    for dm in dms:
+        dm.tree = None  # Only compare the text data
+    n_tokens = sum(len(dm.get_abs_tags(True)) + len(dm.get_text_tags(True)) for dm in dms)
+    size_before, load_before = measure(dms)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab = TokenVocab.load(Path(tmp) / 'vocab.p', create=True)
+        for dm in dms:
+            dm.compact_tags(vocab)
+        vocab.save()
+        size_after, load_after = measure(dms)
+        vocab_size = os.path.getsize(vocab.path)
+
+    print(f'{len(dms)} docmodels, {n_tokens} tokens, {len(vocab)} token types')
+    print(f'Size: {size_before / 1e6:.1f}MB -> {size_after / 1e6:.1f}MB (x{size_before / size_after:.1f} smaller, '
+          f'plus a {vocab_size / 1e6:.1f}MB vocab file loaded once)')
+    print(f'Load time: {load_before:.3f}s -> {load_after:.3f}s (x{load_before / load_after:.1f} faster)')
+    return {'size_before': size_before, 'size_after': size_after, 'vocab_size': vocab_size,
+            'load_before': load_before, 'load_after': load_after}
+
+
+if __name__ == '__main__':
+    benchmark_compact_tags()
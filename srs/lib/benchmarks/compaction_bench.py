@@ -0,0 +1,64 @@
+"""Benchmark: disk usage and scan time of DocModels compacted with each codec, to choose one for the corpus"""
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from srs.lib.docmodel import CODECS, DocModel
+from srs.lib.preprocess.compaction import compact_docmodels
+from srs.lib.utils.generators import generate_ids_text_tags
+
+
+def dir_size(path: Path) -> int:
+    return sum(os.path.getsize(path / f) for f in os.listdir(path))
+
+
+def time_scans(dm_path: Path) -> dict:
+    """Times a metadata-only scan (headers) and a full tags scan (step 2 like) of the DocModels in dm_path"""
+
+    timings = {}
+    start = time.perf_counter()
+    for f in os.listdir(dm_path):
+        DocModel.read_pickle(dm_path / f).metadata_to_dict()
+    timings['metadata_scan'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in generate_ids_text_tags(dm_path, flatten=False):
+        pass
+    timings['tags_scan'] = time.perf_counter() - start
+    return timings
+
+
+def benchmark_compaction(dm_path: Path, codecs=tuple(CODECS), n_workers: int = 1) -> dict:
+    """Copies the DocModels of dm_path to a temporary folder, compacts them with each codec and measures the results.
+
+    Args:
+        dm_path: Folder holding the DocModels to test with (left untouched). A sample of a few thousand is enough.
+        codecs: Codecs to compare, see docmodel.CODECS
+        n_workers: Number of processes used for the compaction
+
+    Returns:
+        A dict mapping 'original' and each codec to their size (bytes), compaction time and scan times (seconds)
+    """
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        original = Path(tmp) / 'original'
+        shutil.copytree(dm_path, original)
+        results['original'] = {'size': dir_size(original), 'compaction_time': 0.0, **time_scans(original)}
+
+        for codec in codecs:
+            work_path = Path(tmp) / str(codec)
+            shutil.copytree(original, work_path)
+            start = time.perf_counter()
+            compact_docmodels(work_path, codec=codec, n_workers=n_workers)
+            results[codec] = {'size': dir_size(work_path), 'compaction_time': time.perf_counter() - start,
+                              **time_scans(work_path)}
+            shutil.rmtree(work_path)
+
+    print(f'\n{"":>10} {"size (MB)":>10} {"compaction (s)":>15} {"metadata scan (s)":>18} {"tags scan (s)":>14}')
+    for name, r in results.items():
+        print(f'{str(name):>10} {r["size"] / 1e6:>10.1f} {r["compaction_time"]:>15.2f} {r["metadata_scan"]:>18.2f} '
+              f'{r["tags_scan"]:>14.2f}')
+    return results
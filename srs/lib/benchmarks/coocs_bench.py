@@ -0,0 +1,179 @@
+"""Benchmark: CoocsModel offset-based cooccurrence counting vs the previous token by token implementation"""
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from srs.lib.benchmarks.synthetic import generate_paragraphs, make_vocabulary
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.preprocess.tagging import Tag
+
+
+class ListCoocsModel:
+    """The previous CoocsModel counting, kept as a reference: each token is looked up in the vocab list, and the window
+    around each vocab word is rebuilt as a list and counted token by token"""
+
+    def __init__(self, vocab: list[str], window: int, tag_attr: str = 'lemma'):
+        self.vocab = vocab
+        self.window = window
+        self.tag_attr = tag_attr
+        self.coocs = defaultdict(Counter)
+        self.word_occs = Counter()
+        self.refs = defaultdict(Counter)
+
+    def update(self, doc_id: str, tag_list: Iterable) -> None:
+        for i, tag in enumerate(tag_list):
+            word = getattr(tag, self.tag_attr)
+            if word in self.vocab:
+                self.word_occs.update([word])
+                beg = max(i - self.window, 0)
+                end = i + self.window + 1
+                sequence = [getattr(w, self.tag_attr) for w in tag_list[beg:end] if getattr(w, self.tag_attr) != word]
+                self.coocs[word].update(sequence)
+                for cooc in sequence:
+                    if cooc in self.vocab:
+                        self.refs[tuple(sorted([word, cooc]))].update([doc_id])
+
+
+def make_paragraphs(n_paras: int, vocab_size: int = 20000) -> list[tuple[str, list]]:
+    """Synthetic (para_id, tags) pairs, the lemma of each tag being its lower case word"""
+
+    paras = []
+    for i, text in enumerate(generate_paragraphs(n_paras, vocab_size=vocab_size)):
+        words = [w.strip('.').lower() for w in text.split()]
+        paras.append((f'synth-{i // 20}_{i % 20}', [Tag(w, 'NN', w) for w in words]))
+    return paras
+
+
+def benchmark_coocs(n_paras: int = 20000, lexicon_size: int = 1000, window: int = 5) -> dict:
+    """Compares the update speed of both implementations on n_paras synthetic paragraphs, with a lexicon of
+    lexicon_size words spread over the Zipf ranks of the vocabulary, and checks that they give the same coocs, word_occs
+    and refs.
+
+    Returns:
+        A dict mapping each implementation to its number of paragraphs per second
+    """
+
+    paras = make_paragraphs(n_paras)
+    vocabulary = make_vocabulary(20000)
+    lexicon = vocabulary[::len(vocabulary) // lexicon_size][:lexicon_size]
+    print(f'{len(paras)} paragraphs, {sum(len(tags) for _, tags in paras)} tokens, lexicon of {len(lexicon)} words')
+
+    results, models = {}, {}
+    for name, model_cls in (('token by token', ListCoocsModel), ('offsets', CoocsModel)):
+        model = model_cls(lexicon, window)
+        start = time.perf_counter()
+        for para_id, tags in paras:
+            model.update(para_id, tags)
+        model.coocs
+        elapsed = time.perf_counter() - start
+        results[name] = len(paras) / elapsed
+        models[name] = model
+        print(f'{name}: {elapsed:.2f}s, {results[name]:.0f} paragraphs/s')
+
+    reference, model = models['token by token'], models['offsets']
+    if reference.coocs != model.coocs or reference.word_occs != model.word_occs or reference.refs != model.refs:
+        raise AssertionError('The implementations gave different results')
+    print('Same coocs, word_occs and refs')
+    return results
+
+
+def benchmark_ref_memory(n_paras: int = 20000, lexicon_size: int = 200, ref_sample_size: int = 20) -> dict:
+    """Compares the memory held by the refs when keeping every id and when sampling ref_sample_size ids per pair. The
+    lexicon is made of the lexicon_size most frequent words, whose pairs cooccur in many paragraphs like those of the
+    epistemic markers lexicon.
+
+    Returns:
+        A dict mapping each ref_sample_size (None for every id) to the memory of the model (bytes)
+    """
+
+    paras = make_paragraphs(n_paras)
+    lexicon = make_vocabulary(20000)[:lexicon_size]
+
+    results = {}
+    for sample_size in (None, ref_sample_size):
+        tracemalloc.start()
+        model = CoocsModel(lexicon, 5, ref_sample_size=sample_size)
+        for para_id, tags in paras:
+            model.update(para_id, tags, update_coocs=False)
+        results[sample_size], _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'ref_sample_size={sample_size}: {len(model.ref_counts)} pairs, '
+              f'{sum(model.ref_counts.values())} refs, {results[sample_size] / 2**20:.1f}MB')
+        del model
+    return results
+
+
+def benchmark_window_sweep(n_paras: int = 20000, lexicon_size: int = 500, windows: Iterable[int] = range(2, 11)) -> dict:
+    """Compares counting the cooccurrences of all the windows in a single pass (CoocsModel windows) with one pass per
+    window, and with a single pass at the largest window.
+
+    Returns:
+        A dict mapping each method to its time (seconds)
+    """
+
+    paras = make_paragraphs(n_paras)
+    lexicon = make_vocabulary(20000)[:lexicon_size:2]
+    windows = list(windows)
+
+    def run(window: int, **kwargs) -> CoocsModel:
+        model = CoocsModel(lexicon, window, **kwargs)
+        for para_id, tags in paras:
+            model.update(para_id, tags, update_refs=False)
+        model.coocs
+        return model
+
+    results = {}
+    start = time.perf_counter()
+    single_models = {window: run(window) for window in windows}
+    results['one pass per window'] = time.perf_counter() - start
+    start = time.perf_counter()
+    run(max(windows))
+    results['largest window'] = time.perf_counter() - start
+    start = time.perf_counter()
+    sweep = run(max(windows), windows=windows)
+    results['window sweep'] = time.perf_counter() - start
+    for name, elapsed in results.items():
+        print(f'{name}: {elapsed:.2f}s')
+
+    for window, model in single_models.items():
+        if (sweep.window_matrix(window) != model.window_matrix()).nnz:
+            raise AssertionError(f'The window sweep gave different counts for a window of {window}')
+    print(f'Same counts for windows {windows}')
+    return results
+
+
+
+def benchmark_top_k_memory(sizes: Iterable[int] = (5000, 10000, 20000, 40000), lexicon_size: int = 200,
+                           top_k: int = 100) -> dict:
+    """Compares the number of cooccurrence counts held by an exact CoocsModel and one keeping the approximate top_k
+    collocates of each lexicon word, on growing corpora, and checks the top_k collocates recovered by a second pass.
+
+    Returns:
+        A dict mapping each corpus size to the (exact, top_k) numbers of counts held
+    """
+
+    lexicon = make_vocabulary(20000)[:lexicon_size]
+    results = {}
+    for n_paras in sizes:
+        paras = make_paragraphs(n_paras)
+        exact, bounded = CoocsModel(lexicon, 5), CoocsModel(lexicon, 5, top_k=top_k)
+        for para_id, tags in paras:
+            exact.update(para_id, tags, update_refs=False)
+            bounded.update(para_id, tags, update_refs=False)
+        bounded._flush()
+        results[n_paras] = (exact.window_matrix().nnz, bounded.window_matrix().nnz)
+        max_bound = max(bounded.collocate_error_bounds().values())
+        for para_id, tags in paras:
+            bounded.update_exact(para_id, tags)
+        recovered = bounded.top_collocates() == exact.top_collocates(top_k)
+        print(f'{n_paras} paragraphs: {results[n_paras][0]} exact counts, {results[n_paras][1]} top_k counters '
+              f'(max error bound {max_bound:.1f}), top {top_k} recovered by the second pass: {recovered}')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_coocs()
+    benchmark_ref_memory()
+    benchmark_window_sweep()
+    benchmark_top_k_memory()
@@ -0,0 +1,52 @@
+"""Benchmark: full corpus scans reading the DocModels folder vs reading a corpus store"""
+import tempfile
+import time
+from pathlib import Path
+
+from srs.lib.corpus_store import build_corpus_store
+from srs.lib.nlp_params import TT_NVA_TAGS
+from srs.lib.utils.generators import generate_ids_abs_tags, generate_ids_text_tags_filtered, generate_para_lemmas
+
+
+def time_scans(source) -> dict:
+    """Times the scans made by steps 1, 2 and 4 over source (a DocModels folder or a corpus store)"""
+
+    scans = {
+        'abstract tags (step 1)': lambda: generate_ids_abs_tags(source),
+        'filtered text tags (step 2)': lambda: generate_ids_text_tags_filtered(source, lambda x: x.pos in TT_NVA_TAGS,
+                                                                               flatten=False),
+        'paragraph lemmas (step 4)': lambda: generate_para_lemmas(source),
+    }
+    timings = {}
+    for name, scan in scans.items():
+        start = time.perf_counter()
+        for _ in scan():
+            pass
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def benchmark_corpus_store(dm_path: Path, store_path: Path = None) -> dict:
+    """Builds a corpus store from the DocModels in dm_path, then compares the scan times of both sources.
+
+    Args:
+        dm_path: Folder holding tagged DocModels (e.g. made by pipeline_bench.benchmark_pipeline)
+        store_path: Folder of the store to build. A temporary folder is used if None.
+
+    Returns:
+        A dict mapping each scan to its (DocModels time, store time), in seconds.
+    """
+
+    if store_path is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return benchmark_corpus_store(dm_path, Path(tmp) / 'store')
+
+    start = time.perf_counter()
+    store = build_corpus_store(dm_path, store_path)
+    print(f'Store built in {time.perf_counter() - start:.2f}s')
+
+    dm_timings, store_timings = time_scans(dm_path), time_scans(store)
+    for name in dm_timings:
+        print(f'{name}: {dm_timings[name]:.2f}s -> {store_timings[name]:.2f}s '
+              f'(x{dm_timings[name] / store_timings[name]:.1f} faster)')
+    return {name: (dm_timings[name], store_timings[name]) for name in dm_timings}
@@ -0,0 +1,65 @@
+"""Benchmark: DocTermModel array-backed counting vs the previous Counter per document implementation"""
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
+from srs.lib.benchmarks.compact_tags_bench import make_synthetic_docmodels
+from srs.lib.models.docterm import DocTermModel
+from srs.lib.nlp_params import TT_NVA_TAGS
+from srs.lib.utils.examples_tests_utils import CounterDocTermModel
+from srs.lib.utils.generators import generate_ids_abs_tags, PosFilter
+
+
+def fill(model_cls, docs: list[tuple]):
+    model = model_cls(update_filter_fct=PosFilter(TT_NVA_TAGS))
+    for doc_id, tags in docs:
+        model.update(doc_id, tags)
+    if isinstance(model, DocTermModel):
+        model.counts_matrix()
+    return model
+
+
+def measure(model_cls, docs: list[tuple], repeat: int = 3) -> tuple[float, int]:
+    """Returns the best update time over repeat runs (seconds), and the memory held by the model after updating it on
+    all docs (bytes, measured in a separate run since tracing slows the updates down)"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fill(model_cls, docs)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    model = fill(model_cls, docs)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del model
+    return min(timings), memory
+
+
+def benchmark_docterm(dm_path: Optional[Path] = None, n_docs: int = 2000, repeat: int = 3) -> dict:
+    """Compares the update speed and memory of both implementations on the abstracts of dm_path (all of them), or of
+    n_docs synthetic DocModels if dm_path is None.
+
+    Returns:
+        A dict mapping each implementation to its (updates per second, bytes per document)
+    """
+
+    if dm_path is not None:
+        docs = list(generate_ids_abs_tags(dm_path))
+    else:
+        docs = [(dm.id, dm.get_abs_tags(flatten=True)) for dm in make_synthetic_docmodels(n_docs)]
+    n_tokens = sum(len(tags) for _, tags in docs)
+    print(f'{len(docs)} docs, {n_tokens} tokens')
+
+    results = {}
+    for name, model_cls in (('Counter per doc', CounterDocTermModel), ('array-backed', DocTermModel)):
+        elapsed, memory = measure(model_cls, docs, repeat)
+        results[name] = (len(docs) / elapsed, memory / len(docs))
+        print(f'{name}: {results[name][0]:.0f} updates/s, {results[name][1]:.0f} bytes/doc')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_docterm()
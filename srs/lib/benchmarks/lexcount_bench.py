@@ -0,0 +1,95 @@
+"""Benchmark: LexCounter sparse counting vs the previous list of counts per document implementation"""
+import contextlib
+import io
+import time
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+
+from srs.lib.benchmarks.synthetic import generate_paragraphs, make_vocabulary
+from srs.lib.models.lexcount import LexCounter
+
+
+class ListLexCounter:
+    """The previous LexCounter counting, kept as a reference: a Counter of all the words of each document, and a list
+    of counts (one per lexicon word) per document"""
+
+    def __init__(self, lex_mapping: dict):
+        self.lex_mapping = lex_mapping
+        self.lex_words = [word for words in self.lex_mapping.values() for word in words]
+        self.lex_counts = {}
+
+    def update(self, doc_id: str, word_list) -> None:
+        c = Counter(word_list)
+        self.lex_counts.update({doc_id: [c[word] for word in self.lex_words]})
+
+    def as_df(self) -> pd.DataFrame:
+        df = pd.DataFrame.from_dict(self.lex_counts, orient='index', columns=self.lex_words, dtype='UInt16')
+        for cat, words in self.lex_mapping.items():
+            df[cat] = sum(df[w] for w in words if w in df)
+        df.drop([col for col in df.columns if col not in self.lex_mapping.keys()], axis=1, inplace=True)
+        return df.reindex(sorted(df.columns), axis=1)
+
+
+def make_lexicon(n_categories: int = 50, words_per_category: int = 6, vocab_size: int = 20000) -> dict:
+    """Categories of words spread over the Zipf ranks of the vocabulary, each category named after its first word"""
+
+    vocab = make_vocabulary(vocab_size)
+    step = vocab_size // (n_categories * words_per_category)
+    words = vocab[::step][:n_categories * words_per_category]
+    return {words[i]: words[i:i + words_per_category] for i in range(0, len(words), words_per_category)}
+
+
+def fill(model_cls, lex_mapping: dict, paras: list[tuple]):
+    with contextlib.redirect_stdout(io.StringIO()):  # Silences the lexicon checks
+        model = model_cls(lex_mapping)
+    for para_id, words in paras:
+        model.update(para_id, words)
+    if isinstance(model, LexCounter):
+        model._flush()
+    return model
+
+
+def benchmark_lexcount(n_paras: int = 50000, n_categories: int = 50, words_per_category: int = 6,
+                       repeat: int = 3) -> dict:
+    """Compares the update speed, memory and as_df() time of both implementations on n_paras synthetic paragraphs,
+    and checks that they give the same DataFrame.
+
+    Returns:
+        A dict mapping each implementation to its (updates per second, bytes per paragraph, as_df seconds)
+    """
+
+    lex_mapping = make_lexicon(n_categories, words_per_category)
+    paras = [(f'synth-{i // 20}_{i % 20}', [w.strip('.').lower() for w in text.split()])
+             for i, text in enumerate(generate_paragraphs(n_paras, vocab_size=20000))]
+    print(f'{len(paras)} paragraphs, {sum(len(words) for _, words in paras)} words, '
+          f'{sum(len(words) for words in lex_mapping.values())} lexicon words in {len(lex_mapping)} categories')
+
+    results, dfs = {}, {}
+    for name, model_cls in (('list per doc', ListLexCounter), ('sparse', LexCounter)):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model = fill(model_cls, lex_mapping, paras)
+            timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        dfs[name] = model.as_df()
+        df_time = time.perf_counter() - start
+        del model
+
+        tracemalloc.start()
+        model = fill(model_cls, lex_mapping, paras)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del model
+
+        results[name] = (len(paras) / min(timings), memory / len(paras), df_time)
+        print(f'{name}: {results[name][0]:.0f} updates/s, {results[name][1]:.0f} bytes/paragraph, '
+              f'as_df in {df_time:.2f}s')
+    pd.testing.assert_frame_equal(dfs['list per doc'], dfs['sparse'])
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_lexcount()
@@ -0,0 +1,85 @@
+"""Benchmark: runs the main steps of the pipeline on a synthetic corpus, using the local tagger backend.
+
+Does not require TreeTagger, so the whole pipeline can be profiled at any corpus size on any machine.
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from srs.config import LEXICON_PATH
+from srs.lib.benchmarks.synthetic import write_biomed_corpus
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.models.docterm import DocTermModel
+from srs.lib.models.lexcount import LexCounter
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.nlp_params import TRASH_SECTIONS, TT_NVA_TAGS
+from srs.lib.preprocess.extraction import create_docmodels_from_xml_corpus, extract_and_tag_docmodel_texts
+from srs.lib.utils.generators import generate_ids_abs_tags, generate_ids_text_tags_filtered, generate_para_lemmas
+from srs.lib.utils.io_utils import load_csv_values_as_single_list, make_list_mapping_from_csv_path
+
+
+def benchmark_pipeline(n_docs: int = 1000, n_workers: int = 1, work_path: Path = None) -> dict:
+    """Runs extraction, tagging, docterm, cooccurrences and lexcounts on n_docs synthetic documents.
+
+    Args:
+        n_docs: Number of synthetic documents
+        n_workers: Number of processes used for extraction and tagging
+        work_path: Folder in which the corpus and docmodels are written. A temporary folder is used if None.
+
+    Returns:
+        A dict mapping each step to its run time, in seconds.
+    """
+
+    if work_path is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return benchmark_pipeline(n_docs, n_workers, Path(tmp))
+
+    lexicon = make_list_mapping_from_csv_path(LEXICON_PATH)
+    lex_words = load_csv_values_as_single_list(LEXICON_PATH)
+    corpus_path, dm_path = work_path / 'corpus', work_path / 'docmodels'
+    dm_path.mkdir(parents=True, exist_ok=True)
+    print(f'Writing {n_docs} synthetic documents to {corpus_path}...')
+    write_biomed_corpus(corpus_path, n_docs, extra_words=lex_words)
+
+    timings = {}
+
+    def timed(step, fct):
+        start = time.perf_counter()
+        fct()
+        timings[step] = time.perf_counter() - start
+        print(f'>>> {step}: {timings[step]:.2f}s')
+
+    def docterm():
+        tc = TagCountsModel(update_filter_fct=lambda x: x.pos in TT_NVA_TAGS)
+        dt = DocTermModel(update_filter_fct=lambda x: x.pos in TT_NVA_TAGS)
+        for doc_id, tags in generate_ids_abs_tags(dm_path):
+            tc.update(tags)
+            dt.update(doc_id, tags)
+        total_counts = tc.total_counts
+        dt.filter_words(lambda x: x in total_counts)
+        dt.as_df(log_norm=True)
+
+    def coocs():
+        cm = CoocsModel(lex_words, window=5)
+        for para_id, tags in generate_ids_text_tags_filtered(dm_path, lambda x: x.pos in TT_NVA_TAGS, flatten=False):
+            cm.update(para_id, tags)
+        cm.shuffle_refs()
+        cm.as_df()
+
+    def lexcounts():
+        lc = LexCounter(lex_mapping=lexicon)
+        for para_id, lemmas in generate_para_lemmas(dm_path):
+            lc.update(para_id, lemmas)
+        lc.as_df()
+
+    timed('extraction', lambda: create_docmodels_from_xml_corpus(corpus_path, dm_path, n_workers=n_workers))
+    timed('tagging', lambda: extract_and_tag_docmodel_texts(dm_path, TRASH_SECTIONS, n_workers=n_workers,
+                                                            tagger_backend='local'))
+    timed('docterm', docterm)
+    timed('coocs', coocs)
+    timed('lexcounts', lexcounts)
+    return timings
+
+
+if __name__ == '__main__':
+    benchmark_pipeline()
@@ -0,0 +1,72 @@
+"""Benchmark: CoocsModel ref samples export grouped by document vs reading a DocModel for every ref"""
+import filecmp
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from srs.config import LEXICON_PATH
+from srs.lib.benchmarks.synthetic import write_biomed_corpus
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.nlp_params import TRASH_SECTIONS, TT_NVA_TAGS
+from srs.lib.preprocess.extraction import create_docmodels_from_xml_corpus, extract_and_tag_docmodel_texts
+from srs.lib.utils.generators import generate_ids_text_tags_filtered
+from srs.lib.utils.io_utils import load_csv_values_as_single_list, save_json
+
+
+def export_ref_samples_per_ref(cm: CoocsModel, dm_path: Path, save_path: Path, n_samples: int = 20) -> None:
+    """The previous export, kept as a reference: the DocModel of every ref is read, and all samples held in memory"""
+
+    ref_samples = {}
+    for pair, refs in cm.shuffled_refs.items():
+        ref_samples[f'{pair[0]}_{pair[1]}'] = [CoocsModel.make_ref_dict(ref, pair, dm_path) for ref in refs[:n_samples]]
+    save_json(save_path, ref_samples)
+
+
+def benchmark_ref_export(n_docs: int = 500, n_samples: int = 20, n_workers: int = 4,
+                         work_path: Optional[Path] = None) -> dict:
+    """Exports n_samples refs for every lexicon pair of n_docs synthetic documents, with both implementations, and
+    checks that they write the same json.
+
+    Returns:
+        A dict mapping each implementation to its run time, in seconds.
+    """
+
+    if work_path is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return benchmark_ref_export(n_docs, n_samples, n_workers, Path(tmp))
+
+    lex_words = load_csv_values_as_single_list(LEXICON_PATH)
+    corpus_path, dm_path = work_path / 'corpus', work_path / 'docmodels'
+    dm_path.mkdir(parents=True, exist_ok=True)
+    print(f'Building {n_docs} synthetic DocModels...')
+    write_biomed_corpus(corpus_path, n_docs, extra_words=lex_words)
+    create_docmodels_from_xml_corpus(corpus_path, dm_path, n_workers=n_workers)
+    extract_and_tag_docmodel_texts(dm_path, TRASH_SECTIONS, n_workers=n_workers, tagger_backend='local')
+    cm = CoocsModel(lex_words, window=5)
+    for para_id, tags in generate_ids_text_tags_filtered(dm_path, lambda x: x.pos in TT_NVA_TAGS, flatten=False):
+        cm.update(para_id, tags, update_coocs=False)
+    cm.shuffle_refs()
+    n_refs = sum(min(len(refs), n_samples) for refs in cm.shuffled_refs.values())
+    print(f'{len(cm.shuffled_refs)} pairs, {n_refs} refs to export')
+
+    exports = {
+        'per ref': lambda path: export_ref_samples_per_ref(cm, dm_path, path, n_samples),
+        'grouped by doc': lambda path: cm.export_ref_samples(dm_path, path, n_samples),
+        f'grouped by doc, {n_workers} workers': lambda path: cm.export_ref_samples(dm_path, path, n_samples,
+                                                                                  n_workers=n_workers),
+    }
+    results = {}
+    for i, (name, export) in enumerate(exports.items()):
+        start = time.perf_counter()
+        export(work_path / f'refs_{i}.json')
+        results[name] = time.perf_counter() - start
+        print(f'{name}: {results[name]:.2f}s')
+        if i and not filecmp.cmp(work_path / 'refs_0.json', work_path / f'refs_{i}.json', shallow=False):
+            raise AssertionError(f'{name} wrote a different json')
+    print('Same json for all exports')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_ref_export()
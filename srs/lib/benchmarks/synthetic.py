@@ -0,0 +1,104 @@
+"""Synthetic corpus data for benchmarks. Word frequencies follow a Zipf distribution, like in a real corpus."""
+import random
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from xml.sax.saxutils import escape
+
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+
+
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 'pe', 'qui', 'ro', 'su', 'ta', 've',
+             'wi', 'xo', 'zu', 'tion', 'ment', 'ic', 'al', 'ous', 'ing', 'ed', 'er']
+
+BASE_WORDS = sorted({w.strip('.,!’').lower() for s in OFFICE_TEST_SENTENCES for w in s.split() if w.strip('.,!’')})
+
+
+def make_vocabulary(size: int = 5000, seed: int = 2112, extra_words: Optional[Iterable[str]] = None) -> list[str]:
+    """Returns a list of size distinct words: extra words and real words first, then pseudo-words built from syllables.
+    """
+
+    rnd = random.Random(seed)
+    words = list(dict.fromkeys(list(extra_words or []) + BASE_WORDS))
+    seen = set(words)
+    while len(words) < size:
+        w = ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 4)))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+    return words[:size]
+
+
+def generate_paragraphs(n_paras: int, vocab_size: int = 5000, min_words: int = 30, max_words: int = 150,
+                        seed: int = 2112, extra_words: Optional[Iterable[str]] = None) -> Iterator[str]:
+    """Generator, yields n_paras paragraphs of sentences made of Zipf-distributed words.
+
+    Extra words are placed at the top of the vocabulary, i.e. they will be among the most frequent words.
+    """
+
+    rnd = random.Random(seed)
+    vocab = make_vocabulary(vocab_size, seed, extra_words)
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    for _ in range(n_paras):
+        words = rnd.choices(vocab, weights, k=rnd.randint(min_words, max_words))
+        sentences = [' '.join(words[i:i + 15]).capitalize() + '.' for i in range(0, len(words), 15)]
+        yield ' '.join(sentences)
+
+
+def generate_documents(n_docs: int, min_paras: int = 5, max_paras: int = 40, seed: int = 2112,
+                       **para_kwargs) -> Iterator[tuple[str, list[str]]]:
+    """Generator, yields (doc_id, [paragraphs]) pairs. Extra kwargs are passed to generate_paragraphs()"""
+
+    rnd = random.Random(seed)
+    sizes = [rnd.randint(min_paras, max_paras) for _ in range(n_docs)]
+    paragraphs = generate_paragraphs(sum(sizes), seed=seed, **para_kwargs)
+    for i, size in enumerate(sizes):
+        yield f'synth-{i}', [next(paragraphs) for _ in range(size)]
+
+
+BOILERPLATE_PARAGRAPH = 'The authors declare that they have no competing interests.'
+
+
+def write_biomed_corpus(dest_path: Path, n_docs: int, seed: int = 2112, **doc_kwargs) -> None:
+    """Writes n_docs synthetic xml files using the BioMed structure expected by DocModel to dest_path.
+
+    Each document has a 2 to 4 paragraphs abstract and a body made of the paragraphs from generate_documents(), plus a
+    boilerplate paragraph shared by all documents. Extra kwargs are passed to generate_documents().
+    """
+
+    dest_path.mkdir(parents=True, exist_ok=True)
+    rnd = random.Random(seed)
+    for doc_id, paras in generate_documents(n_docs, seed=seed, **doc_kwargs):
+        n_abs = rnd.randint(2, 4)
+        abs_xml = ''.join(f'<p>{escape(p)}</p>' for p in paras[:n_abs])
+        bdy_xml = ''.join(f'<sec><st><p>Section</p></st><p>{escape(p)}</p></sec>' for p in paras[n_abs:])
+        bdy_xml += f'<sec><p>{BOILERPLATE_PARAGRAPH}</p></sec>'
+        year = rnd.randint(2000, 2015)
+        xml = (f'<art><ui>{doc_id}</ui><ji>synth</ji><fm><dochead>Research article</dochead><bibl>'
+               f'<title><p>Synthetic document {doc_id}</p></title><aug><au><snm>Doe</snm><fnm>J</fnm></au></aug>'
+               f'<source>Synthetic Journal {rnd.randint(1, 20)}</source><issn>0000-0000</issn><pubdate>{year}</pubdate>'
+               f'<volume>{year - 1999}</volume><issue>1</issue><fpage>{rnd.randint(1, 999)}</fpage>'
+               f'<url>https://example.org/{doc_id}</url><xrefbib><pubid idtype="doi">10.0000/{doc_id}</pubid>'
+               f'</xrefbib></bibl><cpyrt><collab>Doe et al.; licensee Synthetic Ltd.</collab></cpyrt>'
+               f'<kwdg><kwd>Synthetic</kwd></kwdg><abs><sec>{abs_xml}</sec></abs></fm><bdy>{bdy_xml}</bdy></art>')
+        with open(dest_path / f'{doc_id}.xml', 'w', encoding='utf-8') as f:
+            f.write(xml)
+
+
+def write_synthetic_docmodels(work_path: Path, n_docs: int, seed: int = 2112, catalog_path: Optional[Path] = None,
+                              **doc_kwargs) -> Path:
+    """Writes a synthetic corpus to work_path/corpus (see write_biomed_corpus()), then runs the extraction and tagging of
+    step 1 on it with the local tagger backend. Returns the DocModels folder, work_path/docmodels.
+
+    Extra kwargs are passed to generate_documents(), e.g. min_paras=2 and max_paras=4 for a small test corpus.
+    """
+
+    # Imported here, the generators above are used by modules imported by extraction.py
+    from srs.lib.nlp_params import TRASH_SECTIONS
+    from srs.lib.preprocess.extraction import create_docmodels_from_xml_corpus, extract_and_tag_docmodel_texts
+
+    corpus_path, dm_path = work_path / 'corpus', work_path / 'docmodels'
+    dm_path.mkdir(parents=True, exist_ok=True)
+    write_biomed_corpus(corpus_path, n_docs, seed, **doc_kwargs)
+    create_docmodels_from_xml_corpus(corpus_path, dm_path, catalog_path=catalog_path)
+    extract_and_tag_docmodel_texts(dm_path, TRASH_SECTIONS, tagger_backend='local', catalog_path=catalog_path)
+    return dm_path
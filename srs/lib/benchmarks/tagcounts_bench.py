@@ -0,0 +1,90 @@
+"""Benchmark: TagCountsModel integer-id counting vs the previous Counter based implementation"""
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional
+
+from srs.lib.benchmarks.compact_tags_bench import make_synthetic_docmodels
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.nlp_params import TT_NVA_TAGS
+from srs.lib.utils.generators import generate_ids_abs_tags, PosFilter
+
+
+class CounterTagCountsModel:
+    """The previous TagCountsModel counting, kept as a reference: Counters updated with the values of the tags passing
+    the filter, called on each token, and a Counter of secondary values per value"""
+
+    def __init__(self, tag_attr: str = 'lemma', secondary_attr: str = None, update_filter_fct=None):
+        self.total_counts = Counter()
+        self.presence_counts = Counter()
+        self.secondary_counts = defaultdict(Counter)
+        self.tag_attr = tag_attr
+        self.secondary_attr = secondary_attr
+        self.filter_fct = update_filter_fct
+
+    def update(self, tag_list) -> None:
+        vals = []
+        for tag in tag_list:
+            if self.filter_fct(tag):
+                value = getattr(tag, self.tag_attr)
+                vals.append(value)
+                if self.secondary_attr is not None:
+                    self.secondary_counts[value].update({getattr(tag, self.secondary_attr): 1})
+        self.total_counts.update(vals)
+        self.presence_counts.update(set(vals))
+
+
+def fill(model_cls, docs: list, secondary_attr: Optional[str]):
+    model = model_cls(secondary_attr=secondary_attr, update_filter_fct=PosFilter(TT_NVA_TAGS))
+    for tags in docs:
+        model.update(tags)
+    if isinstance(model, TagCountsModel):
+        model.total_counts
+    return model
+
+
+def measure(model_cls, docs: list, secondary_attr: Optional[str], repeat: int = 3) -> tuple[float, int]:
+    """Returns the best update time over repeat runs (seconds), and the memory held by the model after updating it on
+    all docs (bytes, measured in a separate run since tracing slows the updates down)"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fill(model_cls, docs, secondary_attr)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    model = fill(model_cls, docs, secondary_attr)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del model
+    return min(timings), memory
+
+
+def benchmark_tagcounts(dm_path: Optional[Path] = None, n_docs: int = 2000, repeat: int = 3) -> dict:
+    """Compares the update speed and memory of both implementations on the abstracts of dm_path (all of them), or of
+    n_docs synthetic DocModels if dm_path is None, without and with 'pos' as secondary attribute.
+
+    Returns:
+        A dict mapping each (implementation, secondary_attr) to its (updates per second, memory in bytes)
+    """
+
+    if dm_path is not None:
+        docs = [tags for _, tags in generate_ids_abs_tags(dm_path)]
+    else:
+        docs = [dm.get_abs_tags(flatten=True) for dm in make_synthetic_docmodels(n_docs)]
+    print(f'{len(docs)} docs, {sum(len(tags) for tags in docs)} tokens')
+
+    results = {}
+    for secondary_attr in (None, 'pos'):
+        for name, model_cls in (('Counters', CounterTagCountsModel), ('integer ids', TagCountsModel)):
+            elapsed, memory = measure(model_cls, docs, secondary_attr, repeat)
+            results[name, secondary_attr] = (len(docs) / elapsed, memory)
+            print(f'{name}, secondary_attr={secondary_attr}: {results[name, secondary_attr][0]:.0f} updates/s, '
+                  f'{memory / 2**10:.0f}kB')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_tagcounts()
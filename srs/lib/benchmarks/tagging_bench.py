@@ -0,0 +1,35 @@
+"""Benchmark: per-paragraph vs batched TreeTagger calls on a synthetic corpus. Requires a working TreeTagger install."""
+import time
+
+from srs.lib.benchmarks.synthetic import generate_documents
+from srs.lib.preprocess.tagging import tag_paragraphs, make_tagger
+
+
+def benchmark_batched_tagging(tagger, n_docs: int = 200, batch_sizes=(None, 10, 50, 200)) -> dict:
+    """Tags the same synthetic documents with each batch size, checks the tags match and prints the timings.
+
+    Returns:
+        A dict mapping each batch size to its run time, in seconds.
+    """
+
+    docs = list(generate_documents(n_docs))
+    n_paras = sum(len(paras) for _, paras in docs)
+    print(f'Tagging {n_docs} synthetic documents ({n_paras} paragraphs)')
+
+    timings = {}
+    reference = None
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        tags = [tag_paragraphs(tagger, paras, batch_size) for _, paras in docs]
+        timings[batch_size] = time.perf_counter() - start
+        if reference is None:
+            reference = tags
+        elif tags != reference:
+            print(f'WARNING: tags obtained with batch_size={batch_size} differ from the reference')
+        print(f'batch_size={batch_size}: {timings[batch_size]:.2f}s ({n_paras / timings[batch_size]:.0f} paragraphs/s, '
+              f'x{timings[batch_sizes[0]] / timings[batch_size]:.1f})')
+    return timings
+
+
+if __name__ == '__main__':
+    benchmark_batched_tagging(make_tagger('treetagger'))
@@ -0,0 +1,253 @@
+"""Metadata catalog of the DocModels, to select documents without unpickling them.
+
+The catalog is a sqlite database holding one row per DocModel file, with the scalar metadata fields of
+DocModel.metadata_to_dict() and the token counts. It is filled during extraction and tagging (see preprocess/extraction.py)
+and can be brought up to date after DocModels are rewritten by other means with DocCatalog.sync().
+
+Documents can be selected with a SQL WHERE clause:
+
+    catalog.filenames('year >= ? AND source = ?', ('2010', 'bmc genomics'))
+
+or with a declarative predicate, a dict mapping columns to a value, a list of accepted values or an (operator, value)
+pair. All conditions must match:
+
+    catalog.filenames({'year': ('>=', '2010'), 'source': ['bmc genomics', 'bmc genetics'], 'abs_words': ('>=', 150)})
+
+Note that metadata values are stored as extracted from the XML, so years are strings. Values of a declarative predicate
+are converted to the type of their column, as sqlite does, so {'year': ('>=', 2010)} compares years as strings both in
+the catalog and with matches() (used on the metadata of a corpus store). A None value selects the documents without a
+value for the column.
+"""
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional, Union
+
+from srs.lib.docmodel import DocModel
+
+# Catalog columns and their sqlite types. authors is stored as a json string
+COLUMNS = {
+    'filename': 'TEXT PRIMARY KEY',
+    'id': 'TEXT',
+    'title': 'TEXT',
+    'source': 'TEXT',
+    'doctype': 'TEXT',
+    'year': 'TEXT',
+    'issn': 'TEXT',
+    'authors': 'TEXT',
+    'collab': 'TEXT',
+    'doi': 'TEXT',
+    'url': 'TEXT',
+    'volume': 'TEXT',
+    'issue': 'TEXT',
+    'page': 'TEXT',
+    'citation': 'TEXT',
+    'abs_tokens': 'INTEGER',
+    'text_tokens': 'INTEGER',
+    'abs_words': 'INTEGER',
+    'text_words': 'INTEGER',
+    'mtime': 'REAL',
+}
+INDEXED_COLUMNS = ('id', 'year', 'source', 'doctype')
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'like')
+
+Where = Union[None, str, dict]
+
+
+class DocCatalog:
+    """sqlite catalog of the DocModels metadata, see module docstring.
+
+    Attributes
+    ----------
+    path: Path
+        Path to the sqlite database file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(self.path, timeout=120)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS docs ({", ".join(f"{c} {t}" for c, t in COLUMNS.items())})')
+        for column in INDEXED_COLUMNS:
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS docs_{column} ON docs ({column})')
+        self._conn.commit()
+
+    def record(self, rows: list[dict]) -> None:
+        """Inserts or replaces rows, as made by catalog_row()"""
+
+        self._conn.executemany(f'INSERT OR REPLACE INTO docs VALUES ({", ".join("?" * len(COLUMNS))})',
+                               [tuple(row[c] for c in COLUMNS) for row in rows])
+        self._conn.commit()
+
+    def remove(self, filenames: list[str]) -> None:
+        self._conn.executemany('DELETE FROM docs WHERE filename = ?', [(f,) for f in filenames])
+        self._conn.commit()
+
+    def sync(self, dm_path: Path) -> tuple[int, int]:
+        """Brings the catalog up to date with the DocModels in dm_path. Only the files added or modified since they
+        were recorded are unpickled, and rows of deleted files are removed.
+
+        Returns:
+            The number of (updated, removed) rows
+        """
+
+        recorded = dict(self._conn.execute('SELECT filename, mtime FROM docs'))
+        on_disk = {}
+        for entry in os.scandir(dm_path):
+            if entry.name.endswith('.p'):
+                on_disk[entry.name] = entry.stat().st_mtime
+
+        removed = [f for f in recorded if f not in on_disk]
+        self.remove(removed)
+        changed = sorted(f for f, mtime in on_disk.items() if recorded.get(f) != mtime)
+        for i in range(0, len(changed), 1000):
+            self.record([catalog_row(DocModel.read_pickle(dm_path / f), dm_path / f) for f in changed[i:i + 1000]])
+        return len(changed), len(removed)
+
+    def rows(self, where: Where = None, params: tuple = ()) -> list[dict]:
+        """Returns the rows matching the predicate (all rows if None), as dicts, sorted by filename"""
+
+        sql, params = where_to_sql(where, params)
+        cursor = self._conn.execute(f'SELECT * FROM docs{sql} ORDER BY filename', params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def filenames(self, where: Where = None, params: tuple = ()) -> list[str]:
+        """Returns the filenames of the DocModels matching the predicate (all if None), sorted"""
+
+        sql, params = where_to_sql(where, params)
+        return [row[0] for row in self._conn.execute(f'SELECT filename FROM docs{sql} ORDER BY filename', params)]
+
+    def paths(self, dm_path: Path, where: Where = None, params: tuple = ()) -> list[Path]:
+        return [dm_path / f for f in self.filenames(where, params)]
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+
+
+def catalog_row(dm: DocModel, file_path: Optional[Path] = None) -> dict:
+    """Catalog row of a DocModel. file_path defaults to dm.file_path, and should be the up to date pickle of dm."""
+
+    file_path = Path(file_path) if file_path is not None else dm.file_path
+    row = {c: v for c, v in dm.metadata_to_dict().items() if c in COLUMNS}
+    row.update({
+        'filename': file_path.name,
+        'authors': json.dumps(dm.authors),
+        'abs_tokens': dm.abs_tokens,
+        'text_tokens': dm.text_tokens,
+        'abs_words': dm.abs_words,
+        'text_words': dm.text_words,
+        'mtime': os.path.getmtime(file_path),
+    })
+    return row
+
+
+def where_to_sql(where: Where, params: tuple = ()) -> tuple[str, tuple]:
+    """Returns the ' WHERE ...' clause (empty if where is None) and its parameters for a SQL string or a declarative
+    predicate"""
+
+    if where is None:
+        return '', ()
+    if isinstance(where, str):
+        return f' WHERE {where}', tuple(params)
+
+    conditions, params = [], []
+    for column, condition in _typed_conditions(where):
+        if isinstance(condition, list):
+            values = [value for value in condition if value is not None]
+            sql = f'{column} IN ({", ".join("?" * len(values))})' if values else '0'
+            conditions.append(f'({sql} OR {column} IS NULL)' if None in condition else sql)
+            params.extend(values)
+        elif isinstance(condition, tuple):
+            op, value = condition
+            conditions.append(f'{column} {op.upper()} ?')
+            params.append(value)
+        elif condition is None:
+            conditions.append(f'{column} IS NULL')
+        else:
+            conditions.append(f'{column} = ?')
+            params.append(condition)
+    return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', tuple(params)
+
+
+def matches(where: Where, doc: dict) -> bool:
+    """Evaluates a declarative predicate on a metadata dict, in the same way as the catalog would. SQL strings can only be
+    evaluated by the catalog."""
+
+    if where is None:
+        return True
+    if isinstance(where, str):
+        raise TypeError('SQL predicates can only be evaluated by a DocCatalog')
+
+    for column, condition in _typed_conditions(where):
+        value = doc.get(column)
+        if isinstance(condition, list):
+            if value not in condition:
+                return False
+        elif isinstance(condition, tuple):
+            op, expected = condition
+            if value is None or not _compare(op, value, expected):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _typed_conditions(where: dict) -> list[tuple]:
+    """Checks the columns and operators of a declarative predicate, and converts its values to the type of their column
+    (see _typed_value). Returns (column, condition) pairs, with lists for the sets of accepted values."""
+
+    conditions = []
+    for column, condition in where.items():
+        if column not in COLUMNS:
+            raise ValueError(f'Unknown catalog column: {column}')
+        if isinstance(condition, (list, set, frozenset)):
+            condition = [_typed_value(column, value) for value in condition]
+        elif isinstance(condition, tuple):
+            op, value = condition
+            if op not in OPERATORS:
+                raise ValueError(f'Unknown operator: {op}')
+            if value is None:
+                raise ValueError(f'Cannot compare {column} to None with {op}, use {{{column!r}: None}} instead')
+            condition = (op, _typed_value(column, value))
+        else:
+            condition = _typed_value(column, condition)
+        conditions.append((column, condition))
+    return conditions
+
+
+def _typed_value(column: str, value):
+    """Converts a value to the type of a column, as sqlite does when comparing it to the column: str for TEXT columns,
+    int or float for INTEGER and REAL ones. None is kept."""
+
+    if value is None:
+        return None
+    if COLUMNS[column].startswith('TEXT'):
+        return str(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{column} holds numbers, {value!r} cannot be compared to it') from None
+    return int(number) if COLUMNS[column] == 'INTEGER' and number.is_integer() else number
+
+
+def _compare(op: str, value, expected) -> bool:
+    if op == '=':
+        return value == expected
+    if op == '!=':
+        return value != expected
+    if op == '<':
+        return value < expected
+    if op == '<=':
+        return value <= expected
+    if op == '>':
+        return value > expected
+    if op == '>=':
+        return value >= expected
+    if op == 'like':
+        raise ValueError("The 'like' operator can only be evaluated by a DocCatalog")
+    raise ValueError(f'Unknown operator: {op}')
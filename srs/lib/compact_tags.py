@@ -0,0 +1,214 @@
+"""Compact, integer-coded storage for the tags held by DocModels.
+
+Storing one Tag named tuple (three python strings) per token makes pickles big and slow to load. Instead, a corpus-wide
+TokenVocab interns each distinct (word, pos, lemma) triple, called a token type, and each document only stores a flat
+int32 array of token type ids plus the offsets of its paragraphs (CompactTags).
+
+CompactTags behave like the [[Tag]] lists they replace: they can be iterated, indexed and measured, and decoding returns
+shared Tag objects, so existing code using DocModel.get_text_tags() and the generators works unchanged.
+
+The vocab is saved in its own file, and pickled CompactTags only hold its path. It is loaded once per process, the first
+time a document referencing it is unpickled.
+"""
+
+import os
+import pickle
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from srs.lib.preprocess.tagging import Tag
+
+
+class TokenVocab:
+    """Corpus-wide interned vocabularies of words, POS tags and lemmas, and of the token types combining them.
+
+    Ids are only ever appended, so documents encoded with an older version of the vocab remain valid.
+
+    Attributes
+    ----------
+    path: Path
+        Location of the vocab file. Pickled CompactTags reference the vocab through this path.
+    words, pos, lemmas: list[str]
+        The interned values, indexed by their id.
+    types: list[Tag]
+        The token types, indexed by their id. The same Tag object is returned for each token of a given type.
+    type_words, type_pos, type_lemmas: np.ndarray
+        Word, pos and lemma ids of each token type, for vectorized operations (e.g. pos masks).
+    """
+
+    _loaded = {}
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.words, self.pos, self.lemmas = [], [], []
+        self._word_ids, self._pos_ids, self._lemma_ids = {}, {}, {}
+        self.types = []
+        self._type_ids = {}
+        self._type_codes = []
+        self._arrays = None
+
+    def encode(self, tags: Iterable) -> np.ndarray:
+        """Returns the token type ids of the tags, adding new types to the vocab"""
+
+        type_ids = self._type_ids
+        return np.fromiter((type_ids[tag] if tag in type_ids else self.add_type(tag) for tag in tags), dtype=np.int32)
+
+    def decode(self, ids: np.ndarray) -> list:
+        """Returns the Tags corresponding to token type ids"""
+
+        types = self.types
+        if len(ids) and ids.max() >= len(types):
+            self.reload()
+            types = self.types
+        return [types[i] for i in ids.tolist()]
+
+    def add_type(self, tag) -> int:
+        word, pos, lemma = tag
+        type_id = len(self.types)
+        self.types.append(Tag(word, pos, lemma))
+        self._type_ids[self.types[-1]] = type_id
+        self._type_codes.append((self._intern(word, self.words, self._word_ids),
+                                 self._intern(pos, self.pos, self._pos_ids),
+                                 self._intern(lemma, self.lemmas, self._lemma_ids)))
+        self._arrays = None
+        return type_id
+
+    @property
+    def type_words(self) -> np.ndarray:
+        return self._get_arrays()[:, 0]
+
+    @property
+    def type_pos(self) -> np.ndarray:
+        return self._get_arrays()[:, 1]
+
+    @property
+    def type_lemmas(self) -> np.ndarray:
+        return self._get_arrays()[:, 2]
+
+    def pos_mask(self, pos_tags: Iterable[str]) -> np.ndarray:
+        """Returns a boolean array indexed by token type ids, True for types whose pos is in pos_tags"""
+
+        pos_ids = [self._pos_ids[pos] for pos in pos_tags if pos in self._pos_ids]
+        return np.isin(self.type_pos, pos_ids)
+
+    def save(self, path: Path = None) -> None:
+        """Saves the vocab, atomically replacing the existing file"""
+
+        path = Path(path) if path is not None else self.path
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'words': self.words, 'pos': self.pos, 'lemmas': self.lemmas, 'types': self._type_codes}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def reload(self) -> None:
+        with open(self.path, 'rb') as f:
+            data = pickle.load(f)
+        self.words, self.pos, self.lemmas = data['words'], data['pos'], data['lemmas']
+        self._word_ids = {w: i for i, w in enumerate(self.words)}
+        self._pos_ids = {p: i for i, p in enumerate(self.pos)}
+        self._lemma_ids = {l: i for i, l in enumerate(self.lemmas)}
+        self._type_codes = data['types']
+        self.types = [Tag(self.words[w], self.pos[p], self.lemmas[l]) for w, p, l in self._type_codes]
+        self._type_ids = {tag: i for i, tag in enumerate(self.types)}
+        self._arrays = None
+
+    @classmethod
+    def load(cls, path, create: bool = False) -> 'TokenVocab':
+        """Returns the vocab saved at path, loaded only once per process. Creates an empty vocab if the file doesn't
+        exist and create is True."""
+
+        key = str(Path(path).resolve())
+        if key not in cls._loaded:
+            vocab = cls(path)
+            if os.path.exists(path):
+                vocab.reload()
+            elif not create:
+                raise FileNotFoundError(f'No token vocab found at {path}')
+            cls._loaded[key] = vocab
+        return cls._loaded[key]
+
+    def _get_arrays(self) -> np.ndarray:
+        if self._arrays is None:
+            self._arrays = np.array(self._type_codes, dtype=np.int32).reshape(-1, 3)
+        return self._arrays
+
+    @staticmethod
+    def _intern(value: str, values: list, ids: dict) -> int:
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def __len__(self):
+        return len(self.types)
+
+    def __contains__(self, tag):
+        return tag in self._type_ids
+
+    def __reduce__(self):
+        return TokenVocab.load, (str(self.path),)
+
+
+class CompactTags:
+    """Paragraphs of tags stored as a flat int32 array of token type ids, with paragraph offsets.
+
+    Used as a drop-in replacement for [[para1 Tags], [para2 Tags], ...] lists: len() is the number of paragraphs, and
+    iterating or indexing returns lists of Tags, decoded on access.
+    """
+
+    def __init__(self, vocab: TokenVocab, ids: np.ndarray, offsets: np.ndarray):
+        self.vocab = vocab
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs: Iterable[Iterable], vocab: TokenVocab) -> 'CompactTags':
+        encoded = [vocab.encode(para) for para in paragraphs]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(ids) for ids in encoded])
+        ids = np.concatenate(encoded).astype(np.int32) if encoded else np.zeros(0, dtype=np.int32)
+        return cls(vocab, ids, offsets)
+
+    def flatten(self) -> list:
+        """Returns all the tags as a single list"""
+
+        return self.vocab.decode(self.ids)
+
+    def paragraph_ids(self, i: int) -> np.ndarray:
+        """Returns the token type ids of paragraph i"""
+
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def to_lists(self) -> list[list]:
+        return [self[i] for i in range(len(self))]
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('CompactTags paragraph index out of range')
+        return self.vocab.decode(self.paragraph_ids(i))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if isinstance(other, CompactTags):
+            return self.to_lists() == other.to_lists()
+        return self.to_lists() == other
+
+    def __repr__(self):
+        return f'CompactTags({len(self)} paragraphs, {self.n_tokens} tokens)'
@@ -0,0 +1,181 @@
+"""Single pass over the corpus, feeding several models at once.
+
+Each model is fed a different view of the same DocModels: flattened abstract tags (TagCountsModel, DocTermModel), text
+paragraph tags (CoocsModel) or text paragraph lemmas (LexCounter). Instead of one full corpus scan per model, the
+CorpusPass reads each DocModel once and feeds every registered consumer:
+
+    corpus_pass = CorpusPass(DOCMODELS_PATH)
+    corpus_pass.register('coocs', CoocsModel(lexicon, window=5), 'text_paras', tags_filter_fct=PosFilter(TT_NVA_TAGS))
+    corpus_pass.register('lexcounts', LexCounter(lex_mapping), 'text_paras', tag_attr='lemma')
+    models = corpus_pass.run(n_workers=8)
+
+With n_workers > 1, the DocModels are split in chunks of consecutive files, each chunk is fed to a copy of the models
+in a worker process, and the partial models are merged (see the models' merge() methods) in corpus order. Models and
+filters must then be picklable.
+"""
+import copy
+from functools import partial
+from typing import Callable, Optional
+
+from srs.lib.catalog import Where
+from srs.lib.corpus_store import CorpusStore
+from srs.lib.docmodel import DocModel
+from srs.lib.utils.generators import as_corpus_store, select_docmodel_paths, metadata_filter
+from srs.lib.utils.parallel import bounded_imap
+
+# Views available to the consumers: name -> (DocModel getter, store section, flatten). Flattened views yield a single
+# (doc_id, tags) pair per document, the others one ([doc_id]_[para_num], tags) pair per paragraph.
+VIEWS = {
+    'abs': ('get_abs_tags', 'abs', True),
+    'abs_paras': ('get_abs_tags', 'abs', False),
+    'text': ('get_text_tags', 'text', True),
+    'text_paras': ('get_text_tags', 'text', False),
+}
+
+
+class PassConsumer:
+    """A model fed by a CorpusPass.
+
+    Attributes
+    ----------
+    model: any
+        The model, updated with model.update(id, data), or model.update(data) if with_ids is False.
+    view: str
+        Name of the view the model is fed, see VIEWS
+    tags_filter_fct: Callable, optional
+        Only the tags for which the function returns True are passed to the model
+    tag_attr: str, optional
+        If set, the model is passed the value of this attribute of each tag (e.g. 'lemma') instead of the tags
+    with_ids: bool
+        Whether model.update() takes the ids (DocTermModel, CoocsModel, LexCounter) or only the data (TagCountsModel)
+    """
+
+    def __init__(self, model, view: str, tags_filter_fct: Optional[Callable] = None, tag_attr: Optional[str] = None,
+                 with_ids: bool = True):
+        if view not in VIEWS:
+            raise ValueError(f'Unknown view: {view}. Available views: {list(VIEWS)}')
+        self.model = model
+        self.view = view
+        self.tags_filter_fct = tags_filter_fct
+        self.tag_attr = tag_attr
+        self.with_ids = with_ids
+
+    def feed(self, view_data: list) -> None:
+        for item_id, tags in view_data:
+            data = [tag if self.tag_attr is None else getattr(tag, self.tag_attr)
+                    for tag in tags if self.tags_filter_fct is None or self.tags_filter_fct(tag)]
+            if self.with_ids:
+                self.model.update(item_id, data)
+            else:
+                self.model.update(data)
+
+
+class CorpusPass:
+    """Reads a corpus once and feeds all the registered consumers, see module docstring.
+
+    Attributes
+    ----------
+    source: Path or CorpusStore
+        DocModels folder, or corpus store (see corpus_store.py)
+    where: optional
+        Predicate selecting the documents, see generators.py
+    catalog_path: Path, optional
+        Path to the metadata catalog, needed to use where with a DocModels folder
+    shard_index, num_shards: int
+        Only reads the documents of this shard of the corpus, see utils/sharding.py
+    consumers: dict[str, PassConsumer]
+        The registered consumers, by name
+    """
+
+    def __init__(self, source, where: Where = None, catalog_path=None, shard_index: int = 0, num_shards: int = 1):
+        self.source = source
+        self.where = where
+        self.catalog_path = catalog_path
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.consumers = {}
+
+    def register(self, name: str, model, view: str, tags_filter_fct: Optional[Callable] = None,
+                 tag_attr: Optional[str] = None, with_ids: bool = True) -> None:
+        """Registers a model to feed during the pass. See PassConsumer for the parameters. When running with several
+        workers, models are copied to each worker before the pass, so they should not have been updated yet."""
+
+        self.consumers[name] = PassConsumer(model, view, tags_filter_fct, tag_attr, with_ids)
+
+    def run(self, n_workers: int = 1, chunk_size: int = 500, prefetch: Optional[int] = None) -> dict:
+        """Runs the pass and returns the updated models, by consumer name.
+
+        Args:
+            n_workers: Number of processes. 1 runs everything in the current process, None uses all cores. Ignored
+                with a corpus store, which is read sequentially.
+            chunk_size: Number of DocModels fed to each copy of the models when n_workers > 1
+            prefetch: Max number of chunks processed in advance, defaults to 4 per worker.
+
+        Returns:
+            Dict mapping consumer names to their models
+        """
+
+        print(f'Starting a corpus pass for {len(self.consumers)} models ({", ".join(self.consumers)})...')
+        store = as_corpus_store(self.source)
+        if store is not None:
+            for i in store.doc_indices(metadata_filter(self.where, self.shard_index, self.num_shards)):
+                self._feed_all(self.consumers, partial(_store_view, store, i))
+        else:
+            paths = [path for path in select_docmodel_paths(self.source, self.where, self.catalog_path,
+                                                            self.shard_index, self.num_shards)
+                     if path.suffix == '.p']
+            if n_workers == 1:
+                _feed_paths(self.consumers, paths)
+            else:
+                chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+                blank = {name: copy.deepcopy(consumer) for name, consumer in self.consumers.items()}
+                partials = bounded_imap(partial(_feed_chunk, blank), chunks, n_workers=n_workers, max_pending=prefetch)
+                for i, chunk_consumers in enumerate(partials):
+                    for name, consumer in self.consumers.items():
+                        consumer.model.merge(chunk_consumers[name].model)
+                    if (i+1) % 20 == 0:
+                        print(f'Merged {min((i+1) * chunk_size, len(paths))} docmodels...')
+        print('Corpus pass done!')
+        return {name: consumer.model for name, consumer in self.consumers.items()}
+
+    @staticmethod
+    def _feed_all(consumers: dict, get_view: Callable) -> None:
+        views = {}
+        for consumer in consumers.values():
+            if consumer.view not in views:
+                views[consumer.view] = get_view(consumer.view)
+            consumer.feed(views[consumer.view])
+
+
+def _docmodel_view(dm: DocModel, view: str) -> list:
+    getter, _, flatten = VIEWS[view]
+    if flatten:
+        return [(dm.get_id(), getattr(dm, getter)(flatten=True))]
+    return [(f'{dm.get_id()}_{i}', para) for i, para in enumerate(getattr(dm, getter)(flatten=False))]
+
+
+def _store_view(store: CorpusStore, i: int, view: str) -> list:
+    _, section, flatten = VIEWS[view]
+    if flatten:
+        return [(store.ids[i], store.decode(store.doc_tokens(section, i)))]
+    return [(f'{store.ids[i]}_{j}', store.decode(ids)) for j, ids in enumerate(store.doc_paragraphs(section, i))]
+
+
+def _feed_paths(consumers: dict, paths: list) -> None:
+    for i, path in enumerate(paths):
+        try:
+            dm = DocModel.read_pickle(path)
+        except EOFError:
+            print(f'ERROR! Could not open docmodel at: {path}')
+            continue
+        CorpusPass._feed_all(consumers, partial(_docmodel_view, dm))
+        if (i+1) % 5000 == 0:
+            print(f'Processed {i+1} docmodels')
+
+
+def _feed_chunk(blank_consumers: dict, paths: list) -> dict:
+    """Pool task, feeds a chunk of DocModels to fresh copies of the consumers and returns them"""
+
+    consumers = copy.deepcopy(blank_consumers)
+    _feed_paths(consumers, paths)
+    return consumers
@@ -0,0 +1,305 @@
+"""Columnar corpus store, packing the tags and metadata of all DocModels in a few large files.
+
+Reading the corpus from the DocModels folder means one open() and one pickle.load() per document, on every pass. The
+store holds the same data in a handful of files which are memory-mapped and scanned sequentially:
+
+    meta.json              Store format, document ids and metadata (see DocModel.metadata_to_dict), in corpus order
+    token_vocab.p          TokenVocab mapping token type ids to Tags (see compact_tags.py)
+    {section}_tokens.bin   int32, token type ids of all the paragraphs of the section, document after document
+    {section}_paras.bin    int64, offsets of the paragraphs in {section}_tokens.bin (n_paragraphs + 1 values)
+    {section}_docs.bin     int64, offsets of the documents in {section}_paras.bin (n_docs + 1 values)
+    {section}_sents.bin    int64, positions of the sentence ends (SENT tokens) in {section}_tokens.bin
+    {section}_doc_sents.bin int64, offsets of the documents in {section}_sents.bin (n_docs + 1 values)
+
+with section being 'abs' or 'text'. Token arrays returned by the store are views on the memory-mapped files, no copy is
+made until tags or lemmas are decoded.
+
+The store is built once from the DocModels (see build_corpus_store()), and can then be passed to the generators in
+utils/generators.py instead of the DocModels folder.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from srs.lib.compact_tags import TokenVocab
+from srs.lib.docmodel import DocModel
+from srs.lib.utils.parallel import bounded_imap
+
+STORE_FORMAT = 1
+SECTIONS = ('abs', 'text')
+META_FILENAME = 'meta.json'
+VOCAB_FILENAME = 'token_vocab.p'
+SENT_POS = 'SENT'
+# Metadata kept in the store on top of DocModel.metadata_to_dict()
+EXTRA_METADATA = ('filename', 'abs_tokens', 'text_tokens', 'abs_words', 'text_words')
+
+
+class CorpusStoreWriter:
+    """Appends documents to a new corpus store. Use as a context manager, or call close() once all documents are added.
+
+    Attributes
+    ----------
+    path: Path
+        Folder of the store. Created if needed, and should not already hold a store.
+    vocab: TokenVocab
+        Vocab used to encode the tags, saved in the store folder.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if CorpusStore.is_store(self.path):
+            raise FileExistsError(f'A corpus store already exists at {self.path}')
+        self.vocab = TokenVocab(self.path / VOCAB_FILENAME)
+        self.docs = []
+        self._sent_mask = np.zeros(0, dtype=bool)
+        self._files = {}
+        self._n_tokens = {}
+        self._n_paras = {}
+        self._n_sents = {}
+        for section in SECTIONS:
+            for array in ('tokens', 'paras', 'docs', 'sents', 'doc_sents'):
+                self._files[section, array] = open(self.path / f'{section}_{array}.bin', 'wb')
+            self._n_tokens[section] = self._n_paras[section] = self._n_sents[section] = 0
+            self._write(section, 'paras', [0])
+            self._write(section, 'docs', [0])
+            self._write(section, 'doc_sents', [0])
+
+    def add(self, metadata: dict, abs_paragraphs: Optional[Iterable], text_paragraphs: Optional[Iterable]) -> None:
+        """Appends a document to the store.
+
+        Args:
+            metadata: Dict of json-serializable values, must hold an 'id' key. See docmodel_metadata().
+            abs_paragraphs: Abstract tags, as [[para1 Tags], [para2 Tags], ...] or CompactTags. None if not tagged.
+            text_paragraphs: Text tags, same format as abs_paragraphs.
+        """
+
+        for section, paragraphs in zip(SECTIONS, (abs_paragraphs, text_paragraphs)):
+            encoded = [self.vocab.encode(para) for para in paragraphs or []]
+            lengths = np.array([len(ids) for ids in encoded], dtype=np.int64)
+            ids = np.concatenate(encoded) if encoded else np.zeros(0, dtype=np.int32)
+
+            self._write(section, 'tokens', ids.astype(np.int32))
+            self._write(section, 'paras', self._n_tokens[section] + np.cumsum(lengths))
+            sents = self._n_tokens[section] + np.flatnonzero(self._get_sent_mask()[ids])
+            self._write(section, 'sents', sents)
+
+            self._n_tokens[section] += len(ids)
+            self._n_paras[section] += len(encoded)
+            self._n_sents[section] += len(sents)
+            self._write(section, 'docs', [self._n_paras[section]])
+            self._write(section, 'doc_sents', [self._n_sents[section]])
+        self.docs.append(metadata)
+
+    def add_docmodel(self, dm: DocModel) -> None:
+        self.add(docmodel_metadata(dm), dm.tt_abs_paragraphs, dm.tt_text_paragraphs)
+
+    def close(self) -> None:
+        """Flushes the arrays, then saves the vocab and the metadata. The store is only valid once closed."""
+
+        for f in self._files.values():
+            f.close()
+        self.vocab.save()
+        meta = {'format': STORE_FORMAT, 'n_docs': len(self.docs), 'docs': self.docs}
+        tmp_path = self.path / (META_FILENAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.path / META_FILENAME)
+
+    def _write(self, section: str, array: str, values) -> None:
+        np.asarray(values, dtype=np.int32 if array == 'tokens' else np.int64).tofile(self._files[section, array])
+
+    def _get_sent_mask(self) -> np.ndarray:
+        """Boolean array indexed by token type ids, True for sentence ends. Grows with the vocab."""
+
+        if len(self._sent_mask) != len(self.vocab):
+            self._sent_mask = self.vocab.pos_mask([SENT_POS])
+        return self._sent_mask
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self._files.values():
+                f.close()
+
+
+class CorpusStore:
+    """Read-only access to a corpus store. Documents are indexed by their position in the store (corpus order).
+
+    Attributes
+    ----------
+    path: Path
+        Folder of the store
+    vocab: TokenVocab
+        Vocab used to decode the token type ids
+    ids: list[str]
+        Document ids, in store order
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / META_FILENAME, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['format'] != STORE_FORMAT:
+            raise ValueError(f'Unsupported corpus store format {meta["format"]} at {self.path}')
+        self.docs = meta['docs']
+        self.ids = [doc['id'] for doc in self.docs]
+        self._index = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.vocab = TokenVocab.load(self.path / VOCAB_FILENAME)
+        self._arrays = {}
+        self._lemmas = None
+
+    @staticmethod
+    def is_store(path) -> bool:
+        """Whether path is the folder of a corpus store (as opposed to a DocModels folder)"""
+
+        return isinstance(path, CorpusStore) or (path is not None and os.path.isfile(Path(path) / META_FILENAME))
+
+    ### Arrays and offsets ###
+
+    def array(self, section: str, array: str) -> np.ndarray:
+        """Returns one of the store arrays (see module docstring), memory-mapped"""
+
+        if (section, array) not in self._arrays:
+            file_path = self.path / f'{section}_{array}.bin'
+            dtype = np.int32 if array == 'tokens' else np.int64
+            if os.path.getsize(file_path) == 0:
+                self._arrays[section, array] = np.zeros(0, dtype=dtype)  # Empty files can't be memory-mapped
+            else:
+                self._arrays[section, array] = np.memmap(file_path, dtype=dtype, mode='r')
+        return self._arrays[section, array]
+
+    def doc_token_range(self, section: str, i: int) -> tuple[int, int]:
+        docs, paras = self.array(section, 'docs'), self.array(section, 'paras')
+        return int(paras[docs[i]]), int(paras[docs[i + 1]])
+
+    def doc_tokens(self, section: str, i: int) -> np.ndarray:
+        """Token type ids of document i, all paragraphs included"""
+
+        start, end = self.doc_token_range(section, i)
+        return self.array(section, 'tokens')[start:end]
+
+    def doc_paragraphs(self, section: str, i: int) -> list[np.ndarray]:
+        """Token type ids of each paragraph of document i"""
+
+        docs, paras, tokens = self.array(section, 'docs'), self.array(section, 'paras'), self.array(section, 'tokens')
+        bounds = paras[docs[i]:docs[i + 1] + 1].tolist()
+        return [tokens[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def doc_sentences(self, section: str, i: int) -> list[np.ndarray]:
+        """Token type ids of each sentence of document i, without the SENT tokens. Tokens following the last sentence
+        end are left out, as in DocModel.get_text_sentences_tags()."""
+
+        doc_sents, tokens = self.array(section, 'doc_sents'), self.array(section, 'tokens')
+        ends = self.array(section, 'sents')[doc_sents[i]:doc_sents[i + 1]].tolist()
+        starts = [self.doc_token_range(section, i)[0]] + [end + 1 for end in ends[:-1]]
+        return [tokens[start:end] for start, end in zip(starts, ends)]
+
+    ### Decoding ###
+
+    def decode(self, ids: np.ndarray) -> list:
+        return self.vocab.decode(ids)
+
+    def decode_lemmas(self, ids: np.ndarray) -> list[str]:
+        """Returns the lemma of each token, without building the Tags"""
+
+        if self._lemmas is None:
+            self._lemmas = np.array(self.vocab.lemmas, dtype=object)[self.vocab.type_lemmas]
+        return self._lemmas[ids].tolist()
+
+    def metadata(self, i: int) -> dict:
+        return self.docs[i]
+
+    def index_of(self, doc_id: str) -> int:
+        return self._index[doc_id]
+
+    ### Generators ###
+
+    def doc_indices(self, doc_filter_fct: Optional[Callable] = None) -> list[int]:
+        """Indices of the documents whose metadata dict passes doc_filter_fct (all documents if None)"""
+
+        return [i for i, doc in enumerate(self.docs) if doc_filter_fct is None or doc_filter_fct(doc)]
+
+    def generate_ids_tags(self, section: str, flatten: bool = True, doc_filter_fct: Optional[Callable] = None,
+                          tags_filter_fct: Optional[Callable] = None):
+        """Yields (id, [tags]) pairs like generators.generate_ids_tags(). If flatten is False, yields paragraphs with
+        id [doc_id]_[para_num].
+
+        Args:
+            section: 'abs' or 'text'
+            flatten: Whether to yield whole documents or paragraphs
+            doc_filter_fct: None or a function taking a metadata dict and returning a bool
+            tags_filter_fct: None or a function taking a Tag and returning a bool
+        """
+
+        for i in self.doc_indices(doc_filter_fct):
+            chunks = [self.doc_tokens(section, i)] if flatten else self.doc_paragraphs(section, i)
+            for j, ids in enumerate(chunks):
+                tags = self.decode(ids)
+                if tags_filter_fct is not None:
+                    tags = [tag for tag in tags if tags_filter_fct(tag)]
+                yield (self.ids[i] if flatten else f'{self.ids[i]}_{j}'), tags
+
+    def generate_para_lemmas(self, section: str = 'text', doc_filter_fct: Optional[Callable] = None):
+        """Yields (para_id, [lemmas]) pairs, like generators.generate_para_lemmas()"""
+
+        for i in self.doc_indices(doc_filter_fct):
+            for j, ids in enumerate(self.doc_paragraphs(section, i)):
+                yield f'{self.ids[i]}_{j}', self.decode_lemmas(ids)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __repr__(self):
+        return f'CorpusStore({self.path}, {len(self)} docs)'
+
+
+def docmodel_metadata(dm: DocModel) -> dict:
+    """Metadata kept in the store for each document: DocModel.metadata_to_dict() plus the filename and lengths"""
+
+    metadata = dm.metadata_to_dict()
+    metadata.update({key: getattr(dm, key) for key in EXTRA_METADATA})
+    return metadata
+
+
+def build_corpus_store(dm_path: Path, store_path: Path, n_workers: int = 1) -> CorpusStore:
+    """Packs all the DocModels of a folder in a new corpus store.
+
+    DocModels are added in sorted filename order, so the store doesn't depend on the file system.
+
+    Args:
+        dm_path: Folder holding the pickled DocModels
+        store_path: Folder of the new store, should not already hold a store
+        n_workers: Number of processes used to read the DocModels. 1 reads them in the current process.
+
+    Returns:
+        The new CorpusStore
+    """
+
+    dm_paths = sorted(dm_path / f for f in os.listdir(dm_path) if f.endswith('.p'))
+    print(f'Packing {len(dm_paths)} docmodels in a corpus store at {store_path}...')
+    docs_data = map(_read_docmodel_data, dm_paths) if n_workers == 1 \
+        else bounded_imap(_read_docmodel_data, dm_paths, n_workers=n_workers)
+    with CorpusStoreWriter(store_path) as writer:
+        for i, (metadata, abs_paragraphs, text_paragraphs) in enumerate(docs_data):
+            writer.add(metadata, abs_paragraphs, text_paragraphs)
+            if (i+1) % 10000 == 0:
+                print(f'Packed {i+1} docmodels...')
+    print('Done!')
+    return CorpusStore(store_path)
+
+
+def _read_docmodel_data(dm_path: Path) -> tuple:
+    """Returns (metadata, abstract tags, text tags) of a pickled DocModel, with tags as lists of tuples"""
+
+    dm = DocModel.read_pickle(dm_path)
+    return (docmodel_metadata(dm),
+            [[tuple(tag) for tag in para] for para in dm.tt_abs_paragraphs or []],
+            [[tuple(tag) for tag in para] for para in dm.tt_text_paragraphs or []])
@@ -2,14 +2,41 @@
 
 These objects hold the metadata and text data for each documents, so the original corpus files should not be needed once the DocModels are generated.
 All "extract_..." methods were built specifically to work with BioMed XML files, and will need tweeking to work with different source material.
+
+DocModel files are split in sections: a header pickle holding the metadata, followed by one pickle per section (the
+xml tree, the raw paragraphs and the tags, see SECTIONS). Only the header is read when a DocModel is loaded, and each
+section is read from the file the first time one of its attributes is accessed. Files saved as a single pickle (before
+sections were introduced) can still be read, and are fully loaded. Sections can be compressed with one of the CODECS.
 """
 
+import bz2
+import gzip
+import lzma
 import pickle
 import os
-from treetaggerwrapper import make_tags
+from pathlib import Path
 
 
 from srs.lib.nlp_params import TT_EXCLUDED_TAGS
+from srs.lib.preprocess.tagging import tag_paragraphs
+from srs.lib.compact_tags import CompactTags
+
+# Attributes stored in each lazily loaded section of the DocModel files, in file order
+SECTIONS = {
+    'tree': ('tree',),
+    'raw': ('raw_abs_paragraphs', 'raw_text_paragraphs'),
+    'tags': ('tt_abs_paragraphs', 'tt_text_paragraphs'),
+}
+_ATTR_SECTIONS = {attr: section for section, attrs in SECTIONS.items() for attr in attrs}
+PICKLE_PROTOCOL = 5
+
+# Compression codecs available for the sections, as (compress, decompress) functions
+CODECS = {
+    None: (lambda data: data, lambda data: data),
+    'gzip': (lambda data: gzip.compress(data, mtime=0), gzip.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
 
 
 class DocModel:
@@ -50,7 +77,7 @@ class DocModel:
         self.raw_text_paragraphs = None
         self.raw_abs_paragraphs = None
 
-        # TreeTagger tags
+        # TreeTagger tags, as [[para1 Tags], [para2 Tags], ...] lists or as CompactTags (see compact_tags.py)
         self.tt_text_paragraphs = None
         self.tt_abs_paragraphs = None
 
@@ -61,6 +88,8 @@ class DocModel:
         self.abs_words = None
         self.text_words = None
 
+        # Compression codec of the sections when saved (see CODECS)
+        self.file_codec = None
 
         # extract and save on creation
         if extract_metadata_on_init:
@@ -114,12 +143,12 @@ class DocModel:
     def get_text_tags(self, flatten=False):
         """Get text tags as 2d list [[para1 Tags], [para2 Tags], ...]"""
 
-        return self.tt_text_paragraphs if not flatten else sum(self.tt_text_paragraphs, [])
+        return self.tt_text_paragraphs if not flatten else self._flatten_tags(self.tt_text_paragraphs)
 
     def get_abs_tags(self, flatten=False):
         """Get abstract tags as 2d list [[para1 Tags], [para2 Tags], ...]"""
 
-        return self.tt_abs_paragraphs if not flatten else sum(self.tt_abs_paragraphs, [])
+        return self.tt_abs_paragraphs if not flatten else self._flatten_tags(self.tt_abs_paragraphs)
 
     def get_text_sentences_tags(self, *args, **kwargs):
         s = []
@@ -277,11 +306,19 @@ class DocModel:
     def extract_text(self, trash_sections):
         self.raw_text_paragraphs = self.extract_content_paragraphs('bdy', trash_sections)
 
-    def treetag_abstract(self, tagger):
-        self.tt_abs_paragraphs = self.treetag_paragraphs(self.raw_abs_paragraphs, tagger)
+    def treetag_abstract(self, tagger, batch_size=None, cache=None):
+        self.tt_abs_paragraphs = self.treetag_paragraphs(self.raw_abs_paragraphs, tagger, batch_size, cache)
+
+    def treetag_text(self, tagger, batch_size=None, cache=None):
+        self.tt_text_paragraphs = self.treetag_paragraphs(self.raw_text_paragraphs, tagger, batch_size, cache)
 
-    def treetag_text(self, tagger):
-        self.tt_text_paragraphs = self.treetag_paragraphs(self.raw_text_paragraphs, tagger)
+    def treetag_abstract_and_text(self, tagger, batch_size=None, cache=None):
+        """Tags the abstract and text paragraphs together, so a whole document can be sent to the tagger at once"""
+
+        tags = self.treetag_paragraphs(self.raw_abs_paragraphs + self.raw_text_paragraphs, tagger, batch_size, cache)
+        n_abs = len(self.raw_abs_paragraphs)
+        self.tt_abs_paragraphs = tags[:n_abs]
+        self.tt_text_paragraphs = tags[n_abs:]
 
     def make_token_counts(self):
 
@@ -291,6 +328,14 @@ class DocModel:
         self.abs_words = len([t for t in self.get_abs_tags(True) if t.pos not in TT_EXCLUDED_TAGS])
         self.text_words = len([t for t in self.get_text_tags(True) if t.pos not in TT_EXCLUDED_TAGS])
 
+    def compact_tags(self, vocab):
+        """Replaces the Tag lists by CompactTags, using the passed TokenVocab. See compact_tags.py"""
+
+        if self.tt_abs_paragraphs is not None and not isinstance(self.tt_abs_paragraphs, CompactTags):
+            self.tt_abs_paragraphs = CompactTags.from_paragraphs(self.tt_abs_paragraphs, vocab)
+        if self.tt_text_paragraphs is not None and not isinstance(self.tt_text_paragraphs, CompactTags):
+            self.tt_text_paragraphs = CompactTags.from_paragraphs(self.tt_text_paragraphs, vocab)
+
     ### work and process methods ###
 
 
@@ -319,14 +364,22 @@ class DocModel:
     # Process chaque paragraphe avec TreeTagger pour les transformer en listes de tags
     # Prend une liste [str, str, str,str]
     # Retourne une liste [ [tag, tag, tag], [tag, tag, tag] ]
-    def treetag_paragraphs(self, paragraphs, tagger):
+    # Si batch_size est spécifié, les paragraphes sont envoyés à TreeTagger par lots (voir preprocess/tagging.py)
+    # Si un TagCache est passé, seuls les paragraphes absents du cache sont envoyés à TreeTagger
+    def treetag_paragraphs(self, paragraphs, tagger, batch_size=None, cache=None):
         try:
-            tt_tags = [make_tags(tagger.tag_text(para.lower()), exclude_nottags=True) for para in paragraphs]
+            tt_tags = tag_paragraphs(tagger, paragraphs, batch_size, cache)
         except:
             print(f'Treetagging error on id: {self.id}')
             tt_tags = []
         return tt_tags
 
+    @staticmethod
+    def _flatten_tags(paragraphs):
+        if isinstance(paragraphs, CompactTags):
+            return paragraphs.flatten()
+        return sum(paragraphs, [])
+
     def _bibl_metadata_extractor(self, tag: str):
         try:
             return self.tree.getroot()[2][1].find(tag).text.lower().strip()
@@ -335,8 +388,79 @@ class DocModel:
             return 'error'
 
     def to_pickle(self, destination=None):
-        save_to = destination if destination else self.file_path
-        pickle.dump(self, open(save_to, 'wb'))
+        """Saves the DocModel as a header pickle followed by a pickle for each section (see SECTIONS), compressed with
+        self.file_codec. The file is written under a temporary name, then atomically replaces the destination."""
+
+        save_to = Path(destination if destination else self.file_path)
+        data = self.to_bytes()
+        tmp_path = save_to.with_name(f'.{save_to.name}.tmp')  # Hidden, so it is ignored by the generators
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, save_to)
+
+    def to_bytes(self):
+        """Returns the content of the DocModel file, see to_pickle()"""
+
+        codec = getattr(self, 'file_codec', None)
+        compress = CODECS[codec][0]
+        state = self.__getstate__()
+        sections = {section: compress(pickle.dumps({attr: state.pop(attr, None) for attr in attrs},
+                                                   protocol=PICKLE_PROTOCOL))
+                    for section, attrs in SECTIONS.items()}
+        spans, offset = {}, 0
+        for section, data in sections.items():
+            spans[section] = (offset, offset + len(data), codec)
+            offset += len(data)
+        return pickle.dumps(_DocModelHeader(state, spans), protocol=PICKLE_PROTOCOL) + b''.join(sections.values())
+
+    ### Lazy sections ###
+
+    def load_sections(self):
+        """Loads all the sections not loaded yet, so the DocModel no longer depends on its file"""
+
+        for section in list(self.__dict__.get('_section_spans', ())):
+            self._load_section(section)
+
+    def _load_section(self, section):
+        spans = self.__dict__['_section_spans']
+        if any(attr not in self.__dict__ for attr in SECTIONS[section]):
+            path, base, mtime = self._get_source()
+            start, end, codec = spans[section]
+            with open(path, 'rb') as f:
+                if os.stat(f.fileno()).st_mtime_ns != mtime:
+                    raise RuntimeError(f'DocModel file {path} was modified after the DocModel was loaded, '
+                                       f'call load_sections() before rewriting it')
+                f.seek(base + start)
+                values = pickle.loads(CODECS[codec][1](f.read(end - start)))
+            for attr, value in values.items():
+                self.__dict__.setdefault(attr, value)  # Keep values set since the DocModel was loaded
+        del spans[section]
+        if not spans:
+            del self.__dict__['_section_spans']
+            self.__dict__.pop('_source', None)
+
+    def _get_source(self):
+        """Returns the path of the file the DocModel was read from, the position where its sections start and the file
+        modification time"""
+
+        if '_source' not in self.__dict__:
+            # Loaded by a plain pickle.load(), assume the file is still at file_path
+            with open(self.file_path, 'rb') as f:
+                pickle.load(f)
+                self.__dict__['_source'] = (self.file_path, f.tell(), os.stat(f.fileno()).st_mtime_ns)
+        return self.__dict__['_source']
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, i.e. those of sections not loaded yet
+        section = _ATTR_SECTIONS.get(name)
+        if section is None or section not in self.__dict__.get('_section_spans', ()):
+            raise AttributeError(f"'DocModel' object has no attribute '{name}'")
+        self._load_section(section)
+        return self.__dict__[name]
+
+    def __getstate__(self):
+        self.load_sections()
+        return self.__dict__.copy()
 
     def metadata_to_dict(self):
         return {
@@ -385,25 +509,48 @@ class DocModel:
 
     @classmethod
     def read_pickle(cls, path):
-        return pickle.load(open(path, 'rb'))
+        """Reads the header of a DocModel file, sections are loaded on access"""
+
+        with open(path, 'rb') as f:
+            dm = pickle.load(f)
+            if '_section_spans' in dm.__dict__:
+                dm.__dict__['_source'] = (Path(path), f.tell(), os.stat(f.fileno()).st_mtime_ns)
+        return dm
 
     @classmethod
     def docmodel_generator(cls, path, vocal=True, conditions=None):
-        for i, filename in enumerate(os.listdir(path)):
+        for i, filename in enumerate(sorted(os.listdir(path))):
             if filename.split('.')[1] != 'p':
                 print(f'Ignored [{filename}] due to wrong file extension')
                 continue
-            with open(path / filename, 'rb') as f:
-                try:
-                    dm = pickle.load(f)
-                    if not conditions or conditions(dm):
-                        yield dm
-                except EOFError:
-                    print(f'Generator error on file: {filename}')
+            try:
+                dm = cls.read_pickle(path / filename)
+                if not conditions or conditions(dm):
+                    yield dm
+            except EOFError:
+                print(f'Generator error on file: {filename}')
             if vocal and i % 5000 == 0:
                 print(f'Generating {i}th docmodel')
 
 
+class _DocModelHeader:
+    """Pickled at the start of DocModel files, unpickles as a DocModel holding everything but the sections"""
+
+    def __init__(self, state, spans):
+        self.state = state
+        self.spans = spans
+
+    def __reduce__(self):
+        return _docmodel_from_header, (self.state, self.spans)
+
+
+def _docmodel_from_header(state, spans):
+    dm = DocModel.__new__(DocModel)
+    dm.__dict__.update(state)
+    dm.__dict__['_section_spans'] = spans
+    return dm
+
+
 if __name__ == '__main__':
     pass
     # test_path = SUB_K_DOCMODELS_DIR
@@ -1,5 +1,5 @@
 from srs.lib.utils.examples_tests_utils import generate_test_id_tags
-from srs.lib.models import DocTermModel
+from srs.lib.models.docterm import DocTermModel
 from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
 
 
@@ -0,0 +1,75 @@
+"""Unit tests for the association measures over CoocsModel counts"""
+import math
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from srs.lib.models.association import CoocCounts, MEASURES, association_scores
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.examples_tests_utils import generate_test_id_tags
+
+
+class AssociationTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.paras = list(generate_test_id_tags(OFFICE_TEST_SENTENCES))
+        self.cm = CoocsModel(['i', 'asd', 'office'], window=3, flush_every=5)
+        for para_id, tags in self.paras:
+            self.cm.update(para_id, tags)
+        self.counts = self.cm.as_cooc_counts(sort=True)
+
+    def test_counts_match_df(self):
+        df = self.cm.as_df(sort=True)
+        self.assertEqual(self.counts.words.tolist(), list(df.columns))
+        self.assertEqual(self.counts.terms.tolist(), list(df.index))
+        np.testing.assert_array_equal(self.counts.matrix.toarray(), np.nan_to_num(df.to_numpy().T))
+        self.assertEqual(self.cm.n_tokens, sum(len(tags) for _, tags in self.paras))
+
+    def test_scores_keep_sparsity(self):
+        for measure in MEASURES:
+            scores = self.counts.scores(measure)
+            self.assertEqual(scores.nnz, self.counts.matrix.nnz, measure)
+            self.assertTrue(np.isfinite(scores.data).all(), measure)
+        npmi = self.counts.scores('npmi').data
+        self.assertTrue(((npmi >= -1 - 1e-9) & (npmi <= 1 + 1e-9)).all())
+
+    def test_contingency_table(self):
+        # o11=10, r1=20, c1=30, n=1000: e11=0.6
+        expected = {'count': 10, 'pmi': math.log2(10 / 0.6), 't_score': (10 - 0.6) / math.sqrt(10),
+                    'chi2': 1000 * (10 * 960 - 10 * 20) ** 2 / (20 * 980 * 30 * 970)}
+        for measure, value in expected.items():
+            self.assertAlmostEqual(association_scores(measure, [10], [20], [30], 1000)[0], value, msg=measure)
+        self.assertGreater(association_scores('log_likelihood', [10], [20], [30], 1000)[0], 0)
+        self.assertLess(association_scores('log_likelihood', [1], [20], [300], 1000)[0], 0)
+
+    def test_top_k_counts(self):
+        df = self.cm.as_df(sort=True)
+        top = self.counts.top_k('count', k=3)
+        for word, pairs in top.items():
+            self.assertEqual([term for term, _ in pairs], list(df[word].nlargest(3).dropna().index))
+        for pairs in self.counts.top_k('pmi', k=5, min_count=2).values():
+            self.assertLessEqual(len(pairs), 5)
+
+    def test_merge_and_npz(self):
+        a, b = CoocsModel(['i', 'asd', 'office'], window=3), CoocsModel(['i', 'asd', 'office'], window=3)
+        for i, (para_id, tags) in enumerate(self.paras):
+            (a if i % 2 else b).update(para_id, tags)
+        a.merge(b)
+        merged = a.as_cooc_counts(sort=True)
+        np.testing.assert_array_equal(merged.term_counts, self.counts.term_counts)
+        self.assertEqual(merged.n_tokens, self.counts.n_tokens)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'cooc_counts_test.npz'
+            self.counts.save_npz(path)
+            loaded = CoocCounts.load_npz(path)
+        self.assertEqual((loaded.matrix != self.counts.matrix).nnz, 0)
+        self.assertEqual(loaded.terms.tolist(), self.counts.terms.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""Unit tests for the metadata catalog (catalog.py)"""
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.catalog import DocCatalog, OPERATORS, matches, where_to_sql
+from srs.lib.docmodel import DocModel
+from srs.lib.utils.generators import select_docmodel_paths
+
+
+class WhereToSqlTests(unittest.TestCase):
+
+    def test_operators(self):
+        for op in OPERATORS:
+            self.assertEqual(where_to_sql({'year': (op, '2010')}), (f' WHERE year {op.upper()} ?', ('2010',)))
+
+    def test_values(self):
+        self.assertEqual(where_to_sql(None), ('', ()))
+        self.assertEqual(where_to_sql({}), ('', ()))
+        self.assertEqual(where_to_sql({'source': 'bmc genomics'}), (' WHERE source = ?', ('bmc genomics',)))
+        self.assertEqual(where_to_sql({'year': ['2010', '2011']}), (' WHERE year IN (?, ?)', ('2010', '2011')))
+        self.assertEqual(where_to_sql({'year': []}), (' WHERE 0', ()))
+        self.assertEqual(where_to_sql({'year': ('>=', '2010'), 'abs_words': ('<', 150), 'doctype': 'review'}),
+                         (' WHERE year >= ? AND abs_words < ? AND doctype = ?', ('2010', 150, 'review')))
+        self.assertEqual(where_to_sql('year >= ?', ['2010']), (' WHERE year >= ?', ('2010',)))
+
+    def test_typed_values(self):
+        # Values are converted to the type of their column, as sqlite does
+        self.assertEqual(where_to_sql({'year': ('>=', 2010), 'abs_words': ('<', '150')}),
+                         (' WHERE year >= ? AND abs_words < ?', ('2010', 150)))
+        self.assertEqual(where_to_sql({'year': [2010, '2011'], 'mtime': ('>', '1.5')}),
+                         (' WHERE year IN (?, ?) AND mtime > ?', ('2010', '2011', 1.5)))
+        self.assertEqual(where_to_sql({'year': None}), (' WHERE year IS NULL', ()))
+        self.assertEqual(where_to_sql({'year': ['2010', None]}), (' WHERE (year IN (?) OR year IS NULL)', ('2010',)))
+        self.assertTrue(matches({'year': ('>=', 2010), 'abs_words': ('<', '150')}, {'year': '2012', 'abs_words': 90}))
+        self.assertTrue(matches({'year': None}, {'year': None}))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            where_to_sql({'unknown': '2010'})
+        with self.assertRaises(ValueError):
+            where_to_sql({'year': ('in', '2010')})
+        for where in ({'abs_words': ('>', 'many')}, {'year': ('<', None)}):
+            with self.assertRaises(ValueError):
+                where_to_sql(where)
+            with self.assertRaises(ValueError):
+                matches(where, {'year': '2010', 'abs_words': 100})
+        with self.assertRaises(TypeError):
+            matches('year >= 2010', {'year': '2011'})
+        with self.assertRaises(ValueError):
+            matches({'year': ('like', '201%')}, {'year': '2011'})
+
+
+class CatalogFilterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        work_path = Path(self.tmp_dir.name)
+        self.catalog_path = work_path / 'catalog.sqlite'
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(work_path, 12, min_paras=6, max_paras=10,
+                                                     catalog_path=self.catalog_path)
+        self.docmodels = {path.name: DocModel.read_pickle(path) for path in sorted(self.dm_path.glob('*.p'))}
+        self.catalog = DocCatalog(self.catalog_path)
+
+    @classmethod
+    def tearDownClass(self) -> None:
+        self.catalog.close()
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def metadata(dm: DocModel) -> dict:
+        return dict(dm.metadata_to_dict(), abs_tokens=dm.abs_tokens, text_tokens=dm.text_tokens,
+                    abs_words=dm.abs_words, text_words=dm.text_words)
+
+    def test_rows(self):
+        self.assertEqual(len(self.catalog), len(self.docmodels))
+        for row in self.catalog.rows():
+            expected = self.metadata(self.docmodels[row['filename']])
+            for column in ('id', 'title', 'source', 'doctype', 'year', 'abs_words', 'text_tokens'):
+                self.assertEqual(row[column], expected[column])
+
+    def test_same_selection_as_matches(self):
+        # Rows of the catalog, plus a document without metadata
+        with tempfile.TemporaryDirectory() as tmp:
+            catalog = DocCatalog(Path(tmp) / 'catalog.sqlite')
+            rows = self.catalog.rows()
+            empty = {column: None for column in rows[0]}
+            empty.update(filename='empty.p', abs_words=0, mtime=0.0)
+            catalog.record(rows + [empty])
+            rows = catalog.rows()
+            years = sorted(row['year'] for row in rows if row['year'] is not None)
+            predicates = [
+                {'year': ('>=', int(years[len(years) // 2]))},
+                {'year': ('!=', int(years[0]))},
+                {'year': [int(years[0]), years[-1], None]},
+                {'year': None},
+                {'source': None, 'abs_words': ('<', '1')},
+                {'abs_words': ('>', str(rows[0]['abs_words'])), 'year': ('<=', float(years[-1]))},
+                {'abs_words': [str(row['abs_words']) for row in rows[:3]]},
+                {'mtime': ('>', '0')},
+                {'title': rows[0]['title']},
+            ]
+            for where in predicates:
+                with self.subTest(where=where):
+                    self.assertEqual(catalog.filenames(where), [row['filename'] for row in rows if matches(where, row)])
+            self.assertEqual(catalog.filenames({'year': None}), ['empty.p'])
+            catalog.close()
+
+    def test_same_selection_as_docmodels(self):
+        years = sorted(dm.year for dm in self.docmodels.values())
+        abs_words = sorted(dm.abs_words for dm in self.docmodels.values())
+        sources = sorted({dm.source for dm in self.docmodels.values()})
+        median_year, median_words = years[len(years) // 2], abs_words[len(abs_words) // 2]
+        # Predicates, and the same selection evaluated on the DocModels attributes
+        predicates = [
+            ({'year': ('=', median_year)}, lambda dm: dm.year == median_year),
+            ({'year': ('!=', median_year)}, lambda dm: dm.year != median_year),
+            ({'year': ('<', median_year)}, lambda dm: dm.year < median_year),
+            ({'year': ('<=', median_year)}, lambda dm: dm.year <= median_year),
+            ({'year': ('>', median_year)}, lambda dm: dm.year > median_year),
+            ({'year': ('>=', median_year)}, lambda dm: dm.year >= median_year),
+            ({'abs_words': ('>=', median_words)}, lambda dm: dm.abs_words >= median_words),
+            ({'source': sources[::2]}, lambda dm: dm.source in sources[::2]),
+            ({'source': []}, lambda dm: False),
+            ({'doctype': 'research article', 'year': ('>', years[0]), 'abs_words': ('<', median_words)},
+             lambda dm: dm.doctype == 'research article' and dm.year > years[0] and dm.abs_words < median_words),
+            ({'year': 'unknown'}, lambda dm: False),
+            (None, lambda dm: True),
+        ]
+        for where, select in predicates:
+            expected = [name for name, dm in self.docmodels.items() if select(dm)]
+            with self.subTest(where=where):
+                self.assertEqual(self.catalog.filenames(where), expected)
+                self.assertEqual([name for name, dm in self.docmodels.items() if matches(where, self.metadata(dm))],
+                                 expected)
+                if where is not None:
+                    self.assertEqual(select_docmodel_paths(self.dm_path, where, self.catalog_path),
+                                     [self.dm_path / name for name in expected])
+        self.assertTrue(0 < len(self.catalog.filenames(predicates[4][0])) < len(self.docmodels))
+
+        # SQL predicates, including like which can only be evaluated by the catalog
+        self.assertEqual(self.catalog.filenames('year >= ? AND abs_words < ?', (median_year, median_words)),
+                         [name for name, dm in self.docmodels.items()
+                          if dm.year >= median_year and dm.abs_words < median_words])
+        self.assertEqual(self.catalog.filenames({'source': ('like', '%journal 1%')}),
+                         [name for name, dm in self.docmodels.items() if 'journal 1' in dm.source])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Unit tests for the integer-coded tags of the DocModels (compact_tags.py)"""
+import contextlib
+import io
+import multiprocessing
+import pickle
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.compact_tags import CompactTags, TokenVocab
+from srs.lib.docmodel import DocModel
+from srs.lib.preprocess.compaction import compact_docmodel_tags
+from srs.lib.preprocess.tagging import Tag
+
+PARAGRAPHS = [
+    [Tag('The', 'DT', 'the'), Tag('cells', 'NNS', 'cell'), Tag('divide', 'VVP', 'divide'), Tag('.', 'SENT', '.')],
+    [],
+    [Tag('Cells', 'NNS', 'cell'), Tag('may', 'MD', 'may'), Tag('divide', 'VV', 'divide'), Tag('.', 'SENT', '.')],
+]
+
+
+def decode_in_worker(data: bytes) -> list:
+    """Unpickles CompactTags in a worker process, where the vocab has to be loaded from its file"""
+
+    return pickle.loads(data).to_lists()
+
+
+class CompactTagsTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def decode_in_other_process(self, tags: CompactTags) -> list:
+        # Spawned, so the worker doesn't inherit the vocabs loaded by this process
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return executor.submit(decode_in_worker, pickle.dumps(tags)).result()
+
+    def test_round_trip(self):
+        vocab = TokenVocab.load(self.work_path / 'vocab.p', create=True)
+        tags = CompactTags.from_paragraphs(PARAGRAPHS, vocab)
+        self.assertEqual(len(tags), 3)
+        self.assertEqual(tags.n_tokens, 8)
+        self.assertEqual(len(vocab), 7)
+        self.assertEqual(tags, PARAGRAPHS)
+        self.assertEqual(tags.to_lists(), PARAGRAPHS)
+        self.assertEqual(list(tags), PARAGRAPHS)
+        self.assertEqual(tags.flatten(), [tag for para in PARAGRAPHS for tag in para])
+        self.assertEqual(tags, CompactTags.from_paragraphs(PARAGRAPHS, vocab))
+        self.assertNotEqual(tags, PARAGRAPHS[:2])
+
+        # Paragraph indexing
+        self.assertEqual(tags[0], PARAGRAPHS[0])
+        self.assertEqual(tags[1], [])
+        self.assertEqual(tags[-1], PARAGRAPHS[-1])
+        self.assertEqual(tags[1:], PARAGRAPHS[1:])
+        self.assertEqual(tags[::-2], PARAGRAPHS[::-2])
+        for i in (3, -4):
+            with self.assertRaises(IndexError):
+                tags[i]
+        np.testing.assert_array_equal(tags.paragraph_ids(2), vocab.encode(PARAGRAPHS[2]))
+
+        # Tokens of the same type are decoded to the same Tag object
+        self.assertIs(tags[0][-1], tags[2][-1])
+        self.assertEqual(CompactTags.from_paragraphs([], vocab).to_lists(), [])
+
+        # Pos masks and ids of the token types
+        mask = vocab.pos_mask(['NNS', 'VV', 'unknown'])
+        self.assertEqual([tag for tag in tags.flatten() if mask[vocab.encode([tag])[0]]],
+                         [PARAGRAPHS[0][1], PARAGRAPHS[2][0], PARAGRAPHS[2][2]])
+        self.assertEqual([vocab.lemmas[i] for i in vocab.type_lemmas[tags.paragraph_ids(0)]],
+                         [tag.lemma for tag in PARAGRAPHS[0]])
+
+    def test_pickled_to_other_process(self):
+        vocab = TokenVocab.load(self.work_path / 'vocab.p', create=True)
+        tags = CompactTags.from_paragraphs(PARAGRAPHS, vocab)
+        vocab.save()
+        self.assertEqual(self.decode_in_other_process(tags), PARAGRAPHS)
+
+        # Pickles hold the path of the vocab, not the vocab itself
+        self.assertIs(pickle.loads(pickle.dumps(tags)).vocab, vocab)
+        vocab.add_type(Tag('unsaved', 'NN', 'unsaved'))
+        self.assertNotIn(b'unsaved', pickle.dumps(tags))
+
+    def test_vocab_extended_by_second_run(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            dm_path = write_synthetic_docmodels(self.work_path, 3, min_paras=6, max_paras=10)
+        vocab_path = self.work_path / 'vocab.p'
+        paths = sorted(dm_path.glob('*.p'))
+        expected = {path.name: DocModel.read_pickle(path).get_text_tags() for path in paths}
+
+        # A DocModel added after the first run, with token types not in the vocab yet
+        new_tags = [[Tag('unseen', 'JJ', 'unseen'), Tag('tokens', 'NNS', 'token')], expected[paths[0].name][0]]
+        new_dm = DocModel.read_pickle(paths[0])
+        new_dm.tt_text_paragraphs = new_tags
+        new_dm.to_pickle(self.work_path / 'new.p')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            vocab = compact_docmodel_tags(dm_path, vocab_path)
+        n_types = len(vocab)
+        ids = {path.name: DocModel.read_pickle(path).get_text_tags().ids for path in paths}
+        # Vocab loaded by another process before the second run
+        stale_vocab = TokenVocab(vocab_path)
+        stale_vocab.reload()
+
+        (self.work_path / 'new.p').rename(dm_path / 'new.p')
+        with contextlib.redirect_stdout(io.StringIO()):
+            vocab = compact_docmodel_tags(dm_path, vocab_path)
+        self.assertEqual(len(vocab), n_types + 2)
+
+        # Documents compacted by the first run are unchanged, and still decoded with the extended vocab
+        for path in paths:
+            tags = DocModel.read_pickle(path).get_text_tags()
+            self.assertIsInstance(tags, CompactTags)
+            np.testing.assert_array_equal(tags.ids, ids[path.name])
+            self.assertEqual(tags, expected[path.name])
+        tags = DocModel.read_pickle(dm_path / 'new.p').get_text_tags()
+        self.assertEqual(tags, new_tags)
+        self.assertEqual(self.decode_in_other_process(tags), new_tags)
+
+        # The stale vocab is reloaded when it meets ids of the new types
+        self.assertEqual(CompactTags(stale_vocab, tags.ids, tags.offsets), new_tags)
+        self.assertEqual(len(stale_vocab), len(vocab))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Unit tests for the DocModels rewrites of preprocess/compaction.py"""
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.catalog import DocCatalog
+from srs.lib.docmodel import DocModel
+from srs.lib.preprocess.compaction import compact_docmodels, resave_docmodels
+
+
+class CompactionCatalogTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.tmp_dir.name)
+        self.catalog_path = self.work_path / 'catalog.sqlite'
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(self.work_path, 6, min_paras=6, max_paras=10,
+                                                     catalog_path=self.catalog_path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def assert_catalog_up_to_date(self):
+        catalog = DocCatalog(self.catalog_path)
+        self.assertEqual(len(catalog), 6)
+        self.assertEqual(catalog.sync(self.dm_path), (0, 0), 'The catalog should not need a sync after a rewrite')
+        catalog.close()
+
+    def test_resave_updates_catalog(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            resave_docmodels(self.dm_path, catalog_path=self.catalog_path)
+        self.assert_catalog_up_to_date()
+
+    def test_compact_updates_catalog(self):
+        texts = {path.name: DocModel.read_pickle(path).get_text_tags() for path in self.dm_path.glob('*.p')}
+        with contextlib.redirect_stdout(io.StringIO()):
+            compact_docmodels(self.dm_path, codec='gzip', catalog_path=self.catalog_path)
+        self.assert_catalog_up_to_date()
+        for filename, tags in texts.items():
+            self.assertEqual(DocModel.read_pickle(self.dm_path / filename).get_text_tags(), tags)
+
+
+if __name__ == '__main__':
+    unittest.main()
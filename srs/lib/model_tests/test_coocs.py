@@ -0,0 +1,260 @@
+"""Unit tests for CoocsModel window sweeps, top_k collocates and ref samples export"""
+import pickle
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from srs.lib.benchmarks.coocs_bench import ListCoocsModel
+from srs.lib.docmodel import DocModel
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.utils.io_utils import save_json
+from srs.lib.utils.ref_ids import RefIds
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.examples_tests_utils import generate_test_id_tags, tag_text
+
+VOCAB = ['i', 'asd', 'office']
+
+
+class CoocsWindowsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.paras = list(generate_test_id_tags(OFFICE_TEST_SENTENCES))
+        self.sweep = self.fill(CoocsModel(VOCAB, window=3, flush_every=5, windows=[1, 2, 4, 6]))
+
+    @classmethod
+    def fill(cls, model: CoocsModel, paras=None) -> CoocsModel:
+        for para_id, tags in (cls.paras if paras is None else paras):
+            model.update(para_id, tags)
+        return model
+
+    def test_windows_match_single_windows(self):
+        for window in (1, 2, 3, 4, 6):
+            single = self.fill(CoocsModel(VOCAB, window=window))
+            pd.testing.assert_frame_equal(self.sweep.as_df(sort=True, window=window), single.as_df(sort=True))
+
+    def test_main_window(self):
+        single = self.fill(CoocsModel(VOCAB, window=3))
+        self.assertEqual(self.sweep.coocs, single.coocs)
+        self.assertEqual(self.sweep.refs, single.refs)
+        with self.assertRaises(ValueError):
+            self.sweep.as_df(window=5)
+
+    def test_merge_state_and_pickle(self):
+        half = len(self.paras) // 2
+        merged = self.fill(CoocsModel(VOCAB, window=3, windows=[1, 2, 4, 6]), self.paras[:half])
+        merged.merge(self.fill(CoocsModel(VOCAB, window=3, windows=[1, 2, 4, 6]), self.paras[half:]))
+        restored = CoocsModel.from_state(self.sweep.get_state())
+        unpickled = pickle.loads(pickle.dumps(self.sweep))
+        for window in (1, 2, 4, 6):
+            expected = self.sweep.as_df(sort=True, window=window)
+            for model in (merged, restored, unpickled):
+                pd.testing.assert_frame_equal(model.as_df(sort=True, window=window), expected)
+        with self.assertRaises(ValueError):
+            merged.merge(CoocsModel(VOCAB, window=3))
+
+    def test_refs_only_updates_flush(self):
+        # Updates without coocs (refs only) must still flush the pending terms
+        model = CoocsModel(VOCAB, window=3, flush_every=20)
+        for para_id, tags in self.paras:
+            model.update(para_id, tags, update_coocs=False)
+            self.assertLess(sum(len(terms) for terms in model._pending_terms), 20 + len(tags))
+        expected = self.fill(CoocsModel(VOCAB, window=3))
+        self.assertEqual(model.get_state()['data']['term_counts'], expected.get_state()['data']['term_counts'])
+        self.assertEqual(model.n_tokens, expected.n_tokens)
+        self.assertEqual(model.refs, expected.refs)
+
+
+class CoocsReferenceTests(unittest.TestCase):
+    """Counts of CoocsModel against the previous token by token counting (ListCoocsModel)"""
+
+    @classmethod
+    def setUpClass(self) -> None:
+        texts = OFFICE_TEST_SENTENCES + ['I asd', 'office', 'i i i asd office i']
+        self.paras = [(f'doc{i // 4}_{i % 4}', tag_text(text)) for i, text in enumerate(texts)]
+        # Empty paragraphs, at the start, in the middle and at the end
+        self.paras[:0] = [('doc9_0', [])]
+        self.paras.insert(len(self.paras) // 2, ('doc9_1', []))
+        self.paras.append(('doc9_2', []))
+        self.vocab = ['i', 'asd', 'office', 'the', 'a', 'and', 'you']
+
+    def reference(self, window: int) -> ListCoocsModel:
+        model = ListCoocsModel(self.vocab, window)
+        for para_id, tags in self.paras:
+            model.update(para_id, tags)
+        return model
+
+    def test_counts_match_reference(self):
+        # Windows shorter and longer than the short paragraphs, up to windows longer than every paragraph
+        for window in (1, 2, 3, 5, 50):
+            for flush_every in (1, 5, 1000):
+                model = CoocsModel(self.vocab, window=window, flush_every=flush_every)
+                for para_id, tags in self.paras:
+                    model.update(para_id, tags)
+                reference = self.reference(window)
+                with self.subTest(window=window, flush_every=flush_every):
+                    self.assertEqual(model.coocs, reference.coocs)
+                    self.assertEqual(model.word_occs, reference.word_occs)
+                    self.assertEqual(model.refs, reference.refs)
+
+    def test_window_sweep_matches_reference(self):
+        windows = [1, 2, 5, 50]
+        model = CoocsModel(self.vocab, window=3, flush_every=5, windows=windows)
+        for para_id, tags in self.paras:
+            model.update(para_id, tags)
+        self.assertEqual(model.coocs, self.reference(3).coocs)
+        for window in windows:
+            self.assertEqual(model._summary_coocs(model.window_matrix(window)), self.reference(window).coocs)
+
+
+class CoocsRefSampleTests(unittest.TestCase):
+    """Bottom-k sampling of the refs (ref_sample_size)"""
+
+    VOCAB = ['i', 'asd', 'the', 'a', 'and', 'you']
+    SAMPLE_SIZE = 4
+
+    @classmethod
+    def setUpClass(self) -> None:
+        base = list(generate_test_id_tags(OFFICE_TEST_SENTENCES))
+        # Paragraphs of several documents, and documents without paragraph number
+        self.paras = [(f'doc{i // 5}_{i % 5}' if i % 7 else f'doc{i // 5}', tags)
+                      for i, (_, tags) in enumerate(base * 4)]
+        self.full = self.fill(CoocsModel(self.VOCAB, window=3))
+        self.sampled = self.fill(self.make_model())
+
+    @classmethod
+    def make_model(cls, sample_size: int = SAMPLE_SIZE) -> CoocsModel:
+        return CoocsModel(cls.VOCAB, window=3, ref_sample_size=sample_size)
+
+    @classmethod
+    def fill(cls, model: CoocsModel, paras=None) -> CoocsModel:
+        for para_id, tags in (cls.paras if paras is None else paras):
+            model.update(para_id, tags)
+        return model
+
+    def sample_ids(self, model: CoocsModel) -> dict:
+        samples = model.get_state()['data']['ref_samples']
+        return {pair: sorted(ref for _, ref in sample) for pair, sample in samples.items()}
+
+    def test_bottom_k(self):
+        self.assertFalse(self.sampled.refs)
+        self.assertEqual(self.sampled.ref_counts, self.full.ref_counts)
+        self.assertEqual(set(self.sampled.ref_samples), set(self.full.refs))
+        self.assertTrue(any(len(refs) > self.SAMPLE_SIZE for refs in self.full.refs.values()))
+        for pair, refs in self.full.refs.items():
+            sample = self.sample_ids(self.sampled)[pair]
+            self.assertEqual(len(sample), min(len(refs), self.SAMPLE_SIZE))
+            # The ids of lowest priority among every id of the pair
+            self.assertEqual(sample, sorted(sorted(refs, key=self.sampled._ref_priority)[:self.SAMPLE_SIZE]))
+
+    def test_order_and_merge_independent(self):
+        expected = self.sampled.get_state()['data']['ref_samples']
+        self.sampled.shuffle_refs()
+        shuffled = dict(self.sampled.shuffled_refs)
+
+        paras = list(self.paras)
+        random.Random(7).shuffle(paras)
+        reordered = self.fill(self.make_model(), paras)
+        shards = [self.fill(self.make_model(), paras[i::3]) for i in range(3)]
+        merged = shards[2]
+        merged.merge(shards[0])
+        merged.merge(shards[1])
+        for model in (reordered, merged):
+            self.assertEqual(model.get_state()['data']['ref_samples'], expected)
+            model.shuffle_refs()
+            self.assertEqual(dict(model.shuffled_refs), shuffled)
+
+    def test_state_round_trip(self):
+        # Samples of every id hold the documents without paragraph number
+        whole = self.fill(self.make_model(sample_size=100))
+        self.assertEqual(self.sample_ids(whole), {pair: sorted(refs) for pair, refs in self.full.refs.items()})
+        self.assertTrue(any('_' not in ref for refs in self.sample_ids(whole).values() for ref in refs))
+        for model in (self.sampled, whole):
+            expected = model.get_state()['data']['ref_samples']
+            for restored in (CoocsModel.from_state(model.get_state()), pickle.loads(pickle.dumps(model))):
+                self.assertEqual(restored.get_state()['data']['ref_samples'], expected)
+                self.assertEqual(restored.ref_counts, model.ref_counts)
+
+    def test_ref_ids_round_trip(self):
+        ref_ids = RefIds()
+        refs = ['doc1_3', 'doc1', 'doc1_0', 'doc_2', 'doc_2_12', 'doc3_03', 'doc3_x', '_4', 'doc4_',
+                f'doc5_{2**20}', 'doc1_3']
+        encoded = [ref_ids.encode(ref) for ref in refs]
+        self.assertEqual(ref_ids.decode_all(encoded), refs)
+        self.assertEqual(encoded[0], encoded[-1])
+        self.assertEqual(len(set(encoded)), len(set(refs)))
+
+
+class CoocsTopKTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.paras = list(generate_test_id_tags(OFFICE_TEST_SENTENCES))
+        self.exact = CoocsModel(VOCAB, window=3)
+        self.bounded = CoocsModel(VOCAB, window=3, flush_every=5, top_k=2, top_k_capacity=3)
+        for para_id, tags in self.paras:
+            self.exact.update(para_id, tags)
+            self.bounded.update(para_id, tags)
+
+    def test_error_bounds(self):
+        bounds = self.bounded.collocate_error_bounds()
+        approx = self.bounded.coocs
+        for word, counter in self.exact.coocs.items():
+            self.assertLessEqual(len(approx[word]), 3)
+            for term, count in counter.items():
+                self.assertLessEqual(approx[word][term], count)
+                self.assertLessEqual(count - approx[word][term], bounds[word])
+        for word, collocates in self.bounded.top_collocates().items():
+            for term, count, upper_bound in collocates:
+                self.assertTrue(count <= self.exact.coocs[word][term] <= upper_bound)
+
+    def test_exact_pass(self):
+        model = CoocsModel.from_state(self.bounded.get_state())
+        for para_id, tags in self.paras:
+            model.update_exact(para_id, tags)
+        for word, counter in model.coocs.items():
+            for term, count in counter.items():
+                self.assertEqual(count, self.exact.coocs[word][term])
+        self.assertEqual(set(model.collocate_error_bounds().values()), {0.0})
+        self.assertEqual(CoocsModel.from_state(model.get_state()).coocs, model.coocs)
+        with self.assertRaises(RuntimeError):
+            model.update(*self.paras[0])
+
+
+
+class CoocsRefExportTests(unittest.TestCase):
+
+    def test_export_matches_ref_dicts(self):
+        paras = list(generate_test_id_tags(OFFICE_TEST_SENTENCES))
+        cm = CoocsModel(['i', 'asd', 'the', 'a', 'and', 'you'], window=3)
+        for i, (_, tags) in enumerate(paras):
+            # Paragraphs of 3 documents, and a document without paragraph number
+            cm.update(f'doc{i % 3}_{i // 3}' if i != 3 else 'doc0', tags)
+        cm.shuffle_refs()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dm_path = Path(tmp)
+            for doc_num in range(3):
+                dm = DocModel(f'doc{doc_num}.xml', None, dm_path, save_on_init=False, extract_metadata_on_init=False)
+                dm.raw_abs_paragraphs = [f'Abstract of document {doc_num}']
+                dm.raw_text_paragraphs = [f'Paragraph {i} of document {doc_num}, "quoted"\n' for i in range(10)]
+                dm.collab, dm.citation = None, f'Citation {doc_num}'
+                dm.to_pickle()
+
+            expected = {f'{pair[0]}_{pair[1]}': [CoocsModel.make_ref_dict(ref, pair, dm_path) for ref in refs[:3]]
+                        for pair, refs in cm.shuffled_refs.items()}
+            save_json(dm_path / 'expected.json', expected)
+            self.assertIn('"para_num": null', (dm_path / 'expected.json').read_text(encoding='utf-8'))
+            for n_workers in (1, 2):
+                cm.export_ref_samples(dm_path, dm_path / 'refs.json', n_samples=3, n_workers=n_workers, chunk_size=1)
+                self.assertEqual((dm_path / 'refs.json').read_text(encoding='utf-8'),
+                                 (dm_path / 'expected.json').read_text(encoding='utf-8'))
+            cm.export_ref_samples(dm_path, dm_path / 'refs.json', words_to_sample=['nothing'])
+            self.assertEqual((dm_path / 'refs.json').read_text(encoding='utf-8'), '{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
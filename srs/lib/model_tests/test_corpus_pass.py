@@ -0,0 +1,93 @@
+"""Unit tests for CorpusPass, against the corpus loops of the steps"""
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.corpus_pass import CorpusPass
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.models.docterm import DocTermModel
+from srs.lib.models.lexcount import LexCounter
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.nlp_params import TT_NVA_TAGS
+from srs.lib.utils.generators import PosFilter, generate_ids_abs_tags, generate_ids_text_tags_filtered, \
+    generate_para_lemmas
+
+
+class CorpusPassTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(Path(self.tmp_dir.name), 10, min_paras=6, max_paras=10)
+        self.tags_filter = PosFilter(TT_NVA_TAGS)
+        # Most frequent nouns, verbs and adjectives, with pairs cooccurring in many paragraphs
+        tag_counts = TagCountsModel(update_filter_fct=self.tags_filter)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _, tags in generate_ids_abs_tags(self.dm_path):
+                tag_counts.update(tags)
+        counts = tag_counts.as_df(sort=True)['total_counts']
+        self.lexicon = counts.sort_values(ascending=False, kind='stable').index[:20].tolist()
+
+        # Models updated by the loops of each step
+        self.expected = self.make_models()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _, tags in generate_ids_abs_tags(self.dm_path):
+                self.expected['tagcounts'].update(tags)
+            for doc_id, tags in generate_ids_abs_tags(self.dm_path):
+                self.expected['docterm'].update(doc_id, tags)
+            for para_id, tags in generate_ids_text_tags_filtered(self.dm_path, filter_fct=self.tags_filter,
+                                                                 flatten=False):
+                self.expected['coocs'].update(para_id, tags)
+            for para_id, lemmas in generate_para_lemmas(self.dm_path):
+                self.expected['lexcounts'].update(para_id, lemmas)
+
+    @classmethod
+    def tearDownClass(self) -> None:
+        self.tmp_dir.cleanup()
+
+    @classmethod
+    def make_models(cls) -> dict:
+        with contextlib.redirect_stdout(io.StringIO()):
+            lexcounter = LexCounter({word: [word] for word in cls.lexicon})
+        return {
+            'tagcounts': TagCountsModel(secondary_attr='pos', update_filter_fct=cls.tags_filter),
+            'docterm': DocTermModel(update_filter_fct=cls.tags_filter),
+            'coocs': CoocsModel(cls.lexicon, window=5),
+            'lexcounts': lexcounter,
+        }
+
+    def run_pass(self, n_workers: int) -> dict:
+        models = self.make_models()
+        corpus_pass = CorpusPass(self.dm_path)
+        corpus_pass.register('tagcounts', models['tagcounts'], 'abs', with_ids=False)
+        corpus_pass.register('docterm', models['docterm'], 'abs')
+        corpus_pass.register('coocs', models['coocs'], 'text_paras', tags_filter_fct=self.tags_filter)
+        corpus_pass.register('lexcounts', models['lexcounts'], 'text_paras', tag_attr='lemma')
+        with contextlib.redirect_stdout(io.StringIO()):
+            return corpus_pass.run(n_workers=n_workers, chunk_size=3)
+
+    def test_same_models_as_step_loops(self):
+        self.assertTrue(self.expected['coocs'].ref_counts, 'The lexicon words should cooccur in the corpus')
+        for n_workers in (1, 2):
+            models = self.run_pass(n_workers)
+            with self.subTest(n_workers=n_workers):
+                pd.testing.assert_frame_equal(models['tagcounts'].as_df(sort=True),
+                                              self.expected['tagcounts'].as_df(sort=True))
+                self.assertEqual(models['tagcounts'].total_updates, self.expected['tagcounts'].total_updates)
+                pd.testing.assert_frame_equal(models['docterm'].as_df(sort=True),
+                                              self.expected['docterm'].as_df(sort=True))
+                self.assertEqual(models['docterm'].doc_ids, self.expected['docterm'].doc_ids)
+                self.assertEqual(models['coocs'].coocs, self.expected['coocs'].coocs)
+                self.assertEqual(models['coocs'].refs, self.expected['coocs'].refs)
+                self.assertEqual(models['coocs'].n_tokens, self.expected['coocs'].n_tokens)
+                pd.testing.assert_frame_equal(models['lexcounts'].as_df(), self.expected['lexcounts'].as_df())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Unit tests for the corpus store (corpus_store.py)"""
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.corpus_store import CorpusStore, build_corpus_store, docmodel_metadata
+from srs.lib.docmodel import DocModel
+from srs.lib.utils.generators import generate_ids_abs_tags, generate_ids_text_tags, generate_para_lemmas
+
+
+class CorpusStoreTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.tmp_dir.name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(self.work_path, 8, min_paras=6, max_paras=10)
+            self.stores = [build_corpus_store(self.dm_path, self.work_path / f'store_{n}', n_workers=n) for n in (1, 2)]
+        self.docmodels = [DocModel.read_pickle(path) for path in sorted(self.dm_path.glob('*.p'))]
+
+    @classmethod
+    def tearDownClass(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_same_tags_and_metadata(self):
+        for store in self.stores + [CorpusStore(self.stores[0].path)]:
+            self.assertEqual(len(store), len(self.docmodels))
+            self.assertEqual(store.ids, [dm.id for dm in self.docmodels])
+            for i, dm in enumerate(self.docmodels):
+                with self.subTest(store=store.path.name, doc=dm.filename):
+                    # Metadata are stored as json, tuples are read as lists
+                    self.assertEqual(store.metadata(i), json.loads(json.dumps(docmodel_metadata(dm))))
+                    self.assertEqual(store.index_of(dm.id), i)
+                    for section, paragraphs in (('abs', dm.get_abs_tags()), ('text', dm.get_text_tags())):
+                        paragraphs = [list(para) for para in paragraphs or []]
+                        self.assertEqual([store.decode(ids) for ids in store.doc_paragraphs(section, i)], paragraphs)
+                        self.assertEqual(store.decode(store.doc_tokens(section, i)),
+                                         [tag for para in paragraphs for tag in para])
+                    self.assertEqual([store.decode(ids) for ids in store.doc_sentences('text', i)],
+                                     list(dm.get_text_sentences_tags()))
+        self.assertTrue(any(store.doc_sentences('text', 0) for store in self.stores), 'Texts should have sentences')
+
+    def test_same_generated_tags(self):
+        store = self.stores[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for generator in (generate_ids_abs_tags, generate_ids_text_tags):
+                for flatten in (True, False):
+                    self.assertEqual(list(generator(store.path, flatten=flatten)),
+                                     list(generator(self.dm_path, flatten=flatten)))
+            self.assertEqual(list(generate_para_lemmas(store.path)), list(generate_para_lemmas(self.dm_path)))
+
+    def test_untagged_docmodel(self):
+        dm_path = self.work_path / 'untagged'
+        dm_path.mkdir()
+        shutil.copy(self.dm_path / self.docmodels[0].filename, dm_path)
+        dm = DocModel('synth-untagged.xml', None, dm_path, save_on_init=False, extract_metadata_on_init=False)
+        dm.raw_abs_paragraphs, dm.raw_text_paragraphs = [], []
+        dm.to_pickle()
+        with contextlib.redirect_stdout(io.StringIO()):
+            store = build_corpus_store(dm_path, self.work_path / 'untagged_store')
+        self.assertEqual(store.ids, [self.docmodels[0].id, dm.id])
+        self.assertEqual(store.metadata(1), json.loads(json.dumps(docmodel_metadata(dm))))
+        for section in ('abs', 'text'):
+            self.assertEqual(store.doc_paragraphs(section, 1), [])
+            self.assertEqual(len(store.doc_tokens(section, 1)), 0)
+            self.assertEqual(store.doc_sentences(section, 1), [])
+            self.assertEqual(store.decode(store.doc_tokens(section, 0)),
+                             self.stores[0].decode(self.stores[0].doc_tokens(section, 0)))
+
+    def test_existing_store(self):
+        with self.assertRaises(FileExistsError), contextlib.redirect_stdout(io.StringIO()):
+            build_corpus_store(self.dm_path, self.stores[0].path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Unit tests for the DocModel files and their lazily loaded sections (docmodel.py)"""
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.docmodel import SECTIONS, DocModel
+
+
+class LazySectionsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.tmp_dir.name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(self.work_path, 3, min_paras=6, max_paras=10)
+        self.path = sorted(self.dm_path.glob('*.p'))[0]
+        self.expected = DocModel.read_pickle(self.path)
+        self.expected.load_sections()
+
+    @classmethod
+    def tearDownClass(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def assert_same_sections(self, dm: DocModel) -> None:
+        self.assertEqual(dm.raw_abs_paragraphs, self.expected.raw_abs_paragraphs)
+        self.assertEqual(dm.raw_text_paragraphs, self.expected.raw_text_paragraphs)
+        self.assertEqual(dm.get_abs_tags(), self.expected.get_abs_tags())
+        self.assertEqual(dm.get_text_tags(), self.expected.get_text_tags())
+        self.assertEqual(dm.tree is None, self.expected.tree is None)
+
+    def test_one_section_loaded(self):
+        dm = DocModel.read_pickle(self.path)
+        self.assertEqual(set(dm.__dict__['_section_spans']), set(SECTIONS))
+        self.assertEqual(dm.id, self.expected.id)
+        self.assertTrue(all(attr not in dm.__dict__ for attrs in SECTIONS.values() for attr in attrs))
+
+        # Only the section of the attribute is read
+        self.assertEqual(dm.get_text_tags(), self.expected.get_text_tags())
+        self.assertEqual(set(dm.__dict__['_section_spans']), {'tree', 'raw'})
+        self.assertIn('tt_abs_paragraphs', dm.__dict__)
+        self.assertNotIn('raw_text_paragraphs', dm.__dict__)
+        self.assertNotIn('tree', dm.__dict__)
+
+        # Values set before their section is loaded are kept
+        dm.raw_abs_paragraphs = ['replaced']
+        self.assertEqual(dm.raw_text_paragraphs, self.expected.raw_text_paragraphs)
+        self.assertEqual(dm.raw_abs_paragraphs, ['replaced'])
+        dm.load_sections()
+        self.assertNotIn('_section_spans', dm.__dict__)
+        self.assertNotIn('_source', dm.__dict__)
+        with self.assertRaises(AttributeError):
+            dm.unknown_attribute
+
+    def test_file_rewritten(self):
+        path = self.work_path / 'rewritten.p'
+        shutil.copy(self.path, path)
+        dm = DocModel.read_pickle(path)
+        self.assertEqual(dm.get_abs_tags(), self.expected.get_abs_tags())
+        other = DocModel.read_pickle(path)
+        other.title = 'rewritten'
+        other.to_pickle(path)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))  # In case of a coarse mtime
+        with self.assertRaisesRegex(RuntimeError, 'modified'):
+            dm.raw_text_paragraphs
+
+        # The rewritten file is still read as a whole
+        self.assertEqual(DocModel.read_pickle(path).title, 'rewritten')
+        self.assert_same_sections(DocModel.read_pickle(path))
+
+    def test_legacy_single_pickle(self):
+        path = self.work_path / 'legacy.p'
+        with open(path, 'wb') as f:
+            pickle.dump(DocModel.read_pickle(self.path), f)  # Sections are loaded by __getstate__
+        dm = DocModel.read_pickle(path)
+        self.assertNotIn('_section_spans', dm.__dict__)
+        self.assertNotIn('_source', dm.__dict__)
+        self.assert_same_sections(dm)
+
+        # Re-saved in the sections format
+        dm.to_pickle(path)
+        dm = DocModel.read_pickle(path)
+        self.assertEqual(set(dm.__dict__['_section_spans']), set(SECTIONS))
+        self.assert_same_sections(dm)
+
+    def test_plain_pickle_load(self):
+        # Without read_pickle, the sections are read from file_path
+        self.assertEqual(self.expected.file_path, self.path)
+        with open(self.path, 'rb') as f:
+            dm = pickle.load(f)
+        self.assertNotIn('_source', dm.__dict__)
+        self.assert_same_sections(dm)
+        self.assertNotIn('_section_spans', dm.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
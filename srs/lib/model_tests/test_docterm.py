@@ -1,9 +1,18 @@
 """Unit tests for DocTermModel"""
+import os
+import pickle
+import tempfile
 import unittest
 
-from charting.lib.models import DocTermModel
-from charting.lib.utils.test_texts import OFFICE_TEST_SENTENCES
-from charting.lib.utils.examples_tests_utils import generate_test_id_tags
+import numpy as np
+import pandas as pd
+
+from srs.lib.models.docterm import DocTermModel, SparseDocTerm
+from srs.lib.nlp_params import TT_NVA_TAGS
+from srs.lib.preprocess.tagging import Tag
+from srs.lib.utils.generators import PosFilter
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.examples_tests_utils import CounterDocTermModel, generate_test_id_tags
 
 
 class DocTermTests(unittest.TestCase):
@@ -99,6 +108,141 @@ class DocTermTests(unittest.TestCase):
             self.assertFalse(col_name in self.filtered_df.columns)
 
 
+def counter_as_df(model: CounterDocTermModel, log_norm: bool = False) -> pd.DataFrame:
+    """as_df() of the previous Counter per document implementation"""
+
+    df = pd.DataFrame.from_dict(model.doc_word_counts, orient='index',
+                                columns=list(model.unique_words), dtype='UInt16').fillna(0)
+    if log_norm:
+        df = df.apply(lambda x: np.log(x + 1))
+    return df
+
+
+class LegacyDocTermModel:
+    """Pickles like a DocTermModel of the previous implementation, i.e. as its __dict__ of Counters"""
+
+    def __init__(self, model: CounterDocTermModel, total_updates: int):
+        self.state = dict(model.__dict__, total_updates=total_updates)
+
+    def __reduce__(self):
+        return object.__new__, (DocTermModel,), self.state
+
+
+class DocTermReferenceTests(unittest.TestCase):
+    """DocTermModel against the previous Counter per document implementation (CounterDocTermModel)"""
+
+    @classmethod
+    def setUpClass(self) -> None:
+        # Tags with a pos, capitalised words as nouns
+        self.docs = [(doc_id, [Tag(tag.word, 'NN' if tag.starts_with.isupper() else 'VV', tag.lemma) for tag in tags])
+                     for doc_id, tags in generate_test_id_tags(OFFICE_TEST_SENTENCES)]
+        # A doc updated again replaces its counts
+        self.docs.append(('doc_3', self.docs[0][1]))
+        self.removed_words = ['the', 'you', 'asd']
+
+    def fill(self, model):
+        for doc_id, tags in self.docs:
+            model.update(doc_id, tags)
+        return model
+
+    def assert_same_df(self, df: pd.DataFrame, expected: pd.DataFrame) -> None:
+        # Rows and columns of the previous implementation are in no particular order
+        self.assertEqual(set(df.index), set(expected.index))
+        self.assertEqual(set(df.columns), set(expected.columns))
+        pd.testing.assert_frame_equal(df, expected.loc[df.index, df.columns])
+
+    def test_as_df_matches_counters(self):
+        for filter_fct in (lambda tag: True, PosFilter(['VV'])):
+            model = self.fill(DocTermModel(update_filter_fct=filter_fct))
+            reference = self.fill(CounterDocTermModel(update_filter_fct=filter_fct))
+            self.assertEqual(model.doc_word_counts, reference.doc_word_counts)
+            for log_norm in (False, True):
+                self.assert_same_df(model.as_df(log_norm=log_norm, sort=True), counter_as_df(reference, log_norm))
+
+            model.filter_words(lambda word: word not in self.removed_words)
+            reference.unique_words = {word for word in reference.unique_words if word not in self.removed_words}
+            self.assertEqual(model.unique_words, reference.unique_words)
+            for log_norm in (False, True):
+                self.assert_same_df(model.as_df(log_norm=log_norm, sort=True), counter_as_df(reference, log_norm))
+            self.assert_same_df(DocTermModel.from_state(model.get_state()).as_df(sort=True), counter_as_df(reference))
+
+    def test_unpickle_previous_format(self):
+        reference = self.fill(CounterDocTermModel(update_filter_fct=PosFilter(TT_NVA_TAGS)))
+        reference.unique_words = {word for word in reference.unique_words if word not in self.removed_words}
+        model = pickle.loads(pickle.dumps(LegacyDocTermModel(reference, len(self.docs))))
+        self.assertIsInstance(model, DocTermModel)
+        self.assertIsInstance(model.filter_fct, PosFilter)
+        self.assertEqual(model.total_updates, len(self.docs))
+        self.assertEqual(model.doc_word_counts, reference.doc_word_counts)
+        self.assertEqual(model.unique_words, reference.unique_words)
+        self.assert_same_df(model.as_df(sort=True), counter_as_df(reference))
+
+        # The unpickled model is a regular DocTermModel
+        model.update('doc_new', self.docs[0][1])
+        self.assertEqual(model.total_updates, len(self.docs) + 1)
+        restored = pickle.loads(pickle.dumps(model))
+        pd.testing.assert_frame_equal(restored.as_df(sort=True), model.as_df(sort=True))
+
+
+class SparseDocTermTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.dt = DocTermModel(tag_attr='lemma', )
+
+        for s_id, tags in generate_test_id_tags(OFFICE_TEST_SENTENCES):
+            self.dt.update(s_id, tags)
+        self.dt.filter_words(lambda x: x not in ['the', 'you', 'asd'])
+
+    def test_same_as_df(self):
+        sdt = self.dt.as_sparse(sort=True)
+        df = self.dt.as_df(sort=True)
+        self.assertEqual(list(sdt.index), list(df.index), 'Sparse and dense matrices should have the same rows')
+        self.assertEqual(list(sdt.columns), list(df.columns), 'Sparse and dense matrices should have the same columns')
+        self.assertTrue((sdt.matrix.toarray() == df.to_numpy(dtype=float)).all(), 'Counts should be equal')
+
+        log_df = self.dt.as_df(log_norm=True, sort=True)
+        # The log of UInt16 counts is computed in float32
+        self.assertTrue(all(str(dtype) == 'Float32' for dtype in log_df.dtypes))
+        for dtype in (np.float32, np.float64, np.int32):
+            log_matrix = self.dt.as_sparse(sort=True, dtype=dtype).log1p().matrix
+            self.assertTrue((log_matrix.toarray() == log_df.to_numpy(dtype=np.float64)).all(),
+                            f'log1p() should give the same values as as_df(log_norm=True), with {dtype.__name__} values')
+
+    def test_normalize(self):
+        l1 = self.dt.as_sparse().normalize('l1').matrix
+        self.assertTrue(np.allclose(l1.sum(axis=1), 1), 'Rows should sum to 1 after l1 normalisation')
+        l2 = self.dt.as_sparse().tfidf().normalize('l2').matrix
+        self.assertTrue(np.allclose(l2.multiply(l2).sum(axis=1), 1), 'Rows should have a unit l2 norm')
+
+    def test_integer_matrices(self):
+        counts = np.array([[1, 2], [3, 0]])
+        idf = np.log(3 / (1 + np.array([2, 1]))) + 1
+        for dtype in (np.int32, np.int64):
+            sdt = SparseDocTerm(counts.astype(dtype), ['a', 'b'], ['x', 'y']).tfidf()
+            self.assertEqual(sdt.matrix.dtype, np.float32)
+            self.assertTrue(np.allclose(sdt.matrix.toarray(), counts * idf),
+                            'tfidf() should not truncate the weighted counts of integer matrices')
+            l1 = SparseDocTerm(counts.astype(dtype), ['a', 'b'], ['x', 'y']).normalize('l1').matrix
+            self.assertTrue(np.allclose(l1.toarray(), [[1 / 3, 2 / 3], [1, 0]]))
+            l2 = SparseDocTerm(counts.astype(dtype), ['a', 'b'], ['x', 'y']).normalize('l2').matrix
+            self.assertTrue(np.allclose(l2.multiply(l2).sum(axis=1), 1))
+
+            # Same values as from the default float32 counts
+            normalised = self.dt.as_sparse(dtype=dtype).tfidf().normalize('l2').matrix
+            self.assertEqual((normalised != self.dt.as_sparse().tfidf().normalize('l2').matrix).nnz, 0)
+
+    def test_npz(self):
+        sdt = self.dt.as_sparse().log1p()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'docterm.npz')
+            sdt.save_npz(path)
+            loaded = SparseDocTerm.load_npz(path)
+        self.assertEqual(list(loaded.index), list(sdt.index))
+        self.assertEqual(list(loaded.columns), list(sdt.columns))
+        self.assertEqual((loaded.matrix != sdt.matrix).nnz, 0, 'Loaded matrix should be equal to the saved one')
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,51 @@
+"""Unit tests for the extraction and tagging of the DocModels (preprocess/extraction.py)"""
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.catalog import DocCatalog
+from srs.lib.docmodel import DocModel
+from srs.lib.nlp_params import TRASH_SECTIONS
+from srs.lib.preprocess.extraction import extract_and_tag_docmodel_texts
+
+
+class ExtractAndTagTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.tmp_dir.name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(self.work_path, 6, min_paras=6, max_paras=10)
+        self.filenames = sorted(path.name for path in self.dm_path.glob('*.p'))
+
+    @classmethod
+    def tearDownClass(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_errors_collected_in_both_modes(self):
+        for n_workers in (1, 2):
+            dm_path = self.work_path / f'docmodels_{n_workers}'
+            shutil.copytree(self.dm_path, dm_path)
+            (dm_path / 'broken.p').write_bytes(b'not a pickle')
+            catalog_path = self.work_path / f'catalog_{n_workers}.sqlite'
+            with contextlib.redirect_stdout(io.StringIO()):
+                errors = extract_and_tag_docmodel_texts(dm_path, TRASH_SECTIONS, n_workers=n_workers,
+                                                        tagger_backend='local', catalog_path=catalog_path)
+            with self.subTest(n_workers=n_workers):
+                # The broken file is reported, and every other DocModel is still tagged and recorded
+                self.assertEqual([filename for errs in errors.values() for filename, _ in errs], ['broken.p'])
+                catalog = DocCatalog(catalog_path)
+                self.assertEqual(catalog.filenames(), self.filenames)
+                catalog.close()
+                for filename in self.filenames:
+                    self.assertEqual(DocModel.read_pickle(dm_path / filename).get_text_tags(),
+                                     DocModel.read_pickle(self.dm_path / filename).get_text_tags())
+
+
+if __name__ == '__main__':
+    unittest.main()
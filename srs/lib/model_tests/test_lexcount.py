@@ -0,0 +1,164 @@
+"""Unit tests for LexCounter"""
+import contextlib
+import io
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from srs.lib.models.lexcount import LexCounter
+from srs.lib.models.lexstats import LexStats
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.examples_tests_utils import generate_test_id_tags
+
+# 'i' is listed in two categories
+LEX_MAPPING = {'i': ['i', 'you'], 'work': ['work', 'office', 'i'], 'the': ['a', 'the']}
+# Groups of the docs of LexStatsTests, doc4 is not in a group
+GROUPS = {'doc0': 'even', 'doc1': 'odd', 'doc2': 'even', 'doc3': 'odd'}
+
+
+class LexCounterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.paras = [(para_id, [tag.lemma for tag in tags])
+                      for para_id, tags in generate_test_id_tags(OFFICE_TEST_SENTENCES)]
+        self.lc = self.fill(self.paras, flush_every=7)
+
+    @classmethod
+    def fill(cls, paras, flush_every: int = 1_000_000) -> LexCounter:
+        with contextlib.redirect_stdout(io.StringIO()):
+            lc = LexCounter(LEX_MAPPING, flush_every=flush_every)
+        for para_id, words in paras:
+            lc.update(para_id, words)
+        return lc
+
+    def test_counts(self):
+        lex_counts = self.lc.lex_counts
+        self.assertEqual(list(lex_counts), [para_id for para_id, _ in self.paras], 'Every doc should have a row')
+        for para_id, words in self.paras:
+            self.assertEqual(lex_counts[para_id], [words.count(word) for word in self.lc.lex_words])
+        self.assertEqual(lex_counts['doc_24'], [0] * len(self.lc.lex_words))
+
+    def test_merged_categories(self):
+        df = self.lc.as_df()
+        self.assertEqual(list(df.columns), ['i', 'the', 'work'])
+        self.assertEqual(str(df['i'].dtype), 'UInt16')
+        for para_id, words in self.paras:
+            for cat, cat_words in LEX_MAPPING.items():
+                self.assertEqual(df.loc[para_id, cat], sum(words.count(word) for word in cat_words))
+        words_df = self.lc.as_df(merge_categories=False, sort_columns=False)
+        self.assertEqual(list(words_df.columns), self.lc.lex_words)
+
+    def test_replaced_doc(self):
+        lc = self.fill(self.paras + [('doc_3', ['the', 'the']), ('doc_new', ['office'])])
+        lex_counts = lc.lex_counts
+        self.assertEqual(list(lex_counts)[3], 'doc_3', 'A replaced doc should keep its position')
+        self.assertEqual(lex_counts['doc_3'], [0, 0, 0, 0, 0, 0, 2])
+        self.assertEqual(list(lex_counts)[-1], 'doc_new')
+
+    def test_merge_state_and_pickle(self):
+        half = len(self.paras) // 2
+        merged = self.fill(self.paras[:half])
+        merged.merge(self.fill(self.paras[half:]))
+        with contextlib.redirect_stdout(io.StringIO()):
+            from_state = LexCounter.from_state(self.lc.get_state())
+            legacy_state = LexCounter.from_state({'params': {'lex_mapping': LEX_MAPPING},
+                                                  'data': {'lex_counts': self.lc.lex_counts}})
+        expected = self.lc.as_df(sort_index=True)
+        for lc in (merged, from_state, legacy_state, pickle.loads(pickle.dumps(self.lc))):
+            pd.testing.assert_frame_equal(lc.as_df(sort_index=True), expected)
+
+
+class LexStatsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        # Five paragraphs per doc
+        self.paras = [(f'doc{i // 5}_{i % 5}', [tag.lemma for tag in tags])
+                      for i, (_, tags) in enumerate(generate_test_id_tags(OFFICE_TEST_SENTENCES))]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.lc = LexCounter(LEX_MAPPING, flush_every=7, group_mapping=GROUPS)
+        for para_id, words in self.paras:
+            self.lc.update(para_id, words)
+        self.df = self.lc.as_df().astype(float)
+
+    def fill_stats_only(self, paras) -> LexCounter:
+        with contextlib.redirect_stdout(io.StringIO()):
+            lc = LexCounter(LEX_MAPPING, flush_every=5, group_mapping=GROUPS, keep_counts=False)
+        for para_id, words in paras:
+            lc.update(para_id, words)
+        return lc
+
+    def assert_stats_match_df(self, stats: LexStats):
+        pd.testing.assert_series_equal(stats.mean(), self.df.mean())
+        pd.testing.assert_frame_equal(stats.cov(), self.df.cov())
+        pd.testing.assert_frame_equal(stats.corr(), self.df.corr())
+        for group in ('even', 'odd'):
+            group_df = self.df.loc[[para_id for para_id in self.df.index if GROUPS.get(para_id.split('_')[0]) == group]]
+            pd.testing.assert_series_equal(stats.mean([group]), group_df.mean())
+            pd.testing.assert_frame_equal(stats.corr([group]), group_df.corr())
+
+    def test_stats_match_counts(self):
+        self.assertEqual(self.lc.stats.columns, list(self.df.columns))
+        self.assertEqual(int(self.lc.stats.n.sum()), len(self.paras))
+        self.assert_stats_match_df(self.lc.stats)
+
+    def test_stats_only(self):
+        lc = self.fill_stats_only(self.paras)
+        with self.assertRaises(ValueError):
+            lc.as_df()
+        self.assertEqual(lc._matrix.shape[0], 0, 'No counts should be kept')
+        self.assert_stats_match_df(lc.stats)
+
+    def test_replaced_doc(self):
+        # With counts, stats are those of the last update of each doc, like as_df()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lc = LexCounter(LEX_MAPPING, group_mapping=GROUPS)
+        for para_id, words in [('doc0_0', ['the', 'the', 'i'])] + self.paras:
+            lc.update(para_id, words)
+        self.assert_stats_match_df(lc.stats)
+
+    def test_merge_state_and_pickle(self):
+        half = len(self.paras) // 2
+        merged = self.fill_stats_only(self.paras[:half])
+        merged.merge(self.fill_stats_only(self.paras[half:]))
+        state = merged.get_state()
+        self.assertNotIn('group_mapping', state['params'], 'The group mapping should only be saved as a hash')
+        with contextlib.redirect_stdout(io.StringIO()):
+            from_state = LexCounter.from_state(state)
+        for lc in (merged, from_state, pickle.loads(pickle.dumps(merged))):
+            self.assert_stats_match_df(lc.stats)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            other = LexCounter(LEX_MAPPING, group_mapping={'doc0': 'odd'}, keep_counts=False)
+        with self.assertRaises(ValueError):
+            merged.merge(other)
+
+    def test_group_mapping_not_pickled(self):
+        lc = pickle.loads(pickle.dumps(self.fill_stats_only(self.paras[:5])))
+        self.assertIsNone(lc._group_mapping)
+        with self.assertRaises(ValueError):
+            lc.update('doc1_0', ['i'])
+        with self.assertRaises(ValueError):
+            lc.set_group_mapping({'doc0': 'odd'})
+        lc.set_group_mapping(GROUPS)
+        for para_id, words in self.paras[5:]:
+            lc.update(para_id, words)
+        self.assert_stats_match_df(lc.stats)
+
+    def test_group_mapping_path(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'groups.p'
+            pd.Series(GROUPS).to_pickle(path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                lc = LexCounter(LEX_MAPPING, group_mapping=path, keep_counts=False)
+            self.assertEqual(lc.group_mapping_hash, self.lc.group_mapping_hash)
+            for i, (para_id, words) in enumerate(self.paras):
+                if i == 5:
+                    # Reloaded from the path, like in a worker process
+                    lc = pickle.loads(pickle.dumps(lc))
+                lc.update(para_id, words)
+            self.assert_stats_match_df(lc.stats)
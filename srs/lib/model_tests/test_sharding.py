@@ -0,0 +1,157 @@
+"""Unit tests for the sharding of the corpus and the merge of the models partial states (models/partial_state.py)"""
+import contextlib
+import io
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from srs.lib.benchmarks.synthetic import write_synthetic_docmodels
+from srs.lib.models import partial_state
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.models.docterm import DocTermModel
+from srs.lib.models.lexcount import LexCounter
+from srs.lib.models.partial_state import find_partial_states, merge_partial_states, read_partial_state_header, \
+    save_partial_state, save_shard_state
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.utils.generators import generate_ids_abs_tags, generate_ids_text_tags, generate_para_lemmas, \
+    select_docmodel_paths
+
+
+class ShardingTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.tmp_dir.name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dm_path = write_synthetic_docmodels(self.work_path, 12, min_paras=6, max_paras=10)
+            tag_counts = TagCountsModel()
+            for _, tags in generate_ids_text_tags(self.dm_path):
+                tag_counts.update(tags)
+        # Most frequent lemmas, with pairs cooccurring in many paragraphs
+        counts = tag_counts.as_df(sort=True)['total_counts']
+        self.lexicon = counts.sort_values(ascending=False, kind='stable').index[:20].tolist()
+        self.models = self.fill_models()
+
+    @classmethod
+    def tearDownClass(self) -> None:
+        self.tmp_dir.cleanup()
+
+    @classmethod
+    def fill_models(cls, shard_index: int = 0, num_shards: int = 1) -> dict:
+        """Models of the steps, updated on one shard of the corpus"""
+
+        shard = {'shard_index': shard_index, 'num_shards': num_shards}
+        models = {
+            'tagcounts': TagCountsModel(secondary_attr='pos'),
+            'docterm': DocTermModel(),
+            'coocs': CoocsModel(cls.lexicon, window=3, windows=[1, 5], ref_sample_size=3),
+        }
+        with contextlib.redirect_stdout(io.StringIO()):
+            models['lexcount'] = LexCounter({word: [word] for word in cls.lexicon})
+            for _, tags in generate_ids_text_tags(cls.dm_path, **shard):
+                models['tagcounts'].update(tags)
+            for doc_id, tags in generate_ids_abs_tags(cls.dm_path, **shard):
+                models['docterm'].update(doc_id, tags)
+            for para_id, tags in generate_ids_text_tags(cls.dm_path, flatten=False, **shard):
+                models['coocs'].update(para_id, tags)
+            for para_id, lemmas in generate_para_lemmas(cls.dm_path, **shard):
+                models['lexcount'].update(para_id, lemmas)
+        return models
+
+    @staticmethod
+    def results(models: dict) -> dict:
+        """What the steps save of each model"""
+
+        coocs = models['coocs']
+        coocs.shuffle_refs()
+        return {
+            'tagcounts': models['tagcounts'].as_df(sort=True),
+            'docterm': models['docterm'].as_df(sort=True),
+            'coocs': [coocs.as_df(sort=True)] + [coocs.as_df(sort=True, window=window) for window in coocs.windows],
+            'refs': (dict(coocs.shuffled_refs), dict(coocs.ref_counts)),
+            'lexcount': models['lexcount'].as_df(sort_index=True),
+        }
+
+    def assert_same_results(self, results: dict, expected: dict) -> None:
+        for name, value in expected.items():
+            with self.subTest(model=name):
+                if isinstance(value, pd.DataFrame):
+                    pd.testing.assert_frame_equal(results[name], value)
+                elif name == 'coocs':
+                    for df, expected_df in zip(results[name], value):
+                        pd.testing.assert_frame_equal(df, expected_df)
+                else:
+                    self.assertEqual(results[name], value)
+
+    def test_shards_partition_corpus(self):
+        paths = select_docmodel_paths(self.dm_path)
+        for num_shards in (2, 3, 5):
+            shards = [select_docmodel_paths(self.dm_path, shard_index=i, num_shards=num_shards)
+                      for i in range(num_shards)]
+            self.assertEqual(sorted(path for shard in shards for path in shard), sorted(paths))
+        with self.assertRaises(ValueError):
+            select_docmodel_paths(self.dm_path, shard_index=3, num_shards=3)
+
+    def test_merged_shards_match_single_run(self):
+        expected = self.results(self.models)
+        for num_shards in (2, 3):
+            with tempfile.TemporaryDirectory() as shards_dir, contextlib.redirect_stdout(io.StringIO()):
+                for shard_index in range(num_shards):
+                    for name, model in self.fill_models(shard_index, num_shards).items():
+                        save_shard_state(model, shards_dir, name, shard_index, num_shards)
+                merged = {name: merge_partial_states(find_partial_states(shards_dir, name)) for name in self.models}
+            with self.subTest(num_shards=num_shards):
+                self.assert_same_results(self.results(merged), expected)
+
+    def test_header_checks(self):
+        model = self.models['docterm']
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            tmp = Path(tmp)
+            paths = [save_shard_state(model, tmp, 'docterm', i, 3) for i in range(3)]
+            self.assertEqual(read_partial_state_header(paths[0])['num_shards'], 3)
+
+            # Missing shard, shard found twice, states of runs with different numbers of shards
+            with self.assertRaisesRegex(ValueError, 'Missing'):
+                merge_partial_states(paths[:2])
+            save_partial_state(model, tmp / 'copy.state', 1, 3)
+            with self.assertRaisesRegex(ValueError, 'twice'):
+                merge_partial_states(paths + [tmp / 'copy.state'])
+            save_partial_state(model, tmp / 'other_run.state', 1, 2)
+            with self.assertRaisesRegex(ValueError, 'num_shards'):
+                merge_partial_states([paths[0], tmp / 'other_run.state'])
+            with self.assertRaisesRegex(ValueError, 'No partial states'):
+                merge_partial_states([])
+            with self.assertRaises(ValueError):
+                save_partial_state(model, tmp / 'invalid.state', 3, 3)
+
+            # Different models or parameters
+            save_partial_state(self.models['tagcounts'], tmp / 'tagcounts.state', 1, 3)
+            with self.assertRaisesRegex(ValueError, 'model'):
+                merge_partial_states([paths[0], tmp / 'tagcounts.state', paths[2]])
+            save_partial_state(DocTermModel(tag_attr='word'), tmp / 'words.state', 1, 3)
+            with self.assertRaisesRegex(ValueError, 'params'):
+                merge_partial_states([paths[0], tmp / 'words.state', paths[2]])
+
+            # Other format version, or not a partial state
+            with mock.patch.object(partial_state, 'STATE_VERSION', partial_state.STATE_VERSION + 1):
+                save_partial_state(model, tmp / 'next_version.state', 1, 3)
+            with self.assertRaisesRegex(ValueError, 'version'):
+                read_partial_state_header(tmp / 'next_version.state')
+            with self.assertRaisesRegex(ValueError, 'version'):
+                merge_partial_states([paths[0], tmp / 'next_version.state', paths[2]])
+            model.to_pickle(tmp / 'model.p')
+            with self.assertRaisesRegex(ValueError, 'not a partial state'):
+                read_partial_state_header(tmp / 'model.p')
+            with open(tmp / 'model.p', 'wb') as f:
+                pickle.dump({'format': 'other'}, f)
+            with self.assertRaisesRegex(ValueError, 'not a partial state'):
+                read_partial_state_header(tmp / 'model.p')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Unit tests for the paragraph tags cache (preprocess/tagcache.py)"""
+import itertools
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from srs.lib.preprocess import tagcache
+from srs.lib.preprocess.tagcache import TagCache
+from srs.lib.preprocess.tagging import Tag
+
+
+def tags_of(paragraph: str) -> list:
+    return [Tag(word, 'NN', word.lower()) for word in paragraph.split()]
+
+
+class TagCacheTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'tags.sqlite'
+        # Every call to time.time() is one tick later, so entries never have the same last_used value
+        clock = mock.patch.object(tagcache, 'time', mock.Mock(time=itertools.count().__next__))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def put(self, cache: TagCache, *paragraphs: str, namespace: str = 'local-1') -> None:
+        cache.put_many(paragraphs, [tags_of(para) for para in paragraphs], namespace)
+
+    def cached(self, cache: TagCache, *paragraphs: str) -> list:
+        """Paragraphs found in the cache"""
+
+        return [para for para, tags in zip(paragraphs, cache.get_many(paragraphs, 'local-1')) if tags is not None]
+
+    def test_lru_eviction(self):
+        cache = TagCache(self.path, max_entries=3, evict_every=2)
+        self.put(cache, 'a')
+        self.put(cache, 'b')
+        self.assertEqual(self.cached(cache, 'a'), ['a'])  # a is now more recent than b
+        self.put(cache, 'c', 'd')
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(self.cached(cache, 'a', 'b', 'c', 'd'), ['a', 'c', 'd'])
+
+        # The size is only checked every evict_every inserts
+        self.assertEqual(self.cached(cache, 'c'), ['c'])
+        self.put(cache, 'e')
+        self.assertEqual(len(cache), 4)
+        self.put(cache, 'f')
+        self.assertEqual(self.cached(cache, 'a', 'c', 'd', 'e', 'f'), ['c', 'e', 'f'])
+        self.assertEqual(cache.evictions, 3)
+        self.assertEqual(cache.evict(), 0)
+        cache.close()
+
+    def test_hits_and_misses(self):
+        cache = TagCache(self.path)
+        self.assertEqual(cache.get_many(['The cells divide'], 'local-1'), [None])
+        self.put(cache, 'The cells divide', 'Cells may divide')
+        # Paragraphs are looked up once normalised, each occurrence counts
+        results = cache.get_many(['the  CELLS\ndivide', 'Unknown paragraph', 'Cells may divide', 'Cells may divide'],
+                                 'local-1')
+        self.assertEqual(results, [tags_of('The cells divide'), None, tags_of('Cells may divide'),
+                                   tags_of('Cells may divide')])
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 2, 'hit_rate': 0.6, 'evictions': 0, 'entries': 2})
+        cache.close()
+
+        # Entries persist across instances, stats don't
+        cache = TagCache(self.path)
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(self.cached(cache, 'The cells divide'), ['The cells divide'])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache.close()
+
+    def test_namespaces(self):
+        cache = TagCache(self.path)
+        paragraph = 'The cells divide'
+        self.assertNotEqual(TagCache.make_key(paragraph, 'local-1'), TagCache.make_key(paragraph, 'treetagger-3.2'))
+        self.assertEqual(TagCache.make_key(paragraph, 'local-1'), TagCache.make_key(' the cells  divide', 'local-1'))
+
+        self.put(cache, paragraph, namespace='local-1')
+        self.assertEqual(cache.get_many([paragraph], 'treetagger-3.2'), [None])
+        other_tags = [Tag('The', 'DT', 'the'), Tag('cells', 'NNS', 'cell'), Tag('divide', 'VVP', 'divide')]
+        cache.put_many([paragraph], [other_tags], 'treetagger-3.2')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_many([paragraph], 'local-1'), [tags_of(paragraph)])
+        self.assertEqual(cache.get_many([paragraph], 'treetagger-3.2'), [other_tags])
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Unit tests for TagCountsModel"""
+import pickle
+import unittest
+
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.examples_tests_utils import generate_test_id_tags
+
+
+class TagCountsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        self.docs = [tags for _, tags in generate_test_id_tags(OFFICE_TEST_SENTENCES)]
+        self.tc = TagCountsModel(secondary_attr='word', flush_every=7)
+        for tags in self.docs:
+            self.tc.update(tags)
+
+    def test_counts(self):
+        self.assertEqual(self.tc.total_updates, len(OFFICE_TEST_SENTENCES))
+        self.assertEqual(self.tc.total_counts['i'], 12, 'Value \'i\' should be counted 12 times')
+        self.assertEqual(self.tc.presence_counts['i'], 10, 'Value \'i\' should be found in 10 docs')
+        self.assertEqual(self.tc.total_counts['asd'], 11)
+        self.assertEqual(self.tc.presence_counts['asd'], 3)
+        self.assertEqual(sum(self.tc.secondary_counts['i'].values()), 12)
+
+        df = self.tc.as_df(sort=True)
+        self.assertEqual(list(df.index), sorted(self.tc.total_counts))
+        self.assertEqual(df.loc['i', 'total_counts'], 12)
+        self.assertEqual(df.loc['i', 'article_counts'], 10)
+
+    def test_filter_values(self):
+        tc = pickle.loads(pickle.dumps(self.tc))
+        tc.filter_values(lambda x: x not in ('i', 'asd'))
+        self.assertNotIn('i', tc.total_counts)
+        self.assertNotIn('asd', tc.as_df().index)
+        self.assertNotIn('i', tc.secondary_counts)
+        self.assertEqual(len(tc.as_df()), len(self.tc.as_df()) - 2)
+
+        # Removed values are counted from zero if found again
+        tc.update(self.docs[0])
+        self.assertEqual(tc.total_counts['i'], sum(tag.lemma == 'i' for tag in self.docs[0]))
+
+    def test_merge(self):
+        first, second = TagCountsModel(secondary_attr='word'), TagCountsModel(secondary_attr='word')
+        for tags in self.docs[:10]:
+            first.update(tags)
+        for tags in self.docs[10:]:
+            second.update(tags)
+        first.merge(second)
+        self.assertEqual(first.total_counts, self.tc.total_counts)
+        self.assertEqual(first.presence_counts, self.tc.presence_counts)
+        self.assertEqual(first.secondary_counts, self.tc.secondary_counts)
+        self.assertTrue(first.as_df(sort=True).equals(self.tc.as_df(sort=True)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Unit tests for VocabularyBuilder"""
+import unittest
+
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.models.vocab import VocabularyBuilder
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.examples_tests_utils import generate_test_id_tags
+
+
+class VocabularyBuilderTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self) -> None:
+        # Repeated so that some words are found in many docs
+        self.docs = [tags for _ in range(5) for _, tags in generate_test_id_tags(OFFICE_TEST_SENTENCES)]
+
+    def test_same_vocabulary_as_tagcounts(self):
+        # Tiny sketches make most words collide, which must only add candidates
+        for min_df, max_df_ratio, width in ((5, 0.3, 2**16), (5, 0.3, 8), (2, 0.05, 4), (10, 0.2, 1), (1, 1.0, 64)):
+            tc = TagCountsModel()
+            builder = VocabularyBuilder(min_df, max_df_ratio, value_filter_fct=_long_word, width=width)
+            for tags in self.docs:
+                tc.update(tags)
+                builder.update_sketch(tags)
+            for tags in self.docs:
+                builder.update_counts(tags)
+
+            tc.filter_values(_long_word)
+            tc_df = tc.as_df()
+            tc_df = tc_df[(tc_df['article_counts'] <= max_df_ratio * len(tc_df)) & (tc_df['article_counts'] >= min_df)]
+            self.assertEqual(builder.vocabulary(), sorted(tc_df.index), f'Vocabulary mismatch for {min_df, max_df_ratio, width}')
+
+    def test_distinct_cap(self):
+        # With max_df_ratio = 1 and 5 docs, the cap (6 values) is reached and the upper threshold keeps everything
+        builder = VocabularyBuilder(min_df=1, max_df_ratio=1.0)
+        for tags in self.docs[:5]:
+            builder.update_sketch(tags)
+        for tags in self.docs[:5]:
+            builder.update_counts(tags)
+        self.assertIsNone(builder.n_distinct)
+        self.assertEqual(builder.report()['distinct_cap'], 6)
+        self.assertEqual(len(builder.vocabulary()), len(builder.candidate_counts))
+
+    def test_pass_order(self):
+        builder = VocabularyBuilder()
+        builder.update_sketch(self.docs[0])
+        builder.update_counts(self.docs[0])
+        with self.assertRaises(RuntimeError):
+            builder.update_sketch(self.docs[1])
+        builder = VocabularyBuilder()
+        builder.update_sketch(self.docs[0])
+        with self.assertRaises(RuntimeError):
+            builder.vocabulary()
+
+
+def _long_word(value: str) -> bool:
+    return len(value) >= 3
+
+
+if __name__ == '__main__':
+    unittest.main()
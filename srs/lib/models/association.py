@@ -0,0 +1,191 @@
+"""Association measures over cooccurrence counts, to rank the collocates of the lexicon words.
+
+Raw cooccurrence counts favour frequent words. Association measures compare the observed count O11 of a (word, term)
+pair to the count expected if they were independent, from a 2x2 contingency table:
+
+                 term       other terms
+    word         O11        O12             R1 = cooccurrences counted in the windows of the word
+    other words  O21        O22
+                 C1 = occurrences of the term   N = tokens of the corpus
+
+with E11 = R1 * C1 / N. Window based counts are only an approximation of this table (a term can be counted in the
+windows of several occurrences of a word), so cells are clipped at 0 and the margins computed from the clipped cells.
+
+Scores are only computed for the observed pairs, on the data of a sparse matrix, and never densified:
+
+    counts = cm.as_cooc_counts()
+    npmi = counts.scores('npmi')  # csr matrix with the same sparsity as counts.matrix
+    top = counts.top_k('log_likelihood', k=20, min_count=5)  # {word: [(term, score), ...]}
+
+Measures:
+    count: O11
+    pmi: log2(O11 / E11)
+    npmi: pmi / -log2(O11 / N), in [-1, 1]
+    log_likelihood: Dunning's G2 = 2 * sum(O * ln(O / E)) over the 4 cells, negative if O11 < E11
+    chi2: Pearson's chi-square of the table, N * (O11 * O22 - O12 * O21)^2 / (R1 * R2 * C1 * C2)
+    t_score: (O11 - E11) / sqrt(O11)
+"""
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+MEASURES = ('count', 'pmi', 'npmi', 'log_likelihood', 'chi2', 't_score')
+
+
+class CoocCounts:
+    """Sparse cooccurrence counts, with the term and corpus totals needed by the association measures.
+
+    Attributes
+    ----------
+    matrix: scipy.sparse.csr_matrix
+        Cooccurrence counts, one row per vocab word and one column per term
+    words: np.ndarray
+        Vocab words, labels of the rows
+    terms: np.ndarray
+        Terms, labels of the columns
+    term_counts: np.ndarray
+        Number of occurrences of each term in the corpus
+    n_tokens: int
+        Number of tokens of the corpus
+    row_totals: np.ndarray, optional
+        Number of cooccurrences of each word (R1), if the matrix only holds a part of them (e.g. CoocsModel top_k).
+        Defaults to the sums of the rows.
+    """
+
+    def __init__(self, matrix, words: Iterable[str], terms: Iterable[str], term_counts: Iterable[int], n_tokens: int,
+                 row_totals: Optional[Iterable[int]] = None):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.words = np.asarray(list(words), dtype=str)
+        self.terms = np.asarray(list(terms), dtype=str)
+        self.term_counts = np.asarray(list(term_counts), dtype=np.int64)
+        self.n_tokens = int(n_tokens)
+        self.row_totals = (np.asarray(list(row_totals), dtype=np.int64) if row_totals is not None
+                           else np.asarray(self.matrix.sum(axis=1), dtype=np.int64).ravel())
+        if (self.matrix.shape != (len(self.words), len(self.terms)) or len(self.term_counts) != len(self.terms)
+                or len(self.row_totals) != len(self.words)):
+            raise ValueError(f'Matrix shape {self.matrix.shape} does not match the labels '
+                             f'({len(self.words)}, {len(self.terms)}) and term counts ({len(self.term_counts)})')
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.matrix.shape
+
+    def scores(self, measure: str = 'pmi', min_count: int = 1) -> sparse.csr_matrix:
+        """Association scores of the observed pairs, as a csr matrix with the same rows and columns as the counts.
+        Pairs observed less than min_count times are dropped."""
+
+        if measure not in MEASURES:
+            raise ValueError(f'Unknown measure: {measure}. Available measures: {MEASURES}')
+        counts = self.matrix.astype(np.float64)
+        if min_count > 1:
+            counts.data[counts.data < min_count] = 0
+            counts.eliminate_zeros()
+        if measure == 'count':
+            return counts
+
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(counts.indptr))
+        o11 = counts.data
+        r1 = self.row_totals.astype(np.float64)[rows]
+        c1 = self.term_counts.astype(np.float64)[counts.indices]
+        scores = counts.copy()
+        scores.data = association_scores(measure, o11, r1, c1, float(self.n_tokens))
+        return scores
+
+    def top_k(self, measure: str = 'pmi', k: int = 20, min_count: int = 1,
+              words: Optional[Iterable[str]] = None) -> dict:
+        """Top k terms of each vocab word (or of each word in words) by decreasing score. Ties are broken by term, in
+        alphabetical order.
+
+        Returns:
+            Dict mapping each word to a list of (term, score) pairs, with less than k pairs if the word has fewer
+            collocates.
+        """
+
+        scores = self.scores(measure, min_count)
+        term_ranks = np.empty(len(self.terms), dtype=np.int64)
+        term_ranks[np.argsort(self.terms, kind='stable')] = np.arange(len(self.terms))
+        word_rows = {word: i for i, word in enumerate(self.words.tolist())}
+        terms = self.terms.tolist()
+
+        top = {}
+        for word in (self.words.tolist() if words is None else words):
+            row = word_rows[word]
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            values, indices = scores.data[start:end], scores.indices[start:end]
+            if len(values) > k:
+                # Keeps every value tied with the k-th largest, then sorts them
+                threshold = np.partition(values, len(values) - k)[len(values) - k]
+                kept = values >= threshold
+                values, indices = values[kept], indices[kept]
+            order = np.lexsort((term_ranks[indices], -values))[:k]
+            top[word] = [(terms[j], float(v)) for j, v in zip(indices[order], values[order])]
+        return top
+
+    def top_k_df(self, measure: str = 'pmi', k: int = 20, min_count: int = 1,
+                 words: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Top k terms of each word as a DataFrame, one column per word and one row per rank, like cooc_summary()"""
+
+        top = self.top_k(measure, k, min_count, words)
+        return pd.DataFrame({word: pd.Series([term for term, _ in pairs], dtype=object) for word, pairs in top.items()})
+
+    def save_npz(self, path) -> None:
+        """Saves the counts, labels and totals in a single compressed .npz file"""
+
+        m = self.matrix
+        np.savez_compressed(path, data=m.data, indices=m.indices, indptr=m.indptr, shape=np.array(m.shape),
+                            words=self.words, terms=self.terms, term_counts=self.term_counts,
+                            n_tokens=np.array(self.n_tokens), row_totals=self.row_totals)
+
+    @classmethod
+    def load_npz(cls, path) -> 'CoocCounts':
+        with np.load(path, allow_pickle=False) as f:
+            matrix = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(matrix, f['words'], f['terms'], f['term_counts'], int(f['n_tokens']),
+                       f['row_totals'] if 'row_totals' in f else None)
+
+    def __repr__(self):
+        return f'CoocCounts({self.shape[0]} words, {self.shape[1]} terms, {self.matrix.nnz} pairs)'
+
+
+def association_scores(measure: str, o11: np.ndarray, r1: np.ndarray, c1: np.ndarray, n: float) -> np.ndarray:
+    """Scores of pairs given their observed counts o11, row totals r1, term counts c1 and the corpus size n (arrays
+    of the same length, except n). See module docstring for the measures."""
+
+    o11 = np.asarray(o11, dtype=np.float64)
+    if measure == 'count':
+        return o11.copy()
+
+    # Contingency table, cells clipped at 0 and margins computed from the cells
+    o12 = np.maximum(np.asarray(r1, dtype=np.float64) - o11, 0)
+    o21 = np.maximum(np.asarray(c1, dtype=np.float64) - o11, 0)
+    o22 = np.maximum(n - o11 - o12 - o21, 0)
+    n = o11 + o12 + o21 + o22
+    r1, r2 = o11 + o12, o21 + o22
+    c1, c2 = o11 + o21, o12 + o22
+    e11 = r1 * c1 / n
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if measure == 'pmi':
+            return np.log2(o11 / e11)
+        if measure == 'npmi':
+            pmi = np.log2(o11 / e11)
+            denominator = -np.log2(o11 / n)
+            return np.where(denominator > 0, pmi / denominator, 1.0)
+        if measure == 't_score':
+            return (o11 - e11) / np.sqrt(o11)
+        if measure == 'chi2':
+            denominator = r1 * r2 * c1 * c2
+            return np.where(denominator > 0, n * (o11 * o22 - o12 * o21) ** 2 / denominator, 0.0)
+        if measure == 'log_likelihood':
+            g2 = 2 * (_xlogx(o11, e11) + _xlogx(o12, r1 * c2 / n) + _xlogx(o21, r2 * c1 / n)
+                      + _xlogx(o22, r2 * c2 / n))
+            return np.where(o11 < e11, -g2, g2)
+    raise ValueError(f'Unknown measure: {measure}. Available measures: {MEASURES}')
+
+
+def _xlogx(observed: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """observed * ln(observed / expected), 0 where observed is 0"""
+
+    return np.where(observed > 0, observed * np.log(np.where(observed > 0, observed, 1) / expected), 0.0)
@@ -2,16 +2,29 @@
 
 from typing import Callable, Iterable, Optional
 from collections import defaultdict, Counter
+from array import array
+from functools import partial
+from pathlib import Path
+import hashlib
+import heapq
+import json
+import numpy as np
 import pandas as pd
 import pickle
 import random
+from scipy import sparse
 
 from srs.lib.docmodel import DocModel
-from srs.lib.utils.io_utils import save_json
-
-
-#  TODO update docstrings, added self.tag_attr and changed update() to take [tag] instead of [str]
+from srs.lib.models.association import CoocCounts
+from srs.lib.models.docterm import TAG_CACHE_MAX_SIZE
+from srs.lib.utils.io_utils import save_json_items
+from srs.lib.utils.parallel import bounded_imap
+from srs.lib.utils.ref_ids import RefIds
+from srs.lib.utils.sharding import ref_sort_key
 
+# Integer ids of sampled refs (see utils/ref_ids.py) are stored along with their priority (64 bits hash) as
+# priority * REF_ID_BASE + id
+REF_ID_BASE = 2**64
 
 class CoocsModel:
     """Object used to count word cooccurrences across a series of texts.
@@ -20,8 +33,33 @@ class CoocsModel:
     Also tracks which combinations of vocab word cooccur at least once in each document, making it easy to retrieve the
     ids of all documents in which any specific combination of vocab words were found in the same cooccurrence.
 
-    Ref tracking might consume a lot of memory on large corpus / vocabularies. Consider updating coocs only if it
-    becomes a problem.
+    Each text is encoded as an array of term ids (the id of each distinct tag is cached), and the positions of the vocab
+    words are found with a mask on the term ids. The terms around every vocab word are then gathered at once, with an
+    array of offsets in [-window, window], and accumulated into a sparse vocab x terms matrix every flush_every
+    cooccurrences.
+
+    Ref tracking might consume a lot of memory on large corpus / vocabularies, since every id is kept for every pair of
+    cooccurring vocab words. With ref_sample_size set, only a sample of ref_sample_size ids is kept for each pair (along
+    with the exact number of ids), and memory scales with the number of pairs instead of the corpus size. Each id gets
+    a priority from a seeded hash, and the sample of a pair holds the ids with the lowest priorities (bottom-k reservoir
+    sampling). The sample is then a uniform sample of the ids of the pair, in random order, and it only depends on the
+    seed and the set of ids: not on the order of the updates, and partial models can be merged. Ids are stored as
+    integers (index of the document id, paragraph number), see utils/ref_ids.py.
+
+    With windows set, cooccurrences are instead counted by distance (1 to the largest window) in a sparse matrix with
+    one block of rows per distance. The counts of each window, including window, are then the sums of the blocks up to
+    its size, so all the windows come out of a single pass, at the cost of a pass with the largest window (see
+    window_matrix() and as_df(window=...)).
+
+    The cooccurrence matrix holds a count for every term ever found near each vocab word. With top_k set, each row is
+    instead bounded to top_k_capacity heavy hitter counters (Misra-Gries summaries, the mergeable form of space-saving):
+    at each flush the pending cooccurrences are added to the matrix, then the rows with more than top_k_capacity
+    counters are reduced by subtracting their (top_k_capacity + 1)-th largest count from all their counters and dropping
+    those left at 0. Counters never exceed the true counts, and fall short of them by at most
+    (cooccurrences of the word - sum of its counters) / (top_k_capacity + 1), see collocate_error_bounds(). Every term
+    cooccurring more than this bound with a word keeps a counter. Memory no longer grows with the corpus, apart from the
+    list of distinct terms. The exact counts of the terms holding a counter (the candidates) can be recovered with a
+    second pass over the same texts with update_exact(), after which the model returns these exact counts.
 
     Attributes
     ----------
@@ -30,17 +68,39 @@ class CoocsModel:
     window: int
         How many words to consider in each direction when counting cooccurrences for a targeted word. The value is
         inclusive.
+    windows: list[int], optional
+        Sorted window sizes whose cooccurrences are also counted, see class docstring. Refs only use window.
+    top_k: int, optional
+        If set, only approximate top collocates are kept for each vocab word, see class docstring and top_collocates()
+    top_k_capacity: int, optional
+        Number of counters per vocab word with top_k set, 10 * top_k by default
     coocs: defaultdict[Counter]
-        Variable used to track the cooccurrences. Dict mapping each vocab word to a Counter tracking its cooccurring
-        terms.
-    refs: set[tuple]
-        Collection of tuples tracking cooccurrence references.
+        Dict mapping each vocab word to a Counter tracking its cooccurring terms. Built from the cooccurrence matrix on
+        access.
+    refs: defaultdict[Counter]
+        Maps each pair of cooccurring vocab words (sorted tuple) to a Counter of the ids in which they cooccur. Empty if
+        ref_sample_size is set.
+    ref_counts: Counter
+        Maps each pair of cooccurring vocab words to the number of ids in which they cooccur
+    ref_sample_size: int, optional
+        If set, number of ids sampled for each pair instead of keeping them all in refs
+    ref_seed: int
+        Seed of the priorities of the sampled ids
+    ref_samples: dict[tuple, list]
+        Sample of each pair, as a heap of -(priority * 2**64 + integer id), see _sample_ref()
     word_occs: Counter
-        Tracks how many times each vocab word was found.
+        Tracks how many times each vocab word was found. Built on access.
+    terms: list[str]
+        Every term found, indexed by term id
+    n_tokens: int
+        Number of tokens of the updated texts. The occurrences of each term are also counted, for the association
+        measures (see as_cooc_counts()).
 
     """
 
-    def __init__(self, vocab: list[str], window: int, tag_attr: str = 'lemma'):
+    def __init__(self, vocab: list[str], window: int, tag_attr: str = 'lemma', flush_every: int = 1_000_000,
+                 ref_sample_size: Optional[int] = None, ref_seed: int = 2112, windows: Optional[Iterable[int]] = None,
+                 top_k: Optional[int] = None, top_k_capacity: Optional[int] = None):
         """CoocsCounter constructor,
 
         Parameters
@@ -49,24 +109,77 @@ class CoocsModel:
             The list of targeted words to count cooccurrences on.
         window: int
             The cooccurrence window (inclusive).
+        ref_sample_size: int, optional
+            If set, only keeps a sample of this many ids for each pair of vocab words, see class docstring
+        ref_seed: int
+            Seed of the ref samples
+        windows: Iterable[int], optional
+            Other window sizes to count cooccurrences for in the same pass, see class docstring
+        top_k: int, optional
+            If set, only keeps approximate top collocates for each vocab word, in bounded memory, see class docstring
+        top_k_capacity: int, optional
+            Number of counters per vocab word with top_k set, at least top_k. Defaults to 10 * top_k.
         """
 
         self.tag_attr = tag_attr
         self.vocab = vocab
         self.window = window
-        self.coocs = defaultdict(Counter)
-        self.word_occs = Counter()
-        self.pairs = [
-            tuple(sorted([w1, w2])) for i, w1 in enumerate(self.vocab) for j, w2 in enumerate(self.vocab[i+1:])
-        ]
+        self.windows = sorted(set(windows)) if windows is not None else None
+        if self.windows is not None and (not self.windows or self.windows[0] < 1):
+            raise ValueError(f'Window sizes must be at least 1, got {windows}')
+        self.top_k = top_k
+        self.top_k_capacity = (top_k_capacity or 10 * top_k) if top_k is not None else None
+        if top_k is not None and (top_k < 1 or self.top_k_capacity < top_k):
+            raise ValueError(f'top_k must be at least 1 and top_k_capacity at least top_k, got {top_k} and '
+                             f'{top_k_capacity}')
+        if top_k is not None and self.windows is not None:
+            raise ValueError('Window sweeps are not available with top_k')
+        self.flush_every = flush_every
         # Keys: (word_a, word_b) tuple. Word pairs are
         # values: para_id, n coocs for each pair. Counts are doubled since registered both for word1 and word2
         self.refs = defaultdict(Counter)
+        self.ref_counts = Counter()
+        self.ref_sample_size = ref_sample_size
+        self.ref_seed = ref_seed
+        self.ref_samples = {}
+        # Integer ids of the sampled refs
+        self._ref_ids = RefIds()
 
         # Will hold the shuffled ref ids for each coocs. Keys will be term pairs (tuple) and values list of unique ids
         # Build after updating with .shuffle_refs()
         self.shuffled_refs = {}
 
+        # Distinct vocab words, and their rank in sorted order, used to sort ref pairs
+        self._vocab_words = list(dict.fromkeys(vocab))
+        self._vocab_ids = {word: i for i, word in enumerate(self._vocab_words)}
+        self._vocab_ranks = np.argsort(np.argsort(np.array(self._vocab_words, dtype=object), kind='stable'))
+        max_distance = max([window] + (self.windows or []))
+        self._offsets = np.array([d for d in range(-max_distance, max_distance + 1) if d != 0], dtype=np.int64)
+
+        self.terms = []
+        self._term_ids = {}
+        # Vocab id of each term id, -1 for terms outside of the vocab
+        self._term_vocab = array('q')
+        self._tag_cache = {}
+
+        self._word_occs = np.zeros(len(self._vocab_words), dtype=np.int64)
+        # Number of times each vocab word was found while updating coocs, the words found at least once get a column
+        self._cooc_hits = np.zeros(len(self._vocab_words), dtype=np.int64)
+        self._matrix = sparse.csr_matrix((len(self._vocab_words), 0), dtype=np.int64)
+        self._term_counts = np.zeros(0, dtype=np.int64)
+        self.n_tokens = 0
+        self._pending_rows, self._pending_cols, self._pending_terms = [], [], []
+        self._n_pending = 0
+        # Counts by distance, row (distance - 1) * len(vocab words) + vocab id. Only with windows set, _matrix is then
+        # left empty
+        n_distances = max_distance if self.windows is not None else 0
+        self._distance_matrix = sparse.csr_matrix((n_distances * len(self._vocab_words), 0), dtype=np.int64)
+        self._pending_distance_rows, self._pending_distance_cols = [], []
+        # With top_k set: number of cooccurrences of each vocab word, and exact counts of the candidates (sorted codes
+        # row * number of terms at the start of the second pass + term id), see update_exact()
+        self._cooc_totals = np.zeros(len(self._vocab_words), dtype=np.int64)
+        self._exact_codes, self._exact_counts, self._exact_n_terms = None, None, 0
+
     def update(self, doc_id: str, tag_list: Iterable[str],
                update_coocs: Optional[bool] = True, update_refs: Optional[bool] = True):
         """Updates cooccurrence values and references with passed values.
@@ -88,24 +201,218 @@ class CoocsModel:
             Whether to update vocab words cooccurrence references
         """
 
-        for i, tag in enumerate(tag_list):
-            word = getattr(tag, self.tag_attr)
-            if word in self.vocab:
-                self.word_occs.update([word])
-                beg = max(i - self.window, 0)
-                end = i + self.window + 1
-                sequence = [getattr(w, self.tag_attr) for w in tag_list[beg:end] if getattr(w, self.tag_attr) != word]
+        term_ids = self._encode(tag_list)
+        self._pending_terms.append(term_ids)
+        self._n_pending += len(term_ids)
+        self.n_tokens += len(term_ids)
+        # Checked before the early returns, so updates without coocs still flush the pending terms
+        if self._n_pending >= self.flush_every:
+            self._flush()
+        vocab_ids = np.frombuffer(self._term_vocab, dtype=np.int64)[term_ids]
+        positions = np.flatnonzero(vocab_ids >= 0)
+        if not len(positions):
+            return
+        centers = vocab_ids[positions]
+        np.add.at(self._word_occs, centers, 1)
+        if not (update_coocs or update_refs):
+            return
+
+        if self._exact_codes is not None:
+            raise RuntimeError('The model cannot be updated once update_exact() was called')
+        rows, neighbor_terms, neighbor_positions, distances = self._window_pairs(term_ids, positions, centers)
+
+        if update_coocs:
+            np.add.at(self._cooc_hits, centers, 1)
+            if self.windows is None:
+                self._pending_rows.append(rows)
+                self._pending_cols.append(neighbor_terms)
+            else:
+                self._pending_distance_rows.append((distances - 1) * len(self._vocab_words) + rows)
+                self._pending_distance_cols.append(neighbor_terms)
+            self._n_pending += len(rows)
+        if self._n_pending >= self.flush_every:
+            self._flush()
+
+        if update_refs:
+            if self.windows is not None:
+                # Refs only use the cooccurrences within window
+                in_window = distances <= self.window
+                rows, neighbor_positions = rows[in_window], neighbor_positions[in_window]
+            neighbor_vocab = vocab_ids[neighbor_positions]
+            is_vocab = neighbor_vocab >= 0
+            if is_vocab.any():
+                self._update_refs(doc_id, rows[is_vocab], neighbor_vocab[is_vocab])
+
+    def update_exact(self, doc_id: str, tag_list: Iterable[str]) -> None:
+        """Second pass with top_k set: counts the exact cooccurrences of the candidates (the terms holding a counter
+        after the first pass). Must be fed the same texts as the updates with update_coocs, after which the model
+        returns these exact counts. The first pass cannot be resumed."""
+
+        if self.top_k is None:
+            raise RuntimeError('Exact counts are only recovered with top_k set, other counts are already exact')
+        if self._exact_codes is None:
+            self._flush()
+            matrix = self._matrix.tocoo()
+            self._exact_n_terms = len(self.terms)
+            self._exact_codes = np.sort(matrix.row.astype(np.int64) * self._exact_n_terms + matrix.col)
+            self._exact_counts = np.zeros(len(self._exact_codes), dtype=np.int64)
+
+        term_ids = self._encode(tag_list)
+        vocab_ids = np.frombuffer(self._term_vocab, dtype=np.int64)[term_ids]
+        positions = np.flatnonzero(vocab_ids >= 0)
+        if not len(positions) or not len(self._exact_codes):
+            return
+        rows, neighbor_terms, _, _ = self._window_pairs(term_ids, positions, vocab_ids[positions])
+        known = neighbor_terms < self._exact_n_terms
+        codes = rows[known] * self._exact_n_terms + neighbor_terms[known]
+        indices = np.minimum(np.searchsorted(self._exact_codes, codes), len(self._exact_codes) - 1)
+        np.add.at(self._exact_counts, indices[self._exact_codes[indices] == codes], 1)
+
+    def merge(self, other: 'CoocsModel') -> None:
+        """Adds the counts and refs of another CoocsModel with the same vocab and window, e.g. one updated on another
+        part of the corpus. Shuffled refs don't depend on the order of the refs, so they are the same whatever the order
+        in which models are merged."""
+
+        if self.ref_sample_size != other.ref_sample_size or self.ref_seed != other.ref_seed:
+            raise ValueError('Only models with the same ref_sample_size and ref_seed can be merged')
+        if self.windows != other.windows:
+            raise ValueError('Only models with the same windows can be merged')
+        if (self.top_k, self.top_k_capacity) != (other.top_k, other.top_k_capacity):
+            raise ValueError('Only models with the same top_k and top_k_capacity can be merged')
+        if self._exact_codes is not None or other._exact_codes is not None:
+            raise ValueError('Models cannot be merged once update_exact() was called')
+        self._flush()
+        other._flush()
+        vocab_ids = np.array([self._vocab_ids[word] for word in other._vocab_words], dtype=np.int64)
+        term_ids = np.array([self._term_id(term) for term in other.terms], dtype=np.int64)
+        self._flush()
+        counts = other._matrix.tocoo()
+        self._matrix = self._matrix + sparse.csr_matrix(
+            (counts.data, (vocab_ids[counts.row], term_ids[counts.col])), shape=self._matrix.shape)
+        np.add.at(self._cooc_totals, vocab_ids, other._cooc_totals)
+        self._reduce()
+        if other._distance_matrix.nnz:
+            counts = other._distance_matrix.tocoo()
+            distance_rows = counts.row // len(other._vocab_words) * len(self._vocab_words) \
+                + vocab_ids[counts.row % len(other._vocab_words)]
+            self._distance_matrix = self._distance_matrix + sparse.csr_matrix(
+                (counts.data, (distance_rows, term_ids[counts.col])), shape=self._distance_matrix.shape)
+        np.add.at(self._word_occs, vocab_ids, other._word_occs)
+        np.add.at(self._cooc_hits, vocab_ids, other._cooc_hits)
+        self._term_counts[term_ids] += other._term_counts
+        self.n_tokens += other.n_tokens
+        for pair, counter in other.refs.items():
+            self.refs[pair].update(counter)
+        self.ref_counts.update(other.ref_counts)
+        for pair, sample in other.ref_samples.items():
+            for entry in sample:
+                priority, ref = divmod(-entry, REF_ID_BASE)
+                self._sample_ref(pair, priority, self._encode_ref(other._decode_ref(ref)))
+
+    @property
+    def coocs(self) -> defaultdict:
+        return self._summary_coocs(self.window_matrix())
+
+    def _summary_coocs(self, matrix: Optional[sparse.csr_matrix] = None) -> defaultdict:
+        """Coocs of a vocab words x terms matrix, the first pass counts by default"""
+
+        if matrix is None:
+            self._flush()
+            matrix = self._matrix if self.windows is None else self.window_matrix()
+        coocs = defaultdict(Counter)
+        for i in np.flatnonzero(self._cooc_hits):
+            row = slice(matrix.indptr[i], matrix.indptr[i + 1])
+            coocs[self._vocab_words[i]].update({self.terms[j]: int(count)
+                                                for j, count in zip(matrix.indices[row], matrix.data[row])})
+        return coocs
+
+    @property
+    def word_occs(self) -> Counter:
+        return Counter({self._vocab_words[i]: int(self._word_occs[i]) for i in np.flatnonzero(self._word_occs)})
+
+    def get_state(self) -> dict:
+        """Returns the parameters, counts and refs of the model as plain python objects, see models/partial_state.py"""
 
-                if update_coocs:
-                    self.coocs[word].update(sequence)
-
-                if update_refs:
-                    # Update refs if at least 2 vocab words are found
-                    # if sum(vals := [w in sequence for w in self.vocab]) >= 2:
+        return {
+            'params': {'vocab': list(self.vocab), 'window': self.window, 'tag_attr': self.tag_attr,
+                       'ref_sample_size': self.ref_sample_size, 'ref_seed': self.ref_seed, 'windows': self.windows,
+                       'top_k': self.top_k, 'top_k_capacity': self.top_k_capacity},
+            'data': {
+                # With top_k set, the counters of the first pass, and the exact counts of the second pass if any
+                'coocs': {word: dict(counter) for word, counter in self._summary_coocs().items()},
+                'cooc_totals': {self._vocab_words[i]: int(self._cooc_totals[i])
+                                for i in np.flatnonzero(self._cooc_totals)},
+                'exact_coocs': ({word: dict(counter) for word, counter in self.coocs.items()}
+                                if self._exact_codes is not None else None),
+                'word_occs': dict(self.word_occs),
+                'refs': {pair: dict(counter) for pair, counter in self.refs.items()},
+                'ref_counts': dict(self.ref_counts),
+                'term_counts': {self.terms[i]: int(self._term_counts[i]) for i in np.flatnonzero(self._term_counts)},
+                'n_tokens': self.n_tokens,
+                # Counts by distance, only with windows set: {distance: {word: {term: count}}}
+                'distance_coocs': self._distance_coocs(),
+                # Sampled ids as (priority, id str), so states of different shards don't depend on their doc indices
+                'ref_samples': {pair: sorted((priority, self._decode_ref(ref))
+                                             for priority, ref in (divmod(-entry, REF_ID_BASE) for entry in sample))
+                                for pair, sample in self.ref_samples.items()},
+            },
+        }
 
-                    for cooc in sequence:
-                        if cooc in self.vocab:
-                            self.refs[tuple(sorted([word, cooc]))].update([doc_id])
+    @classmethod
+    def from_state(cls, state: dict) -> 'CoocsModel':
+        model = cls(**state['params'])
+        data = state['data']
+        rows, cols, counts = [], [], []
+        for word, word_counts in data['coocs'].items():
+            vocab_id = model._vocab_ids[word]
+            model._cooc_hits[vocab_id] += 1
+            if model.windows is not None:
+                # Counted in distance_coocs
+                continue
+            for term, count in word_counts.items():
+                rows.append(vocab_id)
+                cols.append(model._term_id(term))
+                counts.append(count)
+        model._flush()
+        if counts:
+            model._matrix = model._matrix + sparse.csr_matrix((counts, (rows, cols)), shape=model._matrix.shape,
+                                                              dtype=np.int64)
+        for word, count in data['word_occs'].items():
+            model._word_occs[model._vocab_ids[word]] += count
+        for word, count in data.get('cooc_totals', {}).items():
+            model._cooc_totals[model._vocab_ids[word]] += count
+        # States saved before term counting have no term counts, see as_cooc_counts()
+        term_counts = data.get('term_counts', {})
+        term_ids = [model._term_id(term) for term in term_counts]
+        model._flush()
+        model._term_counts[term_ids] = list(term_counts.values())
+        model.n_tokens = data.get('n_tokens', 0)
+        rows, cols, counts = [], [], []
+        for distance, distance_coocs in data.get('distance_coocs', {}).items():
+            for word, word_counts in distance_coocs.items():
+                for term, count in word_counts.items():
+                    rows.append((distance - 1) * len(model._vocab_words) + model._vocab_ids[word])
+                    cols.append(model._term_id(term))
+                    counts.append(count)
+        model._flush()
+        if counts:
+            model._distance_matrix = model._distance_matrix + sparse.csr_matrix(
+                (counts, (rows, cols)), shape=model._distance_matrix.shape, dtype=np.int64)
+        if data.get('exact_coocs') is not None:
+            model.update_exact('', [])
+            for word, word_counts in data['exact_coocs'].items():
+                codes = np.array([model._vocab_ids[word] * model._exact_n_terms + model._term_ids[term]
+                                  for term in word_counts], dtype=np.int64)
+                model._exact_counts[np.searchsorted(model._exact_codes, codes)] = list(word_counts.values())
+        for pair, counts in data['refs'].items():
+            model.refs[pair].update(counts)
+        # States saved before ref sampling have no ref_counts
+        model.ref_counts.update(data['ref_counts'] if 'ref_counts' in data
+                                else {pair: len(counts) for pair, counts in data['refs'].items()})
+        for pair, sample in data.get('ref_samples', {}).items():
+            for priority, ref in sample:
+                model._sample_ref(pair, priority, model._encode_ref(ref))
+        return model
 
     def update_coocs_only(self, doc_id: str, tag_list: Iterable[any]):
         """Calls update with coocs only (id, word_list, True, False). Might be cleaner in some cases."""
@@ -118,39 +425,335 @@ class CoocsModel:
         self.update(doc_id, tag_list, False, True)
 
     def shuffle_refs(self, rnd_seed: int = 2112):
+        """Shuffles the refs of each pair. Pairs and refs are sorted before shuffling, so the result only depends on
+        the seed and the set of refs, not on the order in which the corpus was read (or partial models merged).
+
+        If ref_sample_size is set, the sampled refs of each pair are already in random order: they are returned by
+        increasing priority, and rnd_seed is not used (see ref_seed)."""
+
+        if self.ref_sample_size is not None:
+            for pair in sorted(self.ref_samples):
+                self.shuffled_refs[pair] = [self._decode_ref(-entry % REF_ID_BASE)
+                                            for entry in sorted(self.ref_samples[pair], reverse=True)]
+            return
+
         random.seed(rnd_seed)
 
-        for pair, counter in self.refs.items():
-            para_ids = list(counter.keys())
+        for pair in sorted(self.refs):
+            para_ids = sorted(self.refs[pair], key=ref_sort_key)
             random.shuffle(para_ids)
             self.shuffled_refs[pair] = para_ids
 
-    def as_df(self, filter_fct: Optional[Callable[[str], bool]] = None):
-        """Returns a DataFrame with cooccurrence results
+    def as_df(self, filter_fct: Optional[Callable[[str], bool]] = None, sort: bool = False,
+              window: Optional[int] = None):
+        """Returns a DataFrame with cooccurrence results, within window if set (one of windows), or the model's window
 
         Columns are vocab words (as specified on init) that were found at least once in update texts.
-        Index are all words with at least one cooccurrence with a vocab word.
+        Index are all words with at least one cooccurrence with a vocab word, or those passing filter_fct if set.
+        Missing cooccurrences are NaN.
+        If sort is True, index and columns are sorted. Otherwise, columns are in vocab order and words in the order they
+        were first found.
         """
 
+        hits = np.flatnonzero(self._cooc_hits)
+        matrix = self.window_matrix(window)[hits]
+        term_ids = np.flatnonzero(matrix.getnnz(axis=0))
         if filter_fct is not None:
-            filtered_cooc_terms = list(filter(filter_fct, {word for counter in self.coocs.values() for word in counter.keys()}))
-            return pd.DataFrame(self.coocs, index=filtered_cooc_terms)
+            term_ids = term_ids[np.array([bool(filter_fct(self.terms[j])) for j in term_ids], dtype=bool)]
+
+        values = matrix[:, term_ids].T.toarray().astype(np.float64)
+        values[values == 0] = np.nan
+        df = pd.DataFrame(values, index=pd.Index([self.terms[j] for j in term_ids]),
+                          columns=pd.Index([self._vocab_words[i] for i in hits]))
+        # Columns without missing values hold integers, as they would in a DataFrame made from the Counters
+        complete = [column for column, has_nan in df.isna().any().items() if not has_nan and len(df)]
+        if complete:
+            df[complete] = df[complete].astype(np.int64)
+        return df.sort_index(axis=0).sort_index(axis=1) if sort else df
+
+    def as_cooc_counts(self, sort: bool = False, window: Optional[int] = None) -> CoocCounts:
+        """Returns the cooccurrence counts as a sparse CoocCounts, with the same rows and columns as as_df() (without
+        the filter), along with the term and token totals needed by the association measures (see association.py).
+
+        Models restored from states saved before terms were counted have no term totals: the totals of the columns
+        are then used instead, which underestimates the expected counts.
+        """
+
+        hits = np.flatnonzero(self._cooc_hits)
+        matrix = self.window_matrix(window)[hits]
+        term_ids = np.flatnonzero(matrix.getnnz(axis=0))
+        words = [self._vocab_words[i] for i in hits]
+        if sort:
+            hits_order = np.argsort(np.array(words, dtype=object), kind='stable')
+            matrix, words = matrix[hits_order], [words[i] for i in hits_order]
+            term_ids = term_ids[np.argsort(np.array([self.terms[j] for j in term_ids], dtype=object), kind='stable')]
+
+        if self.n_tokens:
+            term_counts, n_tokens = self._term_counts[term_ids], self.n_tokens
         else:
-            return pd.DataFrame(self.coocs)
+            print('WARNING! No term counts in this model, using the cooccurrence totals instead')
+            all_counts = self.window_matrix(window)
+            term_counts, n_tokens = np.asarray(all_counts.sum(axis=0)).ravel()[term_ids], all_counts.sum()
+        # Bounded rows only hold a part of the cooccurrences of each word
+        row_totals = self._cooc_totals[hits] if self.top_k is not None else None
+        if sort and row_totals is not None:
+            row_totals = row_totals[hits_order]
+        return CoocCounts(matrix[:, term_ids], words, [self.terms[j] for j in term_ids], term_counts, n_tokens,
+                          row_totals)
+
+    def collocate_error_bounds(self) -> dict[str, float]:
+        """Maximum difference between the true cooccurrence counts of each vocab word and its counts, 0 unless top_k is
+        set and update_exact() was not called. Terms without a count cooccur at most this many times with the word."""
+
+        self._flush()
+        hits = np.flatnonzero(self._cooc_hits)
+        if self.top_k is None or self._exact_codes is not None:
+            return {self._vocab_words[i]: 0.0 for i in hits}
+        reduced = self._cooc_totals - np.asarray(self._matrix.sum(axis=1)).ravel()
+        return {self._vocab_words[i]: float(reduced[i] / (self.top_k_capacity + 1)) for i in hits}
+
+    def top_collocates(self, k: Optional[int] = None) -> dict[str, list[tuple]]:
+        """Top k collocates of each vocab word (top_k by default) by decreasing count, ties broken alphabetically.
+
+        Returns:
+            Dict mapping each vocab word to a list of (term, count, upper bound of the true count) tuples. Counts are
+            exact, and equal to their upper bound, unless top_k is set and update_exact() was not called.
+        """
 
-    def export_ref_samples(self, dm_path, save_path, n_samples=20, words_to_sample: Optional[list] = None):
-        """Saves cooc samples references as json
+        k = k if k is not None else self.top_k
+        if k is None:
+            raise ValueError('k is required without top_k')
+        bounds = self.collocate_error_bounds()
+        counts = self.as_cooc_counts()
+        return {word: [(term, int(count), int(count + bounds[word])) for term, count in pairs]
+                for word, pairs in counts.top_k('count', k).items()}
+
+    def window_matrix(self, window: Optional[int] = None) -> sparse.csr_matrix:
+        """Cooccurrence counts within window (one of windows, or the model's window if None), as a vocab words x terms
+        matrix. With windows set, the sum of the counts by distance up to window."""
+
+        self._flush()
+        window = self.window if window is None else window
+        if window != self.window and (self.windows is None or window not in self.windows):
+            raise ValueError(f'Cooccurrences were not counted for a window of {window}, windows: {self.windows}')
+        if self._exact_codes is not None:
+            rows, cols = np.divmod(self._exact_codes, self._exact_n_terms)
+            exact = sparse.csr_matrix((self._exact_counts, (rows, cols)), shape=self._matrix.shape)
+            exact.eliminate_zeros()
+            return exact
+        if self.windows is None:
+            return self._matrix
+        counts = self._distance_matrix[:window * len(self._vocab_words)].tocoo()
+        return sparse.csr_matrix((counts.data, (counts.row % len(self._vocab_words), counts.col)),
+                                 shape=self._matrix.shape)
+
+    def export_ref_samples(self, dm_path, save_path, n_samples=20, words_to_sample: Optional[list] = None,
+                           n_workers: int = 1, chunk_size: int = 100):
+        """Saves cooc samples references as json: the first n_samples shuffled refs of each pair, see make_ref_dict()
 
         word_to_sample: Optional, if provided, only coocs containing at least one word from the list will be considered
+
+        Refs are grouped by document, and each DocModel is read once (only its metadata and raw paragraphs), by chunks
+        of chunk_size DocModels in n_workers processes, which also encode their json. The json of each pair is then
+        joined from these parts and written pair by pair, see save_json_items().
         """
 
-        ref_samples = {}
-        for pair, refs in self.shuffled_refs.items():
-            if words_to_sample is None or any(word in pair for word in words_to_sample):
-                data = [CoocsModel.make_ref_dict(ref, pair, dm_path) for ref in refs[:n_samples]]
-                pair_name = f'{pair[0]}_{pair[1]}'
-                ref_samples[pair_name] = data
-        save_json(save_path, ref_samples)
+        pairs = [pair for pair in self.shuffled_refs
+                 if words_to_sample is None or any(word in pair for word in words_to_sample)]
+        doc_paras = defaultdict(set)
+        for pair in pairs:
+            for ref in self.shuffled_refs[pair][:n_samples]:
+                doc_id, para_num = _split_ref(ref)
+                doc_paras[doc_id].add(para_num)
+
+        print(f'Reading the {len(doc_paras)} documents of the refs of {len(pairs)} pairs...')
+        doc_paras = sorted(doc_paras.items())
+        chunks = [doc_paras[i:i + chunk_size] for i in range(0, len(doc_paras), chunk_size)]
+        read_chunk = partial(_read_ref_docs, Path(dm_path))
+        docs = {}
+        for chunk_docs in (map(read_chunk, chunks) if n_workers == 1
+                           else bounded_imap(read_chunk, chunks, n_workers=n_workers, ordered=False)):
+            docs.update(chunk_docs)
+
+        save_json_items(save_path, ((f'{pair[0]}_{pair[1]}', _refs_json(docs, self.shuffled_refs[pair][:n_samples], pair))
+                                    for pair in pairs), encoded=True)
+
+    def _encode(self, tag_list) -> np.ndarray:
+        """Term ids of the tags"""
+
+        tag_list = tag_list if isinstance(tag_list, list) else list(tag_list)
+        try:
+            term_ids = list(map(self._tag_cache.get, tag_list))
+        except TypeError:
+            # Unhashable tags, encoded one by one
+            term_ids = [self._term_id(getattr(tag, self.tag_attr)) for tag in tag_list]
+        else:
+            if None in term_ids:
+                term_ids = [term_id if term_id is not None else self._cache_tag(tag)
+                            for term_id, tag in zip(term_ids, tag_list)]
+        return np.array(term_ids, dtype=np.int64)
+
+    def _cache_tag(self, tag) -> int:
+        term_id = self._term_id(getattr(tag, self.tag_attr))
+        if len(self._tag_cache) >= TAG_CACHE_MAX_SIZE:
+            self._tag_cache.clear()
+        self._tag_cache[tag] = term_id
+        return term_id
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = self._term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self._term_vocab.append(self._vocab_ids.get(term, -1))
+        return term_id
+
+    def _update_refs(self, doc_id: str, vocab_ids: np.ndarray, other_vocab_ids: np.ndarray) -> None:
+        """Counts a ref for each cooccurrence of two vocab words, as a pair sorted alphabetically"""
+
+        first = np.where(self._vocab_ranks[vocab_ids] < self._vocab_ranks[other_vocab_ids], vocab_ids, other_vocab_ids)
+        second = vocab_ids + other_vocab_ids - first
+        codes, counts = np.unique(first * len(self._vocab_words) + second, return_counts=True)
+        if self.ref_sample_size is not None:
+            priority, ref = self._ref_priority(doc_id), self._encode_ref(doc_id)
+        for code, count in zip(codes.tolist(), counts.tolist()):
+            pair = (self._vocab_words[code // len(self._vocab_words)], self._vocab_words[code % len(self._vocab_words)])
+            self.ref_counts[pair] += 1
+            if self.ref_sample_size is None:
+                self.refs[pair][doc_id] += count
+            else:
+                self._sample_ref(pair, priority, ref)
+
+    def _sample_ref(self, pair: tuple, priority: int, ref: int) -> None:
+        """Adds a ref to the sample of a pair if its priority is among the ref_sample_size lowest.
+
+        Samples are max heaps on the priority. The priority and the integer id are packed in a single negated int,
+        which takes less memory than a tuple."""
+
+        entry = -(priority * REF_ID_BASE + ref)
+        sample = self.ref_samples.get(pair)
+        if sample is None:
+            self.ref_samples[pair] = [entry]
+        elif entry in sample:
+            return
+        elif len(sample) < self.ref_sample_size:
+            heapq.heappush(sample, entry)
+        elif entry > sample[0]:
+            heapq.heapreplace(sample, entry)
+
+    def _ref_priority(self, ref: str) -> int:
+        """Priority of a ref in the samples, a seeded hash of its id"""
+
+        return int.from_bytes(hashlib.blake2b(ref.encode('utf-8'), digest_size=8,
+                                              key=str(self.ref_seed).encode('utf-8')).digest(), 'big')
+
+    def _encode_ref(self, ref: str) -> int:
+        return self._ref_ids.encode(ref)
+
+    def _decode_ref(self, ref: int) -> str:
+        return self._ref_ids.decode(ref)
+
+    def _window_pairs(self, term_ids: np.ndarray, positions: np.ndarray, centers: np.ndarray) -> tuple:
+        """Cooccurrences of the vocab words at positions (of vocab ids centers) as (vocab id, term id) pairs, along with
+        the positions of the terms and their distances to the vocab words (only with windows set)"""
+
+        # Window of each vocab word: one row per vocab word, one column per offset. The terms equal to the vocab word
+        # (including itself) are not counted.
+        neighbors = positions[:, None] + self._offsets
+        in_text = (neighbors >= 0) & (neighbors < len(term_ids))
+        rows = np.broadcast_to(centers[:, None], neighbors.shape)[in_text]
+        neighbor_terms = term_ids[neighbors[in_text]]
+        counted = neighbor_terms != np.broadcast_to(term_ids[positions][:, None], neighbors.shape)[in_text]
+        distances = None
+        if self.windows is not None:
+            distances = np.abs(np.broadcast_to(self._offsets, neighbors.shape)[in_text][counted])
+        return rows[counted], neighbor_terms[counted], neighbors[in_text][counted], distances
+
+    def _reduce(self) -> None:
+        """With top_k set, reduces the rows of the matrix to top_k_capacity counters, see class docstring"""
+
+        if self.top_k is None:
+            return
+        matrix, capacity = self._matrix, self.top_k_capacity
+        for row in np.flatnonzero(np.diff(matrix.indptr) > capacity):
+            span = slice(matrix.indptr[row], matrix.indptr[row + 1])
+            values = matrix.data[span]
+            threshold = np.partition(values, len(values) - capacity - 1)[len(values) - capacity - 1]
+            matrix.data[span] = np.maximum(values - threshold, 0)
+        matrix.eliminate_zeros()
+
+    def _distance_coocs(self) -> dict:
+        self._flush()
+        distance_coocs = {}
+        matrix = self._distance_matrix
+        for row in np.flatnonzero(matrix.getnnz(axis=1)):
+            distance, vocab_id = divmod(int(row), len(self._vocab_words))
+            span = slice(matrix.indptr[row], matrix.indptr[row + 1])
+            distance_coocs.setdefault(distance + 1, {})[self._vocab_words[vocab_id]] = {
+                self.terms[j]: int(count) for j, count in zip(matrix.indices[span], matrix.data[span])}
+        return distance_coocs
+
+    def _flush(self) -> None:
+        """Adds the pending cooccurrences to the matrices, extended to all the terms found so far"""
+
+        if self._matrix.shape[1] != len(self.terms):
+            self._matrix.resize(len(self._vocab_words), len(self.terms))
+            self._distance_matrix.resize(self._distance_matrix.shape[0], len(self.terms))
+            self._term_counts = np.concatenate([self._term_counts,
+                                                np.zeros(len(self.terms) - len(self._term_counts), dtype=np.int64)])
+        if self._pending_terms:
+            self._term_counts += np.bincount(np.concatenate(self._pending_terms), minlength=len(self.terms))
+        if self._pending_rows:
+            rows, cols = np.concatenate(self._pending_rows), np.concatenate(self._pending_cols)
+            self._matrix = self._matrix + sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                                                            shape=self._matrix.shape)
+            if self.top_k is not None:
+                self._cooc_totals += np.bincount(rows, minlength=len(self._vocab_words))
+                self._reduce()
+        if self._pending_distance_rows:
+            rows, cols = np.concatenate(self._pending_distance_rows), np.concatenate(self._pending_distance_cols)
+            self._distance_matrix = self._distance_matrix + sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=self._distance_matrix.shape)
+        self._pending_rows, self._pending_cols, self._pending_terms = [], [], []
+        self._pending_distance_rows, self._pending_distance_cols = [], []
+        self._n_pending = 0
+
+    def __getstate__(self):
+        self._flush()
+        state = self.__dict__.copy()
+        state['_tag_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        if '_matrix' not in state:
+            # Pickled by the previous implementation, holding a Counter per vocab word
+            model = CoocsModel.from_state({
+                'params': {'vocab': state['vocab'], 'window': state['window'], 'tag_attr': state['tag_attr']},
+                'data': state})
+            model.shuffled_refs = state['shuffled_refs']
+            state = model.__dict__
+        state.pop('pairs', None)
+        if '_ref_docs' in state:
+            # Pickled before RefIds
+            state['_ref_ids'] = RefIds()
+            for doc_id in state.pop('_ref_docs'):
+                state['_ref_ids']._doc_index(doc_id)
+            state.pop('_ref_doc_ids')
+        if '_distance_matrix' not in state:
+            # Pickled before term counts and windows
+            n_terms = state['_matrix'].shape[1]
+            state.setdefault('_term_counts', np.zeros(n_terms, dtype=np.int64))
+            state.setdefault('n_tokens', 0)
+            state.setdefault('_pending_terms', [])
+            state['windows'] = None
+            state['_distance_matrix'] = sparse.csr_matrix((0, n_terms), dtype=np.int64)
+            state['_pending_distance_rows'], state['_pending_distance_cols'] = [], []
+        if 'top_k' not in state:
+            # Pickled before top_k
+            state['top_k'], state['top_k_capacity'] = None, None
+            state['_cooc_totals'] = np.zeros(state['_matrix'].shape[0], dtype=np.int64)
+            state['_exact_codes'], state['_exact_counts'], state['_exact_n_terms'] = None, None, 0
+        self.__dict__.update(state)
 
     def to_pickle(self, path):
         """Pickles the LexCounter object at the specified location."""
@@ -163,31 +766,97 @@ class CoocsModel:
 
     @classmethod
     def make_ref_dict(cls, ref, words, dm_path):
-
-        # Assumes ref is the article id and para num split by an underscore
-        if '_' in ref:
-            doc_id, para_num = ref.split('_')
-            para_num = int(para_num)
-            flatten = False
-        else:
-            doc_id = ref
-            para_num = None
-            flatten = True
-
-        dm = DocModel.read_pickle(dm_path / f'{doc_id}.p')
-        return {
-            'id': doc_id,
-            'words': words,
-            'para_num': para_num,
-            'tot_paras': len(dm.get_raw_text()),
-            'title': dm.title,
-            'collab': dm.collab,
-            'source': dm.source,
-            'year': dm.year,
-            'citation': dm.citation,
-            'para_text': '' if flatten else dm.get_raw_text()[para_num],
-            'abs_text': dm.get_raw_abs()
-        }
-
-
-
+        """Reads the DocModel of a ref and returns its metadata and paragraph text, as exported by export_ref_samples()"""
+
+        doc_id, para_num = _split_ref(ref)
+        return _ref_dict(_read_ref_doc(Path(dm_path), doc_id, [para_num]), ref, words)
+
+
+def _split_ref(ref: str) -> tuple[str, Optional[int]]:
+    """Document id and paragraph number of a ref, None if the ref is a document id"""
+
+    # Assumes ref is the article id and para num split by an underscore
+    if '_' in ref:
+        doc_id, para_num = ref.split('_')
+        return doc_id, int(para_num)
+    return ref, None
+
+
+def _read_ref_doc(dm_path: Path, doc_id: str, para_nums: Iterable[Optional[int]]) -> dict:
+    """Metadata and raw paragraphs (those of para_nums only) of a DocModel, see _ref_dict()"""
+
+    dm = DocModel.read_pickle(dm_path / f'{doc_id}.p')
+    raw_text = dm.get_raw_text()
+    return {
+        'tot_paras': len(raw_text),
+        'title': dm.title,
+        'collab': dm.collab,
+        'source': dm.source,
+        'year': dm.year,
+        'citation': dm.citation,
+        'paras': {para_num: raw_text[para_num] for para_num in para_nums if para_num is not None},
+        'abs_text': dm.get_raw_abs(),
+    }
+
+
+def _read_ref_docs(dm_path: Path, doc_paras: list[tuple]) -> dict:
+    """Pool task, reads the (doc_id, para_nums) of a chunk of refs and encodes their json, see _refs_json()"""
+
+    return {doc_id: _encode_ref_doc(_read_ref_doc(dm_path, doc_id, para_nums)) for doc_id, para_nums in doc_paras}
+
+
+def _encode_json(value, depth: int) -> str:
+    """json of a value nested depth levels deep in a json.dumps(..., indent=4) text"""
+
+    return json.dumps(value, ensure_ascii=False, indent=4).replace('\n', '\n' + ' ' * 4 * depth)
+
+
+def _encode_ref_doc(doc: dict) -> dict:
+    """json parts of the ref dicts of a document, as values of a ref dict in the exported json (depth 3: object of
+    pairs, list of refs, ref dict)"""
+
+    return {
+        'metadata': ',\n'.join(f'            "{key}": {_encode_json(doc[key], 3)}'
+                               for key in ('tot_paras', 'title', 'collab', 'source', 'year', 'citation')),
+        'paras': {para_num: _encode_json(text, 3) for para_num, text in doc['paras'].items()},
+        'abs_text': _encode_json(doc['abs_text'], 3),
+    }
+
+
+def _refs_json(docs: dict, refs: list[str], words) -> str:
+    """json of the list of the ref dicts of a pair, as save_json() would write it in the exported json, joined from the
+    json parts of their documents"""
+
+    if not refs:
+        return '[]'
+    words_json = _encode_json(words, 3)
+    ref_jsons = []
+    for ref in refs:
+        doc_id, para_num = _split_ref(ref)
+        doc = docs[doc_id]
+        para_json = '""' if para_num is None else doc['paras'][para_num]
+        # Ids and paragraph numbers are scalars, whose json does not depend on the indentation
+        ref_jsons.append(
+            f'        {{\n            "id": {json.dumps(doc_id, ensure_ascii=False)},\n'
+            f'            "words": {words_json},\n            "para_num": {json.dumps(para_num)},\n'
+            f'{doc["metadata"]},\n'
+            f'            "para_text": {para_json},\n'
+            f'            "abs_text": {doc["abs_text"]}\n        }}')
+    return '[\n' + ',\n'.join(ref_jsons) + '\n    ]'
+
+
+def _ref_dict(doc: dict, ref: str, words) -> dict:
+    doc_id, para_num = _split_ref(ref)
+    return {
+        'id': doc_id,
+        'words': words,
+        'para_num': para_num,
+        'tot_paras': doc['tot_paras'],
+        'title': doc['title'],
+        'collab': doc['collab'],
+        'source': doc['source'],
+        'year': doc['year'],
+        'citation': doc['citation'],
+        'para_text': '' if para_num is None else doc['paras'][para_num],
+        'abs_text': doc['abs_text']
+    }
@@ -5,36 +5,281 @@ from collections import Counter
 import pandas as pd
 import numpy as np
 import pickle
+from scipy import sparse
+
+from srs.lib.utils.sharding import ref_sort_key
+
+# Max number of distinct tags whose word id is cached, see DocTermModel
+TAG_CACHE_MAX_SIZE = 2_000_000
 
 
 class DocTermModel:
-    def __init__(self, tag_attr: str = 'lemma', update_filter_fct: Optional[Callable[[any], bool]] = None):
-        self.doc_word_counts = {}
-        self.unique_words = set()
+    """Counts the words of each document, to build a docterm matrix.
+
+    Words are mapped to integer ids as they are found. Each update appends the (word id, count) entries of the document
+    to flat pending arrays, along with the number of entries of its row (COO entries whose rows are implicit, since
+    rows are only ever appended). Pending entries are compacted into a CSR block every compact_every entries. No
+    per-document Counter is kept, and filter_words() only masks columns.
+
+    The word id (or exclusion) of each distinct tag is cached, so filter_fct and getattr are only called once per
+    distinct tag instead of once per token. filter_fct must then only depend on the tag, which is the case of the usual
+    pos filters. Unhashable tags are filtered one by one, without cache. The cache is cleared when it reaches
+    TAG_CACHE_MAX_SIZE tags.
+
+    Attributes
+    ----------
+    tag_attr: str
+        The tag attribute counted, e.g. 'lemma'
+    filter_fct: Callable
+        Only the tags for which it returns True are counted
+    words: list[str]
+        Every word counted, indexed by word id
+    unique_words: set[str]
+        The words kept in the matrix: all the words counted, minus those removed by filter_words()
+    doc_ids: list[str]
+        Updated doc ids, in update order. Updating an existing doc replaces its counts.
+    total_updates: int
+        Number of calls to update()
+    """
+
+    def __init__(self, tag_attr: str = 'lemma', update_filter_fct: Optional[Callable[[any], bool]] = None,
+                 compact_every: int = 250_000):
         self.tag_attr = tag_attr
-        self.filter_fct = update_filter_fct if update_filter_fct is not None else lambda x: True
+        self.filter_fct = update_filter_fct if update_filter_fct is not None else _keep_all
+        self.compact_every = compact_every
         self.total_updates = 0
 
+        self.words = []
+        self._word_ids = {}
+        # One byte per word id, 1 if the word is in unique_words
+        self._word_mask = bytearray()
+        self._filtered = False
+        self._tag_cache = {}
+
+        self.doc_ids = []
+        self._doc_rows = {}
+        # CSR blocks of compacted rows, then the pending rows: entries and number of entries per row
+        self._blocks = []
+        self._compacted_rows = 0
+        self._pending_cols, self._pending_counts, self._pending_lengths = [], [], []
+
+    @property
+    def n_rows(self) -> int:
+        return self._compacted_rows + len(self._pending_lengths)
+
     def update(self,
                doc_id: str,
                tag_list: Iterable[any],
                ) -> None:
-        c = Counter(getattr(tag, self.tag_attr) for tag in tag_list if self.filter_fct(tag))
-        self.unique_words.update(c.keys())
-        self.doc_word_counts.update({doc_id: c})
+        if not isinstance(tag_list, (list, tuple)):
+            tag_list = list(tag_list)
+        counts = self._count_word_ids(tag_list)
+        if self._filtered and counts:
+            # Words counted again are back in unique_words, as with a set of words
+            self._words_mask()[list(counts)] = True
+        self._append_row(doc_id, counts.keys(), counts.values())
         self.total_updates += 1
 
+    def merge(self, other: 'DocTermModel') -> None:
+        """Adds the documents of another DocTermModel, e.g. one updated on another part of the corpus"""
+
+        n_words = len(self.words)
+        col_map = np.array([self._word_id(word) for word in other.words], dtype=np.int32)
+        new_words = col_map >= n_words
+        mask, other_mask = self._words_mask(), other._words_mask()
+        mask[col_map[new_words]] = other_mask[new_words]
+        mask[col_map[~new_words]] |= other_mask[~new_words]
+        self._filtered = self._filtered or other._filtered
+
+        matrix = other.counts_matrix()[[other._doc_rows[doc_id] for doc_id in other.doc_ids]]
+        matrix = sparse.csr_matrix((matrix.data, col_map[matrix.indices], matrix.indptr),
+                                   shape=(matrix.shape[0], len(self.words)))
+        self._compact()
+        first_row = self.n_rows
+        for i, doc_id in enumerate(other.doc_ids):
+            if doc_id not in self._doc_rows:
+                self.doc_ids.append(doc_id)
+            self._doc_rows[doc_id] = first_row + i
+        self._blocks.append(matrix)
+        self._compacted_rows += matrix.shape[0]
+        self.total_updates += other.total_updates
+
+    @property
+    def unique_words(self) -> set:
+        return {word for word, keep in zip(self.words, self._word_mask) if keep}
+
+    @unique_words.setter
+    def unique_words(self, words: Iterable[str]) -> None:
+        words = set(words)
+        self._word_mask = bytearray(word in words for word in self.words)
+        self._filtered = True
+
+    @property
+    def doc_word_counts(self) -> dict:
+        """{doc_id: Counter} of all the words counted in each doc, including those removed by filter_words()"""
+
+        matrix = self.counts_matrix()
+        indptr, indices, data = matrix.indptr.tolist(), matrix.indices.tolist(), matrix.data.tolist()
+        counts = {}
+        for doc_id in self.doc_ids:
+            row = self._doc_rows[doc_id]
+            start, end = indptr[row], indptr[row + 1]
+            counts[doc_id] = Counter({self.words[j]: n for j, n in zip(indices[start:end], data[start:end])})
+        return counts
+
+    def counts_matrix(self) -> sparse.csr_matrix:
+        """CSR matrix of the counts, one row per update and one column per word id. Rows of docs updated again are
+        replaced by a later row, use doc_ids and as_sparse() to get one row per doc."""
+
+        self._compact()
+        if len(self._blocks) != 1:
+            blocks = self._blocks or [sparse.csr_matrix((0, len(self.words)), dtype=np.int32)]
+            for block in blocks:
+                block.resize(block.shape[0], len(self.words))
+            self._blocks = [sparse.vstack(blocks, format='csr', dtype=np.int32)]
+        self._blocks[0].resize(self._blocks[0].shape[0], len(self.words))
+        return self._blocks[0]
+
+    def get_state(self) -> dict:
+        """Returns the parameters and counts of the model as plain python objects, see models/partial_state.py"""
+
+        return {
+            'params': {'tag_attr': self.tag_attr},
+            'data': {
+                'doc_word_counts': {doc_id: dict(counter) for doc_id, counter in self.doc_word_counts.items()},
+                'unique_words': sorted(self.unique_words),
+                'total_updates': self.total_updates,
+            },
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'DocTermModel':
+        model = cls(**state['params'])
+        data = state['data']
+        for doc_id, counts in data['doc_word_counts'].items():
+            model._append_row(doc_id, [model._word_id(word) for word in counts], counts.values())
+        # Words of unique_words may have no counts left, e.g. if the only doc they were counted in was updated again
+        for word in data['unique_words']:
+            model._word_id(word)
+        model.unique_words = data['unique_words']
+        model.total_updates = data['total_updates']
+        return model
+
     def filter_words(self, filter_fct: Callable[[any], bool]):
+        """Removes the words for which filter_fct returns False from unique_words, and the columns of the matrix"""
 
-        self.unique_words = {w for w in self.unique_words if filter_fct(w)}
+        self._words_mask()[:] &= np.array([filter_fct(word) for word in self.words], dtype=bool)
+        self._filtered = True
 
-    def as_df(self, log_norm: bool = False):
-        df = pd.DataFrame.from_dict(self.doc_word_counts, orient='index',
-                                    columns=list(self.unique_words), dtype='UInt16').fillna(0)
+    def as_df(self, log_norm: bool = False, sort: bool = False):
+        """Returns the docterm matrix, docs as index and words as columns. If sort is True, docs and words are sorted,
+        which makes the matrix independent of the update order. Only docs with at least one word of unique_words get a
+        row."""
+
+        sdt = self.as_sparse(sort=sort, dtype=np.int32)
+        df = pd.DataFrame(sdt.matrix.toarray(), index=sdt.index.tolist(), columns=sdt.columns.tolist()).astype('UInt16')
         if log_norm:
             df = df.apply(lambda x: np.log(x + 1))
         return df
 
+    def as_sparse(self, sort: bool = False, dtype=np.float32) -> 'SparseDocTerm':
+        """Returns the docterm matrix as a SparseDocTerm, with the same rows, columns and values as as_df() (without
+        log_norm, see SparseDocTerm.log1p()) but without ever building the dense matrix. Docs are in update order and
+        words in the order they were first found, or both are sorted like as_df(sort=True).
+
+        Only docs with at least one word of unique_words get a row. Values are stored as float32 by default, which is
+        exact for counts. log1p() gives the values of as_df(log_norm=True) whatever the dtype, see its docstring.
+        """
+
+        doc_ids = sorted(self.doc_ids, key=ref_sort_key) if sort else self.doc_ids
+        word_ids = np.flatnonzero(self._words_mask())
+        if sort:
+            word_ids = word_ids[np.argsort(np.array(self.words, dtype=object)[word_ids], kind='stable')]
+
+        matrix = self.counts_matrix()[[self._doc_rows[doc_id] for doc_id in doc_ids]][:, word_ids]
+        non_empty = np.flatnonzero(np.diff(matrix.indptr))
+        matrix = matrix[non_empty].astype(dtype)
+        matrix.sort_indices()
+        return SparseDocTerm(matrix, [doc_ids[i] for i in non_empty], [self.words[j] for j in word_ids])
+
+    def _count_word_ids(self, tag_list: list) -> Counter:
+        """Counts the word ids of the tags passing filter_fct"""
+
+        try:
+            word_ids = list(map(self._tag_cache.get, tag_list))
+        except TypeError:
+            # Unhashable tags, filtered one by one
+            return Counter(self._word_id(getattr(tag, self.tag_attr)) for tag in tag_list if self.filter_fct(tag))
+
+        if None in word_ids:
+            word_ids = [word_id if word_id is not None else self._cache_tag(tag)
+                        for word_id, tag in zip(word_ids, tag_list)]
+        counts = Counter(word_ids)
+        counts.pop(-1, None)
+        return counts
+
+    def _cache_tag(self, tag) -> int:
+        """Caches and returns the word id of a tag, -1 if it doesn't pass filter_fct"""
+
+        word_id = self._word_id(getattr(tag, self.tag_attr)) if self.filter_fct(tag) else -1
+        if len(self._tag_cache) >= TAG_CACHE_MAX_SIZE:
+            # Keeps the memory bounded on corpora with many rare tags, at the cost of filtering them again
+            self._tag_cache.clear()
+        self._tag_cache[tag] = word_id
+        return word_id
+
+    def _word_id(self, word: str) -> int:
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            word_id = self._word_ids[word] = len(self.words)
+            self.words.append(word)
+            self._word_mask.append(1)
+        return word_id
+
+    def _words_mask(self) -> np.ndarray:
+        """Writable boolean view of the words mask, for vectorized operations. Must not be kept while adding words."""
+
+        return np.frombuffer(self._word_mask, dtype=bool)
+
+    def _append_row(self, doc_id: str, word_ids: Iterable[int], counts: Iterable[int]) -> None:
+        if doc_id not in self._doc_rows:
+            self.doc_ids.append(doc_id)
+        self._doc_rows[doc_id] = self.n_rows
+        n_entries = len(self._pending_cols)
+        self._pending_cols.extend(word_ids)
+        self._pending_counts.extend(counts)
+        self._pending_lengths.append(len(self._pending_cols) - n_entries)
+        if len(self._pending_cols) >= self.compact_every:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Moves the pending rows into a new CSR block"""
+
+        if not self._pending_lengths:
+            return
+        indptr = np.zeros(len(self._pending_lengths) + 1, dtype=np.int64)
+        np.cumsum(self._pending_lengths, out=indptr[1:])
+        block = sparse.csr_matrix((np.array(self._pending_counts, dtype=np.int32),
+                                   np.array(self._pending_cols, dtype=np.int32), indptr),
+                                  shape=(len(self._pending_lengths), len(self.words)))
+        self._blocks.append(block)
+        self._compacted_rows += block.shape[0]
+        self._pending_cols, self._pending_counts, self._pending_lengths = [], [], []
+
+    def __getstate__(self):
+        self._compact()
+        state = self.__dict__.copy()
+        state['_tag_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        if 'doc_word_counts' in state:
+            # Pickled by the previous implementation, holding a Counter per doc
+            model = DocTermModel.from_state({'params': {'tag_attr': state['tag_attr']}, 'data': state})
+            model.filter_fct = state['filter_fct']
+            state = model.__dict__
+        self.__dict__.update(state)
+
     def to_pickle(self, path):
         """Pickles the DocTermCounter object at the specified location."""
 
@@ -45,6 +290,142 @@ class DocTermModel:
         return pickle.load(open(path, 'rb'))
 
 
+class SparseDocTerm:
+    """Docterm matrix held as a scipy CSR matrix, with the labels of its rows and columns.
+
+    The abstracts docterm matrix is mostly zeros, so building it as a dense DataFrame takes far more memory and time
+    than needed. SparseDocTerm exposes index, columns and shape like a DataFrame, so it can be passed to LdaModel
+    instead of one. Normalisations modify the matrix in place and return self, so they can be chained. Integer matrices
+    (e.g. from as_sparse(dtype=np.int32)) are first converted to float32, the default dtype of as_sparse():
+
+        sdt = dt.as_sparse(sort=True).log1p()
+        sdt.save_npz(RESULTS_PATH / 'abstracts_docterm.npz')
+
+    Attributes
+    ----------
+    matrix: scipy.sparse.csr_matrix
+        The values, one row per doc and one column per word.
+    index: np.ndarray
+        Doc ids, labels of the rows.
+    columns: np.ndarray
+        Words, labels of the columns.
+    """
+
+    def __init__(self, matrix, index: Iterable[str], columns: Iterable[str]):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.index = np.asarray(list(index), dtype=str)
+        self.columns = np.asarray(list(columns), dtype=str)
+        if self.matrix.shape != (len(self.index), len(self.columns)):
+            raise ValueError(f'Matrix shape {self.matrix.shape} does not match the labels '
+                             f'({len(self.index)}, {len(self.columns)})')
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.matrix.shape
+
+    def log1p(self) -> 'SparseDocTerm':
+        """log(x + 1) of the values, as done by DocTermModel.as_df(log_norm=True). Zeros are left untouched.
+
+        as_df(log_norm=True) takes the log of UInt16 counts, which numpy computes in float32. The log is computed in
+        float32 here too, whatever the dtype of the matrix (integer matrices are converted to float32), so both give the
+        exact same values."""
+
+        # Same operation and precision as as_df(log_norm=True), rather than np.log1p, so both give the exact same values
+        self._to_float()
+        self.matrix.data[:] = np.log(self.matrix.data.astype(np.float32) + 1)
+        return self
+
+    def tfidf(self, smooth_idf: bool = True) -> 'SparseDocTerm':
+        """Multiplies each column by the inverse document frequency of its word, defined as in sklearn's
+        TfidfTransformer: ln((1 + n_docs) / (1 + df)) + 1 if smooth_idf, else ln(n_docs / df) + 1"""
+
+        self._to_float()
+        n_docs = self.shape[0]
+        df = np.bincount(self.matrix.indices, minlength=self.shape[1])
+        if smooth_idf:
+            idf = np.log((1 + n_docs) / (1 + df)) + 1
+        else:
+            idf = np.log(n_docs / np.maximum(df, 1)) + 1
+        self.matrix.data *= idf[self.matrix.indices].astype(self.matrix.dtype)
+        return self
+
+    def normalize(self, norm: str = 'l2') -> 'SparseDocTerm':
+        """Scales each row to a unit 'l1' or 'l2' norm. Empty rows are left as is."""
+
+        if norm not in ('l1', 'l2'):
+            raise ValueError(f"Unknown norm: {norm}, should be 'l1' or 'l2'")
+        self._to_float()
+        if not self.matrix.nnz:
+            return self
+
+        data = self.matrix.data
+        starts = np.minimum(self.matrix.indptr[:-1], len(data) - 1)
+        if norm == 'l1':
+            norms = np.add.reduceat(np.abs(data), starts)
+        else:
+            norms = np.sqrt(np.add.reduceat(data ** 2, starts))
+
+        # reduceat gives a wrong value for empty rows, which have no data to scale anyway
+        row_lengths = np.diff(self.matrix.indptr)
+        norms[(row_lengths == 0) | (norms == 0)] = 1
+        self.matrix.data /= np.repeat(norms, row_lengths).astype(self.matrix.dtype)
+        return self
+
+    def _to_float(self) -> None:
+        """Converts integer matrices to float32, so normalisations can be done in place"""
+
+        if not np.issubdtype(self.matrix.dtype, np.floating):
+            self.matrix = self.matrix.astype(np.float32)
+
+    def reindex(self, index: Optional[Iterable[str]] = None,
+                columns: Optional[Iterable[str]] = None) -> 'SparseDocTerm':
+        """Returns a new SparseDocTerm with rows and/or columns in the given order, like DataFrame.reindex(). Labels
+        missing from the matrix get an empty row or column."""
+
+        index = self.index if index is None else np.asarray(list(index), dtype=str)
+        columns = self.columns if columns is None else np.asarray(list(columns), dtype=str)
+        matrix = _selection_matrix(index, self.index, self.matrix.dtype) @ self.matrix
+        matrix = matrix @ _selection_matrix(columns, self.columns, self.matrix.dtype).T
+        return SparseDocTerm(matrix.tocsr(), index, columns)
+
+    def to_df(self) -> pd.DataFrame:
+        """Returns the matrix as a dense DataFrame"""
+
+        return pd.DataFrame(self.matrix.toarray(), index=self.index, columns=self.columns)
+
+    def save_npz(self, path) -> None:
+        """Saves the matrix and its labels in a single compressed .npz file"""
+
+        m = self.matrix
+        np.savez_compressed(path, data=m.data, indices=m.indices, indptr=m.indptr, shape=np.array(m.shape),
+                            index=self.index, columns=self.columns)
+
+    @classmethod
+    def load_npz(cls, path) -> 'SparseDocTerm':
+        with np.load(path, allow_pickle=False) as f:
+            matrix = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(matrix, f['index'], f['columns'])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'SparseDocTerm({self.shape[0]} docs, {self.shape[1]} words, {self.matrix.nnz} values)'
+
+
+def _selection_matrix(labels: np.ndarray, source_labels: np.ndarray, dtype) -> sparse.csr_matrix:
+    """Sparse (len(labels), len(source_labels)) matrix with a 1 mapping each label to its position in source_labels"""
+
+    positions = {label: i for i, label in enumerate(source_labels.tolist())}
+    rows = [i for i, label in enumerate(labels.tolist()) if label in positions]
+    cols = [positions[label] for label in labels.tolist() if label in positions]
+    return sparse.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, cols)), shape=(len(labels), len(source_labels)))
+
+
+def _keep_all(tag) -> bool:
+    return True
+
+
 if __name__ == '__main__':
 
     pass
@@ -1,11 +1,17 @@
 from sklearn.decomposition import LatentDirichletAllocation
 
+import numpy as np
 import pandas as pd
 import pickle
 
+from srs.lib.models.docterm import SparseDocTerm
+
 
 class LdaModel(LatentDirichletAllocation):
-    """Wrapper class for sklearn's LDA"""
+    """Wrapper class for sklearn's LDA
+
+    docterm_df can be a DataFrame, or a SparseDocTerm (see docterm.py) to fit the model without a dense docterm matrix.
+    """
 
     def __init__(
             self,
@@ -38,7 +44,7 @@ class LdaModel(LatentDirichletAllocation):
         )
 
     def fit(self, y=None, **kwargs):
-        super().fit(self.docterm_df)
+        super().fit(self._docterm_values())
         self.is_fitted = True
 
     def get_topic_words_df(self, normalize=True):
@@ -58,7 +64,7 @@ class LdaModel(LatentDirichletAllocation):
             'Error, trying to get doc topics df from unfitted model! Run model.fit() and try again.'
 
         df = pd.DataFrame(
-            self.transform(self.docterm_df),
+            self.transform(self._docterm_values()),
             index=self.docterm_df.index,
             columns=[f'topic_{i}' for i in range(self.n_topics)],
         )
@@ -75,6 +81,14 @@ class LdaModel(LatentDirichletAllocation):
                               topic_words_df.loc[topic].sort_values(ascending=False)[:num_words].values]) + '\n'
         return csv
 
+    def _docterm_values(self):
+        """The docterm matrix as passed to sklearn: the CSR matrix of a SparseDocTerm, or the DataFrame"""
+
+        if isinstance(self.docterm_df, SparseDocTerm):
+            # sklearn converts dense matrices to float64, converting sparse ones too gives the exact same model
+            return self.docterm_df.matrix.astype(np.float64, copy=False)
+        return self.docterm_df
+
     def to_pickle(self, path):
         """Pickles the LdaModel object at the specified location."""
 
@@ -1,7 +1,16 @@
-from typing import Optional, Mapping, Iterable
+from typing import Optional, Mapping, Iterable, Union
 from collections import Counter
+from array import array
+from pathlib import Path
+import hashlib
+import numpy as np
 import pandas as pd
 import pickle
+from scipy import sparse
+
+from srs.lib.models.lexstats import LexStats
+from srs.lib.utils.ref_ids import RefIds
+from srs.lib.utils.sharding import ref_sort_key
 
 
 class LexCounter:
@@ -10,6 +19,20 @@ class LexCounter:
     Uses a mapping that associates category names to lists of words. Will count the occurrences of each of these words
     in the passed documents (via update_lex_counts), and the totals can then be summed for each category.
 
+    The lexicon is compiled into a dict mapping each distinct lexicon word to a column id, so updates only count the
+    lexicon hits of each document. Documents get a row in update order, and their ids are stored as integers (see
+    utils/ref_ids.py). The (row, column) pairs of the hits are accumulated, and added to a sparse rows x words count
+    matrix every flush_every hits. Categories are merged with a sparse words x categories projection matrix.
+
+    With a group_mapping (doc id -> group, e.g. the cluster of each document), the model also gives the sufficient
+    statistics of the category counts of each group (see models/lexstats.py), computed from the rows of as_df(). Setting
+    keep_counts to False drops the count matrix and accumulates the stats while updating instead, so memory does not
+    grow with the number of paragraphs. Documents updated twice are then counted twice in the stats.
+
+    The group mapping can be large, and is never pickled with the model (worker copies, partial states), only its path
+    and hash: pass a path to a pickled mapping (dict or Series) to use a grouped LexCounter in worker processes, each
+    one loading it once. A mapping passed as a dict must be set again with set_group_mapping() after unpickling.
+
     Attributes
     ----------
     lex_mapping: Mapping[str, Iterable[str]]
@@ -19,7 +42,14 @@ class LexCounter:
         List of all the words across the different categories. Used internally.
     lex_counts: dict
         Dict holding the results, updated when calling update_lex_counts(). Has doc ids as keys and word counts as
-        values (list[int], same size as lex_words).
+        values (list[int], same size as lex_words). Built from the count matrix on access.
+    stats: LexStats, optional
+        Per group sufficient statistics of the merged category counts, columns in alphabetical order. None without a
+        group_mapping.
+    group_mapping_path: Path, optional
+        Path of the group mapping, if it was passed as a path
+    group_mapping_hash: str, optional
+        Hash of the group mapping, see group_mapping_hash(). Models can only be merged if their hashes are equal.
 
     Methods
     -------
@@ -33,7 +63,8 @@ class LexCounter:
         Pickles the LexCounter object.
     """
 
-    def __init__(self, lex_mapping: Mapping[str, Iterable[str]]):
+    def __init__(self, lex_mapping: Mapping[str, Iterable[str]], flush_every: int = 1_000_000,
+                 group_mapping: Optional[Union[Mapping[str, str], str, Path]] = None, keep_counts: bool = True):
         """LexCounter constructor, must set the lexicon by passing a mapping.
 
         Parameters
@@ -41,13 +72,51 @@ class LexCounter:
         lex_mapping: Mapping[str, Iterable[str]]
             A mapping (dict) representing the different categories and their associated words. Has category names as
             keys and list of words as values.
+        flush_every: int, default: 1 000 000
+            Number of lexicon hits buffered before being added to the counts
+        group_mapping: Mapping[str, str] or path, optional
+            Group of each doc id (paragraph ids are mapped with their doc id), or path to a pickled dict or Series
+            holding it. If set, stats are available for each group, docs not in the mapping being only counted in the
+            whole corpus stats.
+        keep_counts: bool, default: True
+            Whether to keep the counts of each doc. If False, only stats are kept, and lex_counts and as_df() are not
+            available.
         """
 
         self.lex_mapping = lex_mapping
         self.lex_words = [word for words in self.lex_mapping.values() for word in words]
-        self.lex_counts = {}
+        self.flush_every = flush_every
+        self.keep_counts = keep_counts
+        if not keep_counts and group_mapping is None:
+            raise ValueError('A group_mapping is needed to only keep stats')
+        self.group_mapping_path, self.group_mapping_hash, self._group_mapping = None, None, None
+        if isinstance(group_mapping, (str, Path)):
+            self.group_mapping_path = Path(group_mapping)
+            self._group_mapping, self.group_mapping_hash = load_group_mapping(self.group_mapping_path)
+        elif group_mapping is not None:
+            self._group_mapping = dict(group_mapping)
+            self.group_mapping_hash = group_mapping_hash(self._group_mapping)
         self._check_lex_mapping()
 
+        # Compiled lexicon: column id of each distinct word, and column of each lex_words entry (duplicate words share
+        # a column)
+        self._words = list(dict.fromkeys(self.lex_words))
+        self._word_ids = {word: i for i, word in enumerate(self._words)}
+        self._lex_columns = np.array([self._word_ids[word] for word in self.lex_words], dtype=np.int64)
+
+        self._ref_ids = RefIds()
+        # Integer id of the document of each row. A document updated twice gets two rows, the last one is kept
+        self._row_refs = array('q')
+        self._matrix = sparse.csr_matrix((0, len(self._words)), dtype=np.int64)
+        # Hits of the paragraphs updated since the last flush, rows numbered from the first of them
+        self._n_pending, self._pending_rows, self._pending_cols = 0, array('q'), array('q')
+
+        self._categories = sorted(self.lex_mapping)
+        self._projection = self._category_projection(self._categories)
+        # Stats accumulated while updating, only without counts
+        self._stats = LexStats(self._categories) if not keep_counts else None
+        self._pending_groups = array('q')
+
     def update(self, doc_id: str, word_list: Iterable[str]):
         """Updates lex_counts from a doc id and a word list
 
@@ -63,10 +132,129 @@ class LexCounter:
             List of strings representing the document's words.
         """
 
-        c = Counter(word_list)
-        self.lex_counts.update({doc_id: [c[word] for word in self.lex_words]})
+        if self.keep_counts:
+            self._row_refs.append(self._ref_ids.encode(doc_id))
+        if self._stats is not None:
+            self._pending_groups.append(self._stats.group_index(self._group_of(doc_id)))
+        row = self._n_pending
+        self._n_pending += 1
+        hits = [word_id for word_id in map(self._word_ids.get, word_list) if word_id is not None]
+        if hits:
+            self._pending_rows.extend([row] * len(hits))
+            self._pending_cols.extend(hits)
+            if len(self._pending_rows) >= self.flush_every:
+                self._flush()
+
+    def merge(self, other: 'LexCounter') -> None:
+        """Adds the documents of another LexCounter with the same lexicon, e.g. one updated on another part of the
+        corpus"""
+
+        self._flush()
+        other._flush()
+        if self.group_mapping_hash != other.group_mapping_hash or self.keep_counts != other.keep_counts:
+            raise ValueError('Only LexCounters with the same group mapping (hash) and keep_counts can be merged')
+        if self._stats is not None:
+            self._stats.merge(other._stats)
+        columns = np.array([self._word_ids[word] for word in other._words], dtype=np.int64)
+        counts = other._matrix.tocoo()
+        n_rows = len(self._row_refs)
+        self._row_refs.extend(self._ref_ids.translate(other._ref_ids, np.frombuffer(other._row_refs, dtype=np.int64)))
+        self._matrix.resize(len(self._row_refs), len(self._words))
+        self._matrix = self._matrix + sparse.csr_matrix((counts.data, (counts.row + n_rows, columns[counts.col])),
+                                                        shape=self._matrix.shape)
+
+    @property
+    def stats(self) -> Optional[LexStats]:
+        if self.group_mapping_hash is None:
+            return None
+        if not self.keep_counts:
+            self._flush()
+            return self._stats
+        # Computed from the last update of each doc, like as_df()
+        rows, doc_ids = self._rows()
+        stats = LexStats(self._categories)
+        stats.add(self._matrix[rows] @ self._projection,
+                  np.array([stats.group_index(self._group_of(doc_id)) for doc_id in doc_ids], dtype=np.int64))
+        return stats
+
+    def set_group_mapping(self, group_mapping: Mapping[str, str]) -> None:
+        """Sets the group mapping again, after unpickling a model or loading its state. Must be the one the model was
+        created with."""
+
+        if group_mapping_hash(group_mapping) != self.group_mapping_hash:
+            raise ValueError('The group mapping does not match the one this LexCounter was created with')
+        self._group_mapping = dict(group_mapping)
+
+    def _group_of(self, doc_id: str):
+        if self._group_mapping is None:
+            if self.group_mapping_path is None:
+                raise ValueError('The group mapping is not pickled with the LexCounter, set it with set_group_mapping() '
+                                 'or pass it as a path')
+            self._group_mapping, mapping_hash = load_group_mapping(self.group_mapping_path)
+            if mapping_hash != self.group_mapping_hash:
+                raise ValueError(f'The group mapping at {self.group_mapping_path} changed since the LexCounter was '
+                                 f'created')
+        return self._group_mapping.get(doc_id.split('_')[0])
+
+    @property
+    def lex_counts(self) -> dict:
+        self._check_counts()
+        rows, doc_ids = self._rows()
+        matrix = self._matrix[rows][:, self._lex_columns].toarray()
+        return {doc_id: counts for doc_id, counts in zip(doc_ids, matrix.tolist())}
+
+    def get_state(self) -> dict:
+        """Returns the lexicon and counts of the model as plain python objects, see models/partial_state.py. Counts
+        are stored as (doc index, word, count) triplets, documents without lexicon words only have an id."""
+
+        rows, doc_ids = self._rows()
+        counts = self._matrix[rows].tocoo()
+        params = {'lex_mapping': {cat: list(words) for cat, words in self.lex_mapping.items()}}
+        data = {
+            'doc_ids': doc_ids,
+            'counts': [(int(row), self._words[col], int(count))
+                       for row, col, count in zip(counts.row, counts.col, counts.data)],
+        }
+        if self.group_mapping_hash is not None:
+            # The mapping itself is not saved, shards only have to agree on its hash
+            params.update({'group_mapping_hash': self.group_mapping_hash, 'keep_counts': self.keep_counts})
+            data['group_mapping_path'] = str(self.group_mapping_path) if self.group_mapping_path is not None else None
+        if self._stats is not None:
+            data['stats'] = self._stats.get_state()
+        return {'params': params, 'data': data}
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'LexCounter':
+        params, data = state['params'], state['data']
+        model = cls(params['lex_mapping'])
+        if params.get('group_mapping_hash') is not None:
+            # The group mapping is loaded from its path when needed, or set with set_group_mapping()
+            model.group_mapping_hash = params['group_mapping_hash']
+            model.keep_counts = params['keep_counts']
+            if data['group_mapping_path'] is not None:
+                model.group_mapping_path = Path(data['group_mapping_path'])
+        if 'stats' in data:
+            model._stats = LexStats.from_state(data['stats'])
+        if 'lex_counts' in data:
+            # States saved before the count matrix, with a list of counts (one per lex_words entry) per document
+            doc_ids = list(data['lex_counts'])
+            counts = [(row, word, count) for row, doc_counts in enumerate(data['lex_counts'].values())
+                      for word, count in zip(model.lex_words, doc_counts) if count]
+            # Duplicate words hold the same counts, only counted once
+            counts = list(dict.fromkeys(counts))
+        else:
+            doc_ids, counts = data['doc_ids'], data['counts']
+        for doc_id in doc_ids:
+            model._row_refs.append(model._ref_ids.encode(doc_id))
+        rows, words, values = zip(*counts) if counts else ((), (), ())
+        model._matrix = sparse.csr_matrix(
+            (np.array(values, dtype=np.int64), (np.array(rows, dtype=np.int64),
+                                                np.array([model._word_ids[word] for word in words], dtype=np.int64))),
+            shape=(len(doc_ids), len(model._words)))
+        return model
 
-    def as_df(self, merge_categories: Optional[bool] = True, sort_columns: Optional[bool] = True):
+    def as_df(self, merge_categories: Optional[bool] = True, sort_columns: Optional[bool] = True,
+              sort_index: Optional[bool] = False):
         """Returns the lex counts as a dataframe, with or without merging words belonging to the same category.
 
         Index are the doc ids passed when updating, columns are the words in the lexicon and values are the number of
@@ -79,21 +267,88 @@ class LexCounter:
             Whether to sum columns belonging to the same category
         sort_columns: Optional[bool], default:True
             Whether to alphabetically sort the columns.
+        sort_index: Optional[bool], default:False
+            Whether to sort the rows by doc id, then paragraph number. Otherwise, rows are in update order.
         Returns
         -------
         pandas.DataFrame
             The lexical counts as a dataframe, as described above.
         """
 
-        df = pd.DataFrame.from_dict(self.lex_counts, orient='index', columns=self.lex_words, dtype='UInt16')
+        self._check_counts()
+        rows, doc_ids = self._rows()
+        if sort_index:
+            order = sorted(range(len(doc_ids)), key=lambda i: ref_sort_key(doc_ids[i]))
+            rows, doc_ids = rows[order], [doc_ids[i] for i in order]
+        matrix = self._matrix[rows]
 
         if merge_categories:
-            for cat, words in self.lex_mapping.items():
-                df[cat] = sum(df[w] for w in words if w in df)
-            df.drop([col for col in df.columns if col not in self.lex_mapping.keys()], axis=1, inplace=True)
+            # Category columns replace the word columns of the same name, the others are added after them
+            categories = list(self.lex_mapping)
+            columns = [col for col in dict.fromkeys(self.lex_words) if col in self.lex_mapping]
+            columns += [cat for cat in categories if cat not in columns]
+            values = (matrix @ self._category_projection(columns)).toarray()
+        else:
+            columns = self.lex_words
+            values = matrix[:, self._lex_columns].toarray()
+        df = pd.DataFrame(values, index=doc_ids, columns=columns).astype('UInt16')
 
         return df.reindex(sorted(df.columns), axis=1) if sort_columns else df
 
+    def _category_projection(self, categories: list[str]) -> sparse.csr_matrix:
+        """Sparse words x categories matrix, holding the number of times each word is listed in each category"""
+
+        rows = [self._word_ids[word] for cat in categories for word in self.lex_mapping[cat]]
+        cols = [j for j, cat in enumerate(categories) for _ in self.lex_mapping[cat]]
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                                 shape=(len(self._words), len(categories)))
+
+    def _rows(self) -> tuple[np.ndarray, list[str]]:
+        """Row of each document, its last update, in order of first update, along with the document ids"""
+
+        self._flush()
+        refs = np.frombuffer(self._row_refs, dtype=np.int64)
+        if not len(refs):
+            return np.zeros(0, dtype=np.int64), []
+        _, first, inverse = np.unique(refs, return_index=True, return_inverse=True)
+        last = np.zeros(len(first), dtype=np.int64)
+        last[inverse] = np.arange(len(refs))  # Later rows overwrite the earlier ones
+        order = np.argsort(first, kind='stable')
+        return last[order], self._ref_ids.decode_all(refs[first[order]].tolist())
+
+    def _check_counts(self) -> None:
+        if not self.keep_counts:
+            raise ValueError('This LexCounter only keeps stats (keep_counts=False), see LexCounter.stats')
+
+    def _flush(self) -> None:
+        """Adds the pending paragraphs to the count matrix and stats"""
+
+        if not self._n_pending:
+            return
+        rows = np.frombuffer(self._pending_rows, dtype=np.int64)
+        cols = np.frombuffer(self._pending_cols, dtype=np.int64)
+        batch = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                                  shape=(self._n_pending, len(self._words)))
+        if self.keep_counts:
+            self._matrix = sparse.vstack([self._matrix, batch], format='csr', dtype=np.int64)
+        if self._stats is not None:
+            self._stats.add(batch @ self._projection, np.frombuffer(self._pending_groups, dtype=np.int64))
+            self._pending_groups = array('q')
+        self._n_pending, self._pending_rows, self._pending_cols = 0, array('q'), array('q')
+
+    def __getstate__(self):
+        self._flush()
+        state = self.__dict__.copy()
+        state['_group_mapping'] = None  # Reloaded from its path or set again, see class docstring
+        return state
+
+    def __setstate__(self, state):
+        if '_matrix' not in state:
+            # Pickled by the previous implementation, holding a list of counts per document
+            state = LexCounter.from_state({'params': {'lex_mapping': state['lex_mapping']},
+                                           'data': {'lex_counts': state['lex_counts']}}).__dict__
+        self.__dict__.update(state)
+
     def to_pickle(self, path):
         """Pickles the LexCounter object at the specified location."""
 
@@ -122,3 +377,30 @@ class LexCounter:
     @classmethod
     def read_pickle(cls, path):
         return pickle.load(open(path, 'rb'))
+
+
+# Group mappings loaded by this process, by (path, modification time): worker processes load each mapping once
+_LOADED_GROUP_MAPPINGS = {}
+
+
+def load_group_mapping(path: Path) -> tuple[dict, str]:
+    """Loads a pickled group mapping (dict or pandas Series, doc id -> group) once per process, and returns it with its
+    hash"""
+
+    path = Path(path)
+    key = (str(path), path.stat().st_mtime_ns)
+    if key not in _LOADED_GROUP_MAPPINGS:
+        mapping = pd.read_pickle(path)
+        mapping = mapping.to_dict() if isinstance(mapping, pd.Series) else dict(mapping)
+        _LOADED_GROUP_MAPPINGS.clear()
+        _LOADED_GROUP_MAPPINGS[key] = (mapping, group_mapping_hash(mapping))
+    return _LOADED_GROUP_MAPPINGS[key]
+
+
+def group_mapping_hash(group_mapping: Mapping[str, str]) -> str:
+    """Hash of a group mapping, independent of the order of its keys"""
+
+    h = hashlib.blake2b(digest_size=16)
+    for doc_id, group in sorted((str(doc_id), str(group)) for doc_id, group in group_mapping.items()):
+        h.update(f'{doc_id}\t{group}\n'.encode('utf-8'))
+    return h.hexdigest()
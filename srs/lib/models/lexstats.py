@@ -0,0 +1,150 @@
+"""Sufficient statistics of the lexical category counts, grouped, to compute means and correlations without keeping
+the paragraph x category table.
+
+For each group of paragraphs (e.g. the clusters of their documents), LexStats holds the number of paragraphs n, the sums
+s of each category column and the cross-product matrix S = XᵀX of the counts X. These are integers, updated batch by
+batch and simply added together when merging shards, so they are exact. Means, covariances and correlations of any
+union of groups are then exact functions of the summed accumulators:
+
+    mean = s / n
+    cov = (n * S - s sᵀ) / (n * (n - 1))
+    corr_ij = (n * S - s sᵀ)_ij / sqrt((n * S - s sᵀ)_ii * (n * S - s sᵀ)_jj)
+
+which are the values of DataFrame.mean(), cov() and corr() on the rows of the groups (corr is NaN for columns without
+variance, like pandas). Memory is O(groups x categories²), instead of O(paragraphs x categories):
+
+    stats = lc.stats  # LexCounter(lex_mapping, group_mapping=doc_clusters)
+    corpus_corrs = stats.corr()
+    cluster_corrs = stats.corr(['cluster_0'])
+"""
+from typing import Hashable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import pickle
+from scipy import sparse
+
+
+class LexStats:
+    """Per group count n, column sums and cross-product matrix of count vectors, see module docstring.
+
+    Attributes
+    ----------
+    columns: list[str]
+        Labels of the count columns, e.g. the lexical categories
+    groups: list
+        Group labels, by index. Rows without a group are in the None group, only used for the whole corpus values.
+    n: np.ndarray
+        Number of rows of each group
+    sums: np.ndarray
+        (groups, columns) sums of the counts
+    cross: np.ndarray
+        (groups, columns, columns) sums of the products of the counts of each pair of columns
+    """
+
+    def __init__(self, columns: Iterable[str]):
+        self.columns = list(columns)
+        self.groups = []
+        self._group_indices = {}
+        k = len(self.columns)
+        self.n = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, k), dtype=np.int64)
+        self.cross = np.zeros((0, k, k), dtype=np.int64)
+
+    def group_index(self, group: Optional[Hashable]) -> int:
+        """Index of a group, added if not known yet"""
+
+        index = self._group_indices.get(group)
+        if index is None:
+            index = self._group_indices[group] = len(self.groups)
+            self.groups.append(group)
+            k = len(self.columns)
+            self.n = np.append(self.n, 0)
+            self.sums = np.concatenate([self.sums, np.zeros((1, k), dtype=np.int64)])
+            self.cross = np.concatenate([self.cross, np.zeros((1, k, k), dtype=np.int64)])
+        return index
+
+    def add(self, counts, group_indices: np.ndarray) -> None:
+        """Adds rows of counts (sparse or dense rows x columns matrix), given the group index of each row"""
+
+        counts = sparse.csr_matrix(counts, dtype=np.int64)
+        group_indices = np.asarray(group_indices, dtype=np.int64)
+        self.n += np.bincount(group_indices, minlength=len(self.groups))
+        for g in np.unique(group_indices):
+            rows = counts[group_indices == g]
+            self.sums[g] += np.asarray(rows.sum(axis=0), dtype=np.int64).ravel()
+            self.cross[g] += (rows.T @ rows).toarray()
+
+    def merge(self, other: 'LexStats') -> None:
+        """Adds the accumulators of another LexStats with the same columns, group by group"""
+
+        if self.columns != other.columns:
+            raise ValueError('Only LexStats with the same columns can be merged')
+        for i, group in enumerate(other.groups):
+            g = self.group_index(group)
+            self.n[g] += other.n[i]
+            self.sums[g] += other.sums[i]
+            self.cross[g] += other.cross[i]
+
+    def totals(self, groups: Optional[Iterable[Hashable]] = None) -> tuple[int, np.ndarray, np.ndarray]:
+        """Summed (n, sums, cross) of groups, or of all the rows if groups is None. Unknown groups have no rows."""
+
+        indices = (list(range(len(self.groups))) if groups is None
+                   else [self._group_indices[g] for g in groups if g in self._group_indices])
+        return int(self.n[indices].sum()), self.sums[indices].sum(axis=0), self.cross[indices].sum(axis=0)
+
+    def mean(self, groups: Optional[Iterable[Hashable]] = None) -> pd.Series:
+        n, sums, _ = self.totals(groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.Series(sums / n, index=self.columns)
+
+    def cov(self, groups: Optional[Iterable[Hashable]] = None) -> pd.DataFrame:
+        n, _, _ = self.totals(groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = self._scaled_scatter(groups) / (n * (n - 1)) if n > 1 else np.nan
+        return pd.DataFrame(values, index=self.columns, columns=self.columns, dtype=np.float64)
+
+    def corr(self, groups: Optional[Iterable[Hashable]] = None) -> pd.DataFrame:
+        scatter = self._scaled_scatter(groups)
+        variances = np.diag(scatter)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = scatter / np.sqrt(np.outer(variances, variances))
+        values[np.outer(variances, variances) == 0] = np.nan
+        np.fill_diagonal(values, np.where(variances > 0, 1.0, np.nan))
+        return pd.DataFrame(values, index=self.columns, columns=self.columns)
+
+    def _scaled_scatter(self, groups: Optional[Iterable[Hashable]]) -> np.ndarray:
+        """n * S - s sᵀ, computed on integers, i.e. n * (n - 1) times the covariance matrix"""
+
+        n, sums, cross = self.totals(groups)
+        return (n * cross - np.outer(sums, sums)).astype(np.float64)
+
+    def get_state(self) -> dict:
+        return {
+            'columns': list(self.columns),
+            'groups': list(self.groups),
+            'n': self.n.tolist(),
+            'sums': self.sums.tolist(),
+            'cross': self.cross.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'LexStats':
+        stats = cls(state['columns'])
+        k = len(stats.columns)
+        for group in state['groups']:
+            stats.group_index(group)
+        stats.n = np.array(state['n'], dtype=np.int64).reshape(-1)
+        stats.sums = np.array(state['sums'], dtype=np.int64).reshape(-1, k)
+        stats.cross = np.array(state['cross'], dtype=np.int64).reshape(-1, k, k)
+        return stats
+
+    def to_pickle(self, path):
+        pickle.dump(self, open(path, 'wb'))
+
+    @classmethod
+    def read_pickle(cls, path):
+        return pickle.load(open(path, 'rb'))
+
+    def __repr__(self):
+        return f'LexStats({len(self.columns)} columns, {len(self.groups)} groups, {int(self.n.sum())} rows)'
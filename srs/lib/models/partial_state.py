@@ -0,0 +1,171 @@
+"""Versioned partial states of the models, to split a run across several machines sharing a file system.
+
+Each node updates its models on one shard of the corpus (see utils/sharding.py) and saves their partial states:
+
+    save_shard_state(cm, SHARDS_PATH, 'coocs', shard_index, num_shards)
+
+Once all the nodes are done, the partial states are merged into a single model, identical to the one obtained by a
+single node reading the whole corpus (up to the order of dict keys, see the sort options of the models' as_df()):
+
+    cm = merge_partial_states(find_partial_states(SHARDS_PATH, 'coocs'))
+
+or from the command line, which saves the merged model as a pickle:
+
+    python -m srs.lib.models.partial_state merge cooc_model.p D:/results/shards/coocs.shard-*.state
+
+A partial state only holds plain python objects (dicts, lists, ints and strings), built by the models' get_state()
+methods, along with a header giving the format version, the model class, the shard and the model parameters. Loading
+a state saved with another format version raises an error instead of returning a wrong model.
+"""
+import argparse
+import os
+import pickle
+from pathlib import Path
+from typing import Iterable
+
+from srs.lib.models.coocs import CoocsModel
+from srs.lib.models.docterm import DocTermModel
+from srs.lib.models.lexcount import LexCounter
+from srs.lib.models.tagcounts import TagCountsModel
+from srs.lib.utils.sharding import check_shard
+
+STATE_FORMAT = 'srs-partial-state'
+STATE_VERSION = 1
+
+MODEL_CLASSES = {cls.__name__: cls for cls in (TagCountsModel, DocTermModel, CoocsModel, LexCounter)}
+
+
+def partial_state_path(dir_path: Path, name: str, shard_index: int, num_shards: int) -> Path:
+    """Conventional path of the partial state of a model: [dir_path]/[name].shard-[i]-of-[n].state"""
+
+    return Path(dir_path) / f'{name}.shard-{shard_index:04d}-of-{num_shards:04d}.state'
+
+
+def find_partial_states(dir_path: Path, name: str) -> list[Path]:
+    return sorted(Path(dir_path).glob(f'{name}.shard-*-of-*.state'))
+
+
+def save_shard_state(model, dir_path: Path, name: str, shard_index: int, num_shards: int) -> Path:
+    """Saves the partial state of a model at its conventional path in dir_path, and returns this path"""
+
+    Path(dir_path).mkdir(parents=True, exist_ok=True)
+    path = partial_state_path(dir_path, name, shard_index, num_shards)
+    save_partial_state(model, path, shard_index, num_shards)
+    print(f'Partial state of shard {shard_index + 1}/{num_shards} saved at {path}')
+    return path
+
+
+def save_partial_state(model, path: Path, shard_index: int = 0, num_shards: int = 1) -> None:
+    """Saves the state of a model updated on one shard. The file is written atomically, so a state found on disk is
+    always complete."""
+
+    check_shard(shard_index, num_shards)
+    model_class = type(model).__name__
+    if model_class not in MODEL_CLASSES:
+        raise TypeError(f'No partial state format for {model_class}')
+
+    state = model.get_state()
+    header = {
+        'format': STATE_FORMAT,
+        'version': STATE_VERSION,
+        'model': model_class,
+        'shard_index': shard_index,
+        'num_shards': num_shards,
+        'params': state['params'],
+    }
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state['data'], f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_partial_state_header(path: Path) -> dict:
+    """Reads and checks the header of a partial state, without loading the data"""
+
+    with open(path, 'rb') as f:
+        header = pickle.load(f)
+    _check_header(header, path)
+    return header
+
+
+def load_partial_state(path: Path) -> tuple:
+    """Returns the (model, header) of a partial state"""
+
+    with open(path, 'rb') as f:
+        header = pickle.load(f)
+        _check_header(header, path)
+        data = pickle.load(f)
+    model = MODEL_CLASSES[header['model']].from_state({'params': header['params'], 'data': data})
+    return model, header
+
+
+def merge_partial_states(paths: Iterable[Path]):
+    """Merges the partial states of all the shards of a run into a single model.
+
+    All states must hold the same model class with the same parameters, and every shard of the run must be present
+    exactly once. Shards are merged in shard order.
+    """
+
+    headers = {Path(path): read_partial_state_header(path) for path in paths}
+    if not headers:
+        raise ValueError('No partial states to merge')
+
+    first_path, first = next(iter(headers.items()))
+    by_shard = {}
+    for path, header in headers.items():
+        for key in ('model', 'num_shards', 'params'):
+            if header[key] != first[key]:
+                raise ValueError(f'Partial states {first_path} and {path} have different {key}, they cannot be merged')
+        if header['shard_index'] in by_shard:
+            raise ValueError(f'Shard {header["shard_index"]} found twice: {by_shard[header["shard_index"]]} and {path}')
+        by_shard[header['shard_index']] = path
+    missing = [i for i in range(first['num_shards']) if i not in by_shard]
+    if missing:
+        raise ValueError(f'Missing partial states for shards {missing} of {first["num_shards"]}')
+
+    model = None
+    for shard_index in sorted(by_shard):
+        shard_model, _ = load_partial_state(by_shard[shard_index])
+        if model is None:
+            model = shard_model
+        else:
+            model.merge(shard_model)
+        print(f'Merged shard {shard_index + 1}/{first["num_shards"]} ({first["model"]})')
+    return model
+
+
+def _check_header(header, path) -> None:
+    if not isinstance(header, dict) or header.get('format') != STATE_FORMAT:
+        raise ValueError(f'{path} is not a partial state file')
+    if header['version'] != STATE_VERSION:
+        raise ValueError(f'{path} has partial state format version {header["version"]}, expected {STATE_VERSION}')
+    if header['model'] not in MODEL_CLASSES:
+        raise ValueError(f'{path} holds an unknown model class: {header["model"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merges the partial states of a sharded run')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='Merges partial states into a single model')
+    merge_parser.add_argument('output', type=Path, help='Path of the merged model')
+    merge_parser.add_argument('states', type=Path, nargs='+', help='Partial states of all the shards')
+    merge_parser.add_argument('--as-state', action='store_true',
+                              help='Save the merged model as a partial state (single shard) instead of a pickle')
+    info_parser = subparsers.add_parser('info', help='Prints the headers of partial states')
+    info_parser.add_argument('states', type=Path, nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        merged = merge_partial_states(args.states)
+        if args.as_state:
+            save_partial_state(merged, args.output)
+        else:
+            merged.to_pickle(args.output)
+        print(f'Merged {len(args.states)} partial states into {args.output}')
+    else:
+        for state_path in args.states:
+            state_header = read_partial_state_header(state_path)
+            print(f'{state_path}: {state_header["model"]}, shard {state_header["shard_index"]} of '
+                  f'{state_header["num_shards"]}, format version {state_header["version"]}')
@@ -1,50 +1,65 @@
 from collections import Counter, defaultdict
 from typing import Callable, Iterable, Optional, Any
+import numpy as np
 import pandas as pd
 import pickle
+from scipy import sparse
+
+from srs.lib.models.docterm import TAG_CACHE_MAX_SIZE
 
 
 class TagCountsModel:
     """Util object for counting lexical occurrences in lists of tags
 
-    Holds two counters (collections -> Counter), one which tracks total instances of each value in the tag lists, and
-    the other the total number of lists in which each value is found at least once. Each list must be fed to one ot the
-    update methods. Values can be accessed as counters, or returned as pandas dataframes or csv str.
+    Tracks the total instances of each value in the tag lists, and the total number of lists in which each value is
+    found at least once. Each list must be fed to the update method. Values can be accessed as counters, or returned as
+    pandas dataframes or csv str.
 
-    Also allows to track a secondary attribute. If secondary_attr is specified on init, a defaultdict(Counter) will be
-    used to count the secondary attribute values for each values. For example, specifying 'pos' as secondary_attr allows
-    to track the pos counts for each individual value. These counts will be added as columns in the dataframe or csv,
-    where each different value will be represented in a column. Secondary values should therefore have a limited set of
-    possible values, for example counting POS tags for words or lemmas, lemmas for each word, etc.
+    Also allows to track a secondary attribute. If secondary_attr is specified on init, the secondary attribute values
+    are counted for each value. For example, specifying 'pos' as secondary_attr allows to track the pos counts for each
+    individual value. These counts will be added as columns in the dataframe or csv, where each different value will be
+    represented in a column. Secondary values should therefore have a limited set of possible values, for example
+    counting POS tags for words or lemmas, lemmas for each word, etc.
 
-    PROBLEM: secondary wont work for lemmas. Should instead add a number of cols == to the most values possible, and
-    then just add a sorted list for each and padd with none.
+    Values and secondary values are mapped to integer ids as they are found. Updates only append the value ids of the
+    tokens (and of the distinct values of each list) to pending lists, which are added to numpy count arrays and to a
+    sparse value x secondary value matrix every flush_every tokens. The ids of each distinct tag are cached, so
+    filter_fct, transform_fct and getattr are only called once per distinct tag: filter_fct must then only depend on
+    the tag, which is the case of the usual pos filters. Unhashable tags are processed one by one, without cache.
 
     Attributes
     ----------
     total_counts: Counter
-        A Counter object tracking the total instances of each value in the tag lists.
+        A Counter object tracking the total instances of each value in the tag lists. Built from the count arrays on
+        access.
     presence_counts: Counter
         A Counter object tracking the total number of tag lists in which each value is found at least once. For example,
         if each tag list represents a document, this will count the number of docs in which each tag (or word or lemma)
-        is found at least once.
+        is found at least once. Built from the count arrays on access.
     secondary_counts: defaultdict[Counter]
-        A defaultdict tracking the secondary counts for each value.
+        The secondary counts for each value. Built from the sparse matrix on access.
     tag_attr: str, optional
         The tag attribute from which to get the values to count. Assumes tags have named attributes,
         e.g. if using TreeTagger tags are named tuples with attributes such as 'lemma' and 'word'. (default is 'lemma')
     secondary_attr: str, optional
         The attribute for the secondary values to count. Works similar to tag_attr but the count will be performed
         for each different value of tag_attr. (default is None)
+    values: list
+        Every value counted, indexed by value id
+    secondary_values: list
+        Every secondary value counted, indexed by secondary value id
 
     Methods
     -------
-    update_counts(tag_list, transform_fct=lambda x: x, filter_fct=None)
+    update(tag_list)
         Processes a tag list and updates counters
 
     filter_values(filter_fct)
         Filters the values (keys) in the counters, should usually be called after counting.
 
+    merge(other)
+        Adds the counts of another TagCountsModel
+
     as_df()
         Returns the counters as a pandas dataframe
 
@@ -54,51 +69,148 @@ class TagCountsModel:
 
     def __init__(self, tag_attr: str = 'lemma', secondary_attr: str = None,
                  update_filter_fct: Optional[Callable[[Any], bool]] = None,
-                 tranform_fct: Optional[Callable[[str], str]] = None):
-        self.total_counts = Counter()
-        self.presence_counts = Counter()
+                 tranform_fct: Optional[Callable[[str], str]] = None,
+                 flush_every: int = 250_000):
         self.tag_attr = tag_attr
+        self.secondary_attr = secondary_attr
+        self.flush_every = flush_every
         self.total_updates = 0
 
-        self.secondary_counts = defaultdict(Counter)
-        self.secondary_attr = secondary_attr
+        # Defaults are named functions (not lambdas) so the model can be pickled and sent to other processes
+        self.filter_fct = update_filter_fct if update_filter_fct is not None else _keep_all
+        self.transform_fct = tranform_fct if tranform_fct is not None else _identity
+
+        self.values = []
+        self._value_ids = {}
+        self.secondary_values = []
+        self._secondary_ids = {}
+        # Tag -> value id (or (value id, secondary id) pair), -1 for tags not passing filter_fct
+        self._tag_cache = {}
 
-        self.filter_fct = update_filter_fct if update_filter_fct is not None else lambda x: True
-        self.transform_fct = tranform_fct if tranform_fct is not None else lambda x: x
+        self._totals = np.zeros(0, dtype=np.int64)
+        self._presence = np.zeros(0, dtype=np.int64)
+        self._secondary = sparse.csr_matrix((0, 0), dtype=np.int64)
+        # Value id of each pending token, value ids found in each pending list, secondary id of each pending token
+        self._pending_ids, self._pending_presence, self._pending_secondary = [], [], []
 
     def update(self,
                tag_list: Iterable[any],
                ) -> None:
         """Processes a tag list and updates the counters
 
-        Takes a tag list (or an iterable of tags) and updates the counters with the values from tag_attr for each tag.
-        Can pass a transform function to transform these values (e.g. lower case) or to filter (e.g. on another
-        attribute like 'pos' or for min length).
+        Takes a tag list (or an iterable of tags) and counts the values from tag_attr of the tags passing filter_fct,
+        after applying transform_fct to them (both set on init).
 
         Parameters
         ----------
         tag_list: iterable
             Iterable of tag objects (named tuples if using Treetagger) with named attributes. Each object must have a
             named attribute corresponding to tag_attr, which is set on init.
-        transform_fct: callable
-            Function to transform values before counting. Values will be passed as an argument, and the function must
-            return the new value. Ex to transform to lower case: lambda x: x.lower() (default is None)
-        filter_fct: callable returns bool
-            Function to filter tags before counting them. Tags are passed as argument and will only be counted if the
-            function returns True. Ex: lambda x: x.pos in ACCEPTED_POS_TAGS (default is None)
         """
 
-        vals = []
-        for tag in tag_list:
-            if self.filter_fct(tag):
-                value = self.transform_fct(getattr(tag, self.tag_attr))
-                vals.append(value)
-                if self.secondary_attr is not None:
-                    self.secondary_counts[value].update({getattr(tag, self.secondary_attr): 1})
+        tag_list = tag_list if isinstance(tag_list, list) else list(tag_list)
+        try:
+            entries = list(map(self._tag_cache.get, tag_list))
+        except TypeError:
+            # Unhashable tags, processed one by one
+            entries = [self._tag_entry(tag) for tag in tag_list]
+        else:
+            if None in entries:
+                entries = [entry if entry is not None else self._cache_tag(tag)
+                           for entry, tag in zip(entries, tag_list)]
 
-        self.total_counts.update(vals)
-        self.presence_counts.update(set(vals))
+        if self.secondary_attr is not None:
+            entries = [entry if entry != -1 else (-1, -1) for entry in entries]
+            ids, secondary_ids = zip(*entries) if entries else ((), ())
+            self._pending_secondary.extend(secondary_ids)
+        else:
+            ids = entries
+        self._pending_ids.extend(ids)
+        self._pending_presence.extend(set(ids))
         self.total_updates += 1
+        if len(self._pending_ids) >= self.flush_every:
+            self._flush()
+
+    def merge(self, other: 'TagCountsModel') -> None:
+        """Adds the counts of another TagCountsModel, e.g. one updated on another part of the corpus"""
+
+        self._flush()
+        other._flush()
+        other_ids = np.flatnonzero(other._totals)
+        ids = np.array([self._value_id(other.values[i]) for i in other_ids], dtype=np.int64)
+        self._grow()
+        self._totals[ids] += other._totals[other_ids]
+        self._presence[ids] += other._presence[other_ids]
+
+        if self.secondary_attr is not None:
+            secondary_ids = np.array([self._secondary_id(value) for value in other.secondary_values], dtype=np.int64)
+            self._grow()
+            counts = other._secondary[other_ids].tocoo()
+            self._secondary = self._secondary + sparse.csr_matrix(
+                (counts.data, (ids[counts.row], secondary_ids[counts.col])), shape=self._secondary.shape)
+        self.total_updates += other.total_updates
+
+    @property
+    def total_counts(self) -> Counter:
+        self._flush()
+        return Counter({self.values[i]: int(self._totals[i]) for i in np.flatnonzero(self._totals)})
+
+    @property
+    def presence_counts(self) -> Counter:
+        self._flush()
+        return Counter({self.values[i]: int(self._presence[i]) for i in np.flatnonzero(self._totals)})
+
+    @property
+    def secondary_counts(self) -> defaultdict:
+        self._flush()
+        secondary_counts = defaultdict(Counter)
+        if self.secondary_attr is None:
+            return secondary_counts
+        matrix = self._secondary
+        for i in np.flatnonzero(self._totals):
+            row = slice(matrix.indptr[i], matrix.indptr[i + 1])
+            secondary_counts[self.values[i]].update({self.secondary_values[j]: int(count)
+                                                     for j, count in zip(matrix.indices[row], matrix.data[row])})
+        return secondary_counts
+
+    def get_state(self) -> dict:
+        """Returns the parameters and counts of the model as plain python objects, see models/partial_state.py. Update
+        filter and transform functions are not part of the state."""
+
+        return {
+            'params': {'tag_attr': self.tag_attr, 'secondary_attr': self.secondary_attr},
+            'data': {
+                'total_counts': dict(self.total_counts),
+                'presence_counts': dict(self.presence_counts),
+                'secondary_counts': {value: dict(counter) for value, counter in self.secondary_counts.items()},
+                'total_updates': self.total_updates,
+            },
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'TagCountsModel':
+        """Rebuilds a model from get_state(). Update functions must be set again before updating it further."""
+
+        model = cls(**state['params'])
+        data = state['data']
+        ids = np.array([model._value_id(value) for value in data['total_counts']], dtype=np.int64)
+        model._grow()
+        model._totals[ids] = list(data['total_counts'].values())
+        model._presence[ids] = [data['presence_counts'][value] for value in data['total_counts']]
+
+        rows, cols, counts = [], [], []
+        for value, secondary_counts in data['secondary_counts'].items():
+            value_id = model._value_id(value)
+            for secondary_value, count in secondary_counts.items():
+                rows.append(value_id)
+                cols.append(model._secondary_id(secondary_value))
+                counts.append(count)
+        model._grow()
+        if counts:
+            model._secondary = model._secondary + sparse.csr_matrix((counts, (rows, cols)),
+                                                                    shape=model._secondary.shape, dtype=np.int64)
+        model.total_updates = data['total_updates']
+        return model
 
     def filter_values(self, filter_fct: Callable[[any], bool]) -> None:
         """Filters values (keys) in counters
@@ -106,7 +218,8 @@ class TagCountsModel:
         Tests each value (key) in the counters against the passed function. Each value is passed to the function, and
         only those returning true are kept. In other words, it filters values based on some criterion. Should usually be
         called after updating. Does a similar job as filter_fct in update_counts(), but is only called once for each
-        unique value instead of once per tag, which makes it faster for heavier operations.
+        unique value instead of once per tag, which makes it faster for heavier operations. The counts of the removed
+        values are reset as a vectorized mask, so they start again from zero if they are found by later updates.
 
         Parameters
         ----------
@@ -115,19 +228,23 @@ class TagCountsModel:
             True will be kept
         """
 
-        for value in list(self.total_counts.keys()):
-            if not filter_fct(value):
-                del self.total_counts[value]
-                del self.presence_counts[value]
-                if self.secondary_attr is not None:
-                    del self.secondary_counts[value]
-
-    def as_df(self, max_sec_cols: int = 30) -> pd.DataFrame:
+        self._flush()
+        counted = np.flatnonzero(self._totals)
+        removed = counted[~np.array([bool(filter_fct(self.values[i])) for i in counted], dtype=bool)]
+        self._totals[removed] = 0
+        self._presence[removed] = 0
+        if self.secondary_attr is not None and len(removed):
+            is_removed = np.zeros(len(self.values), dtype=bool)
+            is_removed[removed] = True
+            self._secondary.data[np.repeat(is_removed, np.diff(self._secondary.indptr))] = 0
+            self._secondary.eliminate_zeros()
+
+    def as_df(self, max_sec_cols: int = 30, sort: bool = False) -> pd.DataFrame:
         """Returns the counters as a pandas dataframe
 
-        Makes a dataframe from the counters. Will use the values (counters' keys) as index and have two columns
-        corresponding to total_counts and presence_counts. If a secondary_attr was specified, will add a column for
-        each possible value in secondary_counts. This may take a good while to run on larger datasets.
+        Makes a dataframe from the count arrays. Will use the values as index and have two columns corresponding to
+        total_counts and presence_counts. If a secondary_attr was specified, will add a column for each possible value
+        in secondary_counts.
 
         Parameters
         ----------
@@ -141,8 +258,11 @@ class TagCountsModel:
             If there are 30 or less different POS tags across the data, a column will be added for each one, with the
             value of each cell representing the number of times each word was fond with each tag.
             Else, if there are more than 30 different POS tags, the new columns will list which tags were found at least
-            once for each word. The number of columns equals to the maximum number of different tags found for a word.
-            For words with fewer pos tags, extra columns are filled wiht an empty string.
+            once for each word, in sorted order. The number of columns equals to the maximum number of different tags
+            found for a word. For words with fewer pos tags, extra columns are filled with an empty string.
+        sort: bool
+            Whether to sort the values (index). Otherwise, values are in the order they were first counted, which
+            depends on the order of the updates.
 
         Returns
         -------
@@ -151,25 +271,114 @@ class TagCountsModel:
             will be added if a secondary attribute was specified, see above for details.
         """
 
-        df = pd.DataFrame({'total_counts': pd.Series(self.total_counts),
-                           'article_counts': pd.Series(self.presence_counts)})
+        self._flush()
+        counted = np.flatnonzero(self._totals)
+        index = pd.Index([self.values[i] for i in counted])
+        df = pd.DataFrame({'total_counts': self._totals[counted], 'article_counts': self._presence[counted]},
+                          index=index)
 
         if self.secondary_attr is not None:
-            unique_sec_vals = sorted({v for c in self.secondary_counts.values() for v in c.keys()})
-            if len(unique_sec_vals) > max_sec_cols:
-                most_sec_vals = max(len(c) for c in self.secondary_counts.values())
+            matrix = self._secondary[counted]
+            used = np.flatnonzero(matrix.getnnz(axis=0))
+            if len(used) > max_sec_cols:
+                row_lengths = np.diff(matrix.indptr)
+                most_sec_vals = int(row_lengths.max())
                 cols = [f'{self.secondary_attr}_{i}' for i in range(most_sec_vals)]
-                d = {v: list(c.keys()) + [''] * (most_sec_vals - len(c.keys()))
-                     for v, c in self.secondary_counts.items()}
-                sf = pd.DataFrame.from_dict(d, orient='index', columns=cols)
-
+                # Secondary values of each row in sorted order, so the table doesn't depend on the update order
+                ranks = np.empty(len(self.secondary_values), dtype=np.int64)
+                ranks[sorted(range(len(self.secondary_values)), key=self.secondary_values.__getitem__)] = \
+                    np.arange(len(self.secondary_values))
+                row_ids = np.repeat(np.arange(len(counted)), row_lengths)
+                indices = matrix.indices[np.lexsort((ranks[matrix.indices], row_ids))]
+                rows = [[self.secondary_values[j] for j in indices[matrix.indptr[i]:matrix.indptr[i + 1]]]
+                        + [''] * (most_sec_vals - row_lengths[i]) for i in range(len(counted))]
+                sf = pd.DataFrame(rows, index=index, columns=cols)
             else:
-                # d = {k: [v[col] for col in unique_sec_vals] for k, v in self.secondary_counts.items()}
-                sf = pd.DataFrame.from_dict({k: [v[col] for col in unique_sec_vals]
-                                             for k, v in self.secondary_counts.items()},
-                                            columns=unique_sec_vals, orient='index')
+                used = sorted(used, key=lambda j: self.secondary_values[j])
+                sf = pd.DataFrame(matrix[:, used].toarray(), index=index,
+                                  columns=[self.secondary_values[j] for j in used])
             df = pd.concat([df, sf], axis=1)
-        return df
+        return df.sort_index() if sort else df
+
+    def _tag_entry(self, tag):
+        """Value id of a tag (or (value id, secondary id) pair if secondary_attr is set), -1 if it doesn't pass
+        filter_fct"""
+
+        if not self.filter_fct(tag):
+            return -1
+        value_id = self._value_id(self.transform_fct(getattr(tag, self.tag_attr)))
+        if self.secondary_attr is not None:
+            return value_id, self._secondary_id(getattr(tag, self.secondary_attr))
+        return value_id
+
+    def _cache_tag(self, tag):
+        entry = self._tag_entry(tag)
+        if len(self._tag_cache) >= TAG_CACHE_MAX_SIZE:
+            self._tag_cache.clear()
+        self._tag_cache[tag] = entry
+        return entry
+
+    def _value_id(self, value) -> int:
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = self._value_ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def _secondary_id(self, secondary_value) -> int:
+        secondary_id = self._secondary_ids.get(secondary_value)
+        if secondary_id is None:
+            secondary_id = self._secondary_ids[secondary_value] = len(self.secondary_values)
+            self.secondary_values.append(secondary_value)
+        return secondary_id
+
+    def _grow(self) -> None:
+        """Extends the count arrays and the secondary matrix to the values and secondary values found so far"""
+
+        n_values = len(self.values)
+        if len(self._totals) < n_values:
+            self._totals = np.concatenate([self._totals, np.zeros(n_values - len(self._totals), dtype=np.int64)])
+            self._presence = np.concatenate([self._presence,
+                                             np.zeros(n_values - len(self._presence), dtype=np.int64)])
+        if self.secondary_attr is not None and self._secondary.shape != (n_values, len(self.secondary_values)):
+            self._secondary.resize(n_values, len(self.secondary_values))
+
+    def _flush(self) -> None:
+        """Adds the pending ids to the count arrays and the secondary matrix"""
+
+        if not self._pending_ids and not self._pending_presence:
+            self._grow()
+            return
+        self._grow()
+        n_values = len(self.values)
+        ids = np.array(self._pending_ids, dtype=np.int64)
+        # Excluded tags have id -1, shifted to bin 0 and dropped
+        self._totals += np.bincount(ids + 1, minlength=n_values + 1)[1:]
+        self._presence += np.bincount(np.array(self._pending_presence, dtype=np.int64) + 1, minlength=n_values + 1)[1:]
+        if self.secondary_attr is not None:
+            secondary_ids = np.array(self._pending_secondary, dtype=np.int64)
+            counted = ids >= 0
+            self._secondary = self._secondary + sparse.csr_matrix(
+                (np.ones(counted.sum(), dtype=np.int64), (ids[counted], secondary_ids[counted])),
+                shape=self._secondary.shape)
+        self._pending_ids, self._pending_presence, self._pending_secondary = [], [], []
+
+    def __getstate__(self):
+        self._flush()
+        state = self.__dict__.copy()
+        state['_tag_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        if 'total_counts' in state:
+            # Pickled by the previous implementation, holding Counters
+            model = TagCountsModel.from_state({'params': {'tag_attr': state['tag_attr'],
+                                                          'secondary_attr': state['secondary_attr']},
+                                               'data': state})
+            model.filter_fct = state['filter_fct']
+            model.transform_fct = state['transform_fct']
+            state = model.__dict__
+        self.__dict__.update(state)
 
     def as_csv(self):
         """Returns the counters as csv
@@ -193,3 +402,10 @@ class TagCountsModel:
     def read_pickle(cls, path):
         return pickle.load(open(path, 'rb'))
 
+
+def _keep_all(tag) -> bool:
+    return True
+
+
+def _identity(value):
+    return value
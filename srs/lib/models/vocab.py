@@ -0,0 +1,259 @@
+"""Bounded memory vocabulary selection on document frequencies.
+
+The vocabulary of the docterm matrix is made of the values counted by a TagCountsModel, filtered with filter_values(),
+whose article counts (document frequencies, df) are between min_df and max_df_ratio times the number of distinct
+values. Counting every value with a TagCountsModel keeps all the rare values (typos, OCR garbage, ...) in memory until
+the end, while only a few thousand of them are selected. VocabularyBuilder selects the same vocabulary in two passes
+over the documents, in bounded memory:
+
+    builder = VocabularyBuilder(min_df=50, max_df_ratio=0.3, update_filter_fct=PosFilter(TT_NVA_TAGS),
+                                value_filter_fct=is_word)
+    for tags in abstracts:
+        builder.update_sketch(tags)
+    for tags in abstracts:
+        builder.update_counts(tags)
+    vocab = builder.vocabulary()
+
+Pass 1 counts the df of every value in a count-min sketch, a fixed size (depth, width) table of counters. Each value
+increments one counter per row, chosen by hashing, and its estimated df is the minimum of its counters. Counters are
+shared by colliding values but only ever incremented, so the estimate is never below the true df.
+
+Pass 2 counts exactly the df of the candidates, the values whose estimated df is at least min_df. Since estimates
+never underestimate, every value with a true df >= min_df is a candidate: the lower threshold is applied exactly.
+
+The upper threshold needs the exact number of distinct values N. Pass 2 keeps the distinct values in a set capped at
+n_docs / max_df_ratio + 1 values. If the cap is never reached, the set holds all the values and N is exact. Otherwise
+N > n_docs / max_df_ratio, so max_df_ratio * N > n_docs >= df for every value, and the upper threshold keeps
+everything, as it would with the exact N. Both thresholds being applied exactly, the vocabulary is the one selected
+from a TagCountsModel.
+
+Memory is bounded by the sketch, the candidates and the distinct values set. The number of candidates is bounded by
+the sum of the dfs divided by min_df (values with a true df >= min_df), plus the values wrongly promoted by collisions.
+With probability 1 - exp(-depth), estimates exceed true dfs by at most e / width times the sum of the dfs (the
+classic count-min bound), which gives the ceiling returned by report().
+"""
+import hashlib
+import math
+from collections import Counter
+from typing import Any, Callable, Iterable, Optional
+
+import numpy as np
+
+# Approximate size of a value held in a set or dict (short str object, hash table slot and int count)
+ENTRY_BYTES = 120
+
+
+class CountMinSketch:
+    """Count-min sketch of string keys, with fixed memory: depth rows of width int32 counters.
+
+    Keys are hashed once with blake2b, and the column of each row is derived from the two halves of the hash (double
+    hashing). Increments are buffered and added to the table with np.bincount, flush() must be called before reading
+    estimates, which estimate() does.
+
+    Attributes
+    ----------
+    width: int
+        Number of counters per row
+    depth: int
+        Number of rows
+    table: np.ndarray
+        (depth, width) counters
+    total: int
+        Sum of all increments, which bounds the overestimation of the counts, see error_bound()
+    """
+
+    def __init__(self, width: int = 2**20, depth: int = 4, flush_every: int = 2**16):
+        self.width = width
+        self.depth = depth
+        self.flush_every = flush_every
+        self.table = np.zeros((depth, width), dtype=np.int32)
+        self.total = 0
+        self._pending = []
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def add(self, keys: Iterable[str]) -> None:
+        """Increments the count of each key by one"""
+
+        self._pending.extend(keys)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        for row, columns in enumerate(self._columns(self._pending)):
+            self.table[row] += np.bincount(columns, minlength=self.width).astype(np.int32)
+        self.total += len(self._pending)
+        self._pending = []
+
+    def estimate(self, keys: list[str]) -> np.ndarray:
+        """Estimated counts of the keys, never below their true counts"""
+
+        self.flush()
+        if not keys:
+            return np.zeros(0, dtype=np.int32)
+        return np.min([self.table[row, columns] for row, columns in enumerate(self._columns(keys))], axis=0)
+
+    def error_bound(self) -> float:
+        """Estimates exceed true counts by at most this value, with probability 1 - exp(-depth)"""
+
+        return math.e / self.width * self.total
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        """Adds the counts of another sketch of the same shape, e.g. one updated on another part of the corpus"""
+
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Only sketches of the same shape can be merged')
+        self.flush()
+        other.flush()
+        self.table += other.table
+        self.total += other.total
+
+    def _columns(self, keys: list[str]) -> list[np.ndarray]:
+        digests = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest() for key in keys)
+        hashes = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+        h1, h2 = hashes[:, 0], hashes[:, 1] | np.uint64(1)
+        return [((h1 + np.uint64(row) * h2) % np.uint64(self.width)).astype(np.intp) for row in range(self.depth)]
+
+
+class VocabularyBuilder:
+    """Selects the values whose document frequency (df) is between min_df and max_df_ratio times the number of
+    distinct values, in two passes and bounded memory. See module docstring.
+
+    Values are taken from the tags like TagCountsModel does: tag_attr of the tags passing update_filter_fct. The values
+    not passing value_filter_fct are then ignored, like after TagCountsModel.filter_values(). Each update is one
+    document.
+
+    Attributes
+    ----------
+    min_df: int
+        Minimum df of the vocabulary values
+    max_df_ratio: float
+        Maximum df of the vocabulary values, as a ratio of the number of distinct values
+    tag_attr: str
+        The tag attribute counted, e.g. 'lemma'
+    filter_fct: Callable
+        Only the tags for which it returns True are counted
+    value_filter_fct: Callable
+        Only the values for which it returns True are counted
+    sketch: CountMinSketch
+        df estimates of pass 1
+    candidate_counts: Counter
+        Exact df of the candidates, counted in pass 2
+    n_docs: int
+        Number of documents of pass 1
+    """
+
+    def __init__(self, min_df: int = 50, max_df_ratio: float = 0.3, tag_attr: str = 'lemma',
+                 update_filter_fct: Optional[Callable[[Any], bool]] = None,
+                 value_filter_fct: Optional[Callable[[str], bool]] = None,
+                 width: int = 2**20, depth: int = 4):
+        self.min_df = min_df
+        self.max_df_ratio = max_df_ratio
+        self.tag_attr = tag_attr
+        self.filter_fct = update_filter_fct if update_filter_fct is not None else _keep_all
+        self.value_filter_fct = value_filter_fct if value_filter_fct is not None else _keep_all
+
+        self.sketch = CountMinSketch(width, depth)
+        self.n_docs = 0
+        self.candidate_counts = Counter()
+        self._counted_docs = 0
+        self._distinct = set()
+        self._distinct_cap = None
+
+    def update_sketch(self, tag_list: Iterable[Any]) -> None:
+        """Pass 1: adds the values of a document to the df sketch"""
+
+        if self._distinct_cap is not None:
+            raise RuntimeError('The sketch cannot be updated once update_counts() was called')
+        self.sketch.add(self._doc_values(tag_list))
+        self.n_docs += 1
+
+    def update_counts(self, tag_list: Iterable[Any]) -> None:
+        """Pass 2: counts the exact df of the candidates of a document, and the distinct values. Documents must be the
+        same as in pass 1."""
+
+        if self._distinct_cap is None:
+            self.sketch.flush()
+            self._distinct_cap = math.floor(self.n_docs / self.max_df_ratio) + 1
+        values = self._doc_values(tag_list)
+        if self._distinct is not None:
+            self._distinct.update(values)
+            if len(self._distinct) >= self._distinct_cap:
+                # N is large enough for the upper threshold to keep every value, the set is not needed anymore
+                self._distinct = None
+        estimates = self.sketch.estimate(values)
+        self.candidate_counts.update(value for value, estimate in zip(values, estimates) if estimate >= self.min_df)
+        self._counted_docs += 1
+
+    def is_candidate(self, tag) -> bool:
+        """Whether the value of a tag may be in the vocabulary, according to its estimated df. Can be passed as the
+        update_filter_fct of the models updated during pass 2, so they only count the candidates."""
+
+        if not self.filter_fct(tag):
+            return False
+        value = getattr(tag, self.tag_attr)
+        return self.value_filter_fct(value) and bool(self.sketch.estimate([value])[0] >= self.min_df)
+
+    @property
+    def n_distinct(self) -> Optional[int]:
+        """Exact number of distinct values, or None if it is known to be at least the cap of the distinct values set"""
+
+        return len(self._distinct) if self._distinct is not None else None
+
+    def vocabulary(self) -> list[str]:
+        """Returns the sorted vocabulary, the same values as the index of a TagCountsModel's as_df() filtered with
+        (article_counts <= max_df_ratio * N) & (article_counts >= min_df), N being the number of rows of the df"""
+
+        if self._counted_docs != self.n_docs:
+            raise RuntimeError(f'Pass 2 counted {self._counted_docs} documents, pass 1 counted {self.n_docs}')
+        max_df = self.max_df_ratio * self.n_distinct if self.n_distinct is not None else math.inf
+        return sorted(value for value, df in self.candidate_counts.items() if self.min_df <= df <= max_df)
+
+    def report(self) -> dict:
+        """Returns the memory ceiling computed after pass 1 and the memory actually used.
+
+        Returns:
+            Dict with the sketch size (bytes), the ceilings of the number of candidates and distinct values held in
+            pass 2 and of the total memory (approximate bytes, see ENTRY_BYTES), and the same values as measured. The
+            distinct values set counts for its peak size, it is dropped once full.
+        """
+
+        self.sketch.flush()
+        excess = self.sketch.error_bound()
+        max_candidates = (self.sketch.total / (self.min_df - excess)) if self.min_df > excess else math.inf
+        distinct_cap = math.floor(self.n_docs / self.max_df_ratio) + 1
+        n_distinct = self.n_distinct
+        n_distinct_held = n_distinct if n_distinct is not None else distinct_cap
+        return {
+            'n_docs': self.n_docs,
+            'sketch_bytes': self.sketch.nbytes,
+            'max_candidates': max_candidates,
+            'distinct_cap': distinct_cap,
+            'memory_ceiling_bytes': self.sketch.nbytes + (max_candidates + distinct_cap) * ENTRY_BYTES,
+            'n_candidates': len(self.candidate_counts),
+            'n_distinct': n_distinct,
+            'memory_used_bytes': self.sketch.nbytes + (len(self.candidate_counts) + n_distinct_held) * ENTRY_BYTES,
+        }
+
+    def print_report(self) -> None:
+        report = self.report()
+        print(f'Vocabulary builder on {report["n_docs"]} docs: {report["n_candidates"]} candidates '
+              f'(ceiling {report["max_candidates"]:.0f}), '
+              f'{report["n_distinct"] if report["n_distinct"] is not None else "at least " + str(report["distinct_cap"])} '
+              f'distinct values (cap {report["distinct_cap"]})')
+        print(f'Memory: {report["memory_used_bytes"] / 2**20:.1f}MB used, '
+              f'ceiling {report["memory_ceiling_bytes"] / 2**20:.1f}MB (sketch {report["sketch_bytes"] / 2**20:.1f}MB)')
+
+    def _doc_values(self, tag_list: Iterable[Any]) -> list[str]:
+        """Distinct values of a document passing both filters, in order of first occurrence"""
+
+        values = dict.fromkeys(getattr(tag, self.tag_attr) for tag in tag_list if self.filter_fct(tag))
+        return [value for value in values if self.value_filter_fct(value)]
+
+
+def _keep_all(value) -> bool:
+    return True
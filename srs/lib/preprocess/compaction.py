@@ -0,0 +1,222 @@
+"""Tools to rewrite existing DocModels in a more compact form
+
+Can also be run as a command to compact a DocModels folder, e.g. to preview the gain of dropping the xml trees and
+compressing the sections with lzma:
+
+    python -m srs.lib.preprocess.compaction --codec lzma --dry-run
+"""
+import argparse
+import os
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+from srs.lib.catalog import DocCatalog, catalog_row
+from srs.lib.compact_tags import TokenVocab
+from srs.lib.docmodel import CODECS, DocModel
+from srs.lib.utils.parallel import bounded_imap
+
+
+def compact_docmodel_tags(path: Path, vocab_path: Path, n_workers: int = 1,
+                          catalog_path: Optional[Path] = None) -> TokenVocab:
+    """Replaces the Tag lists of all DocModels in a dir by integer-coded CompactTags (see compact_tags.py).
+
+    Works in two passes. The first one collects all the token types and adds the new ones to the corpus vocab, which is
+    then saved. The second one rewrites each DocModel with its tags encoded with this vocab. DocModels are read in
+    sorted order, so the vocab ids do not depend on the file system or the number of workers. Can be run again after
+    adding new DocModels: the existing vocab is extended and DocModels already compacted are left untouched.
+
+    Args:
+        path: Folder holding the pickled DocModels
+        vocab_path: Location of the token vocab file, created if needed. Should not be in the DocModels folder.
+        n_workers: Number of processes to use. 1 runs everything in the current process, None uses all cores.
+        catalog_path: Optional path to the metadata catalog (see catalog.py), updated with the rewritten files.
+
+    Returns:
+        The updated TokenVocab
+    """
+
+    dm_paths = sorted(path / f for f in os.listdir(path) if f.endswith('.p'))
+    vocab = TokenVocab.load(vocab_path, create=True)
+
+    print(f'Collecting token types from {len(dm_paths)} docmodels...')
+    n_types = len(vocab)
+    collected = map(_collect_token_types, dm_paths) if n_workers == 1 \
+        else bounded_imap(_collect_token_types, dm_paths, n_workers=n_workers)
+    for types in collected:
+        for tag in types:
+            if tag not in vocab:
+                vocab.add_type(tag)
+    vocab.save()
+    print(f'Added {len(vocab) - n_types} token types to the vocab ({len(vocab)} in total, {len(vocab.words)} words, '
+          f'{len(vocab.lemmas)} lemmas)')
+
+    print('Rewriting docmodels...')
+    compact_fct = partial(_compact_docmodel, vocab_path)
+    results = map(compact_fct, dm_paths) if n_workers == 1 \
+        else bounded_imap(compact_fct, dm_paths, n_workers=n_workers, ordered=False)
+    rows = []
+    for i, (filename, error, row) in enumerate(results):
+        if error is not None:
+            print(f'Error on {filename}: {error}')
+        else:
+            rows.append(row)
+        if (i+1) % 10000 == 0:
+            print(f'Compacted {i+1} docmodels...')
+    if catalog_path is not None:
+        catalog = DocCatalog(catalog_path)
+        catalog.record(rows)
+        catalog.close()
+    print('Done!')
+    return vocab
+
+
+def _collect_token_types(dm_path: Path) -> list:
+    """Returns the distinct token types of a DocModel, in order of appearance. Skips already compacted DocModels."""
+
+    dm = DocModel.read_pickle(dm_path)
+    types = {}
+    for paragraphs in (dm.tt_abs_paragraphs, dm.tt_text_paragraphs):
+        if isinstance(paragraphs, list):
+            for para in paragraphs:
+                types.update(dict.fromkeys(para))
+    return list(types)
+
+
+def _compact_docmodel(vocab_path: Path, dm_path: Path) -> tuple:
+    """Rewrites a DocModel with CompactTags. Returns (filename, error or None, catalog row or None)"""
+
+    try:
+        dm = DocModel.read_pickle(dm_path)
+        dm.compact_tags(TokenVocab.load(vocab_path))
+        dm.to_pickle(dm_path)
+        return dm_path.name, None, catalog_row(dm, dm_path)
+    except Exception as e:
+        return dm_path.name, repr(e), None
+
+
+def resave_docmodels(path: Path, n_workers: int = 1, catalog_path: Optional[Path] = None) -> None:
+    """Re-saves all DocModels in a dir, e.g. to convert DocModels saved as a single pickle to the sectioned format (see
+    docmodel.py), so their sections can be loaded lazily.
+
+    Args:
+        path: Folder holding the pickled DocModels
+        n_workers: Number of processes to use. 1 runs everything in the current process, None uses all cores.
+        catalog_path: Optional path to the metadata catalog (see catalog.py), updated with the rewritten files.
+    """
+
+    dm_paths = sorted(path / f for f in os.listdir(path) if f.endswith('.p'))
+    print(f'Re-saving {len(dm_paths)} docmodels...')
+    results = map(_resave_docmodel, dm_paths) if n_workers == 1 \
+        else bounded_imap(_resave_docmodel, dm_paths, n_workers=n_workers, ordered=False)
+    rows = []
+    for filename, error, row in results:
+        if error is not None:
+            print(f'Error on {filename}: {error}')
+        else:
+            rows.append(row)
+    if catalog_path is not None:
+        catalog = DocCatalog(catalog_path)
+        catalog.record(rows)
+        catalog.close()
+    print('Done!')
+
+
+def _resave_docmodel(dm_path: Path) -> tuple:
+    """Re-saves a DocModel. Returns (filename, error or None, catalog row or None)"""
+
+    try:
+        dm = DocModel.read_pickle(dm_path)
+        dm.to_pickle(dm_path)
+        return dm_path.name, None, catalog_row(dm, dm_path)
+    except Exception as e:
+        return dm_path.name, repr(e), None
+
+
+def compact_docmodels(path: Path, drop_tree: bool = True, codec: Optional[str] = None, n_workers: int = 1,
+                      dry_run: bool = False, catalog_path: Optional[Path] = None) -> dict:
+    """Rewrites all DocModels in a dir, dropping their xml tree (not needed after tagging) and compressing their sections.
+
+    Each file is written under a temporary name then atomically replaces the original, so an interrupted run leaves
+    every DocModel either untouched or fully compacted. Files are saved with pickle protocol 5.
+
+    Args:
+        path: Folder holding the pickled DocModels
+        drop_tree: Whether to drop the xml trees. They can't be recovered without the source corpus.
+        codec: Compression codec of the sections, None, 'gzip', 'bz2' or 'lzma' (see docmodel.CODECS)
+        n_workers: Number of processes to use. 1 runs everything in the current process, None uses all cores.
+        dry_run: If True, nothing is written and only the size report is made.
+        catalog_path: Optional path to the metadata catalog (see catalog.py), updated with the rewritten files.
+
+    Returns:
+        The size report, a dict with the number of files, the total size before and after (in bytes) and the errors as
+        (filename, error) tuples.
+    """
+
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec: {codec}. Available codecs: {list(CODECS)}')
+    dm_paths = sorted(path / f for f in os.listdir(path) if f.endswith('.p'))
+    print(f'{"Estimating the compaction of" if dry_run else "Compacting"} {len(dm_paths)} docmodels '
+          f'(drop tree: {drop_tree}, codec: {codec})...')
+    compact_fct = partial(_compact_docmodel_file, drop_tree, codec, dry_run)
+    results = map(compact_fct, dm_paths) if n_workers == 1 \
+        else bounded_imap(compact_fct, dm_paths, n_workers=n_workers, ordered=False)
+
+    report = {'files': 0, 'size_before': 0, 'size_after': 0, 'errors': []}
+    rows = []
+    for i, (filename, size_before, size_after, error, row) in enumerate(results):
+        if error is not None:
+            print(f'Error on {filename}: {error}')
+            report['errors'].append((filename, error))
+            continue
+        report['files'] += 1
+        report['size_before'] += size_before
+        report['size_after'] += size_after
+        if row is not None:
+            rows.append(row)
+        if (i+1) % 10000 == 0:
+            print(f'Compacted {i+1} docmodels...')
+
+    if catalog_path is not None and not dry_run:
+        catalog = DocCatalog(catalog_path)
+        catalog.record(rows)
+        catalog.close()
+    before, after = report['size_before'], report['size_after']
+    print(f'{report["files"]} docmodels: {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB '
+          f'({100 * (1 - after / before) if before else 0:.1f}% smaller){" (dry run, nothing written)" if dry_run else ""}')
+    return report
+
+
+def _compact_docmodel_file(drop_tree: bool, codec: Optional[str], dry_run: bool, dm_path: Path) -> tuple:
+    """Rewrites (or only measures, if dry_run) a compacted DocModel.
+
+    Returns (filename, size before, size after, error or None, catalog row or None)
+    """
+
+    try:
+        size_before = os.path.getsize(dm_path)
+        dm = DocModel.read_pickle(dm_path)
+        if drop_tree:
+            dm.tree = None
+        dm.file_codec = codec
+        if dry_run:
+            return dm_path.name, size_before, len(dm.to_bytes()), None, None
+        dm.to_pickle(dm_path)
+        return dm_path.name, size_before, os.path.getsize(dm_path), None, catalog_row(dm, dm_path)
+    except Exception as e:
+        return dm_path.name, 0, 0, repr(e), None
+
+
+if __name__ == '__main__':
+    from srs.config import DOCMODELS_PATH, N_WORKERS, CATALOG_PATH
+
+    parser = argparse.ArgumentParser(description='Drops the xml trees of the DocModels and compresses them.')
+    parser.add_argument('path', nargs='?', type=Path, default=DOCMODELS_PATH, help='DocModels folder')
+    parser.add_argument('--codec', choices=[c for c in CODECS if c is not None], default=None,
+                        help='Compression codec of the sections (default: no compression)')
+    parser.add_argument('--keep-tree', action='store_true', help='Keep the xml trees')
+    parser.add_argument('--dry-run', action='store_true', help='Only report the size gain, nothing is written')
+    parser.add_argument('--n-workers', type=int, default=N_WORKERS, help='Number of processes, 0 uses all cores')
+    args = parser.parse_args()
+    compact_docmodels(args.path, drop_tree=not args.keep_tree, codec=args.codec, n_workers=args.n_workers,
+                      dry_run=args.dry_run, catalog_path=CATALOG_PATH)
@@ -1,63 +1,244 @@
 """"""
 import os
-import treetaggerwrapper
 import xml.etree.ElementTree as ET
+from collections import defaultdict
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
+from srs.lib.catalog import DocCatalog, catalog_row
 from srs.lib.docmodel import DocModel
+from srs.lib.preprocess.tagcache import TagCache
+from srs.lib.preprocess.tagging import make_tagger
+from srs.lib.utils.parallel import bounded_imap
 
 
-def create_docmodels_from_xml_corpus(srs_path: Path, save_path: Path, extract_metadata: bool = True) -> None:
+def create_docmodels_from_xml_corpus(srs_path: Path, save_path: Path, extract_metadata: bool = True,
+                                     n_workers: int = 1, max_pending: Optional[int] = None,
+                                     catalog_path: Optional[Path] = None) -> dict:
     """Reads XMLs and creates DocModel objects. Also extracts metadata unless specified otherwise.
 
     Creates a DocModel for each file in the source folder and pickles it to the destination folder. All files in the
     source folder should be BioMed xml files, and the destination folder should be empty.
 
+    With n_workers > 1, files are parsed and pickled by a pool of worker processes. Each file is still handled by the
+    exact same code as in the serial path, so the resulting pickles are the same.
+
+    If catalog_path is specified, the metadata of each DocModel is recorded in the DocCatalog stored at this location
+    (see catalog.py), so documents can later be selected without unpickling them.
+
     Args:
         srs_path: Path to the folder holding the source XML files
         save_path: Folder in which to save the pickled docmodels
         extract_metadata: Whether to extract metadata on docmodel init
+        n_workers: Number of processes to use. 1 runs everything in the current process, None uses all cores.
+        max_pending: Max number of files submitted to the pool and not yet done, defaults to 4 per worker.
+        catalog_path: Optional path to the metadata catalog, created if needed. None disables the catalog.
 
     Returns:
-
+        The errors, as a dict mapping the pid of the process that handled the files to a list of (filename, error)
+        tuples.
     """
 
     print(f'Starting to parse xml files at {srs_path}...')
-    for i, filename in enumerate(os.listdir(srs_path)):
-        try:
-            DocModel(filename, ET.parse(srs_path / filename), save_path, extract_metadata_on_init=extract_metadata)
-        except:
+    create_fct = partial(_create_docmodel_from_xml, srs_path, save_path, extract_metadata)
+    filenames = os.listdir(srs_path)
+    if n_workers == 1:
+        results = map(create_fct, filenames)
+    else:
+        results = bounded_imap(create_fct, filenames, n_workers=n_workers, max_pending=max_pending, ordered=False)
+
+    errors = defaultdict(list)
+    catalog = _CatalogRecorder(catalog_path)
+    for i, (filename, pid, error, row) in enumerate(results):
+        if error is not None:
             print(f'Error on {filename}')
+            errors[pid].append((filename, error))
+        else:
+            catalog.add(row)
         if (i+1) % 10000 == 0:
             print(f'Parsed {i+1} files...')
+    catalog.close()
     print("Save path : {}".format(save_path))
+    if errors:
+        print(f'{sum(len(e) for e in errors.values())} files could not be parsed')
+    return dict(errors)
 
 
-def extract_and_tag_docmodel_texts(path: Path, trash_sections) -> None:
+def _create_docmodel_from_xml(srs_path: Path, save_path: Path, extract_metadata: bool, filename: str) -> tuple:
+    """Creates and pickles the DocModel for a single XML file.
+
+    Returns (filename, pid, error message or None, catalog row or None)
+    """
+
+    try:
+        dm = DocModel(filename, ET.parse(srs_path / filename), save_path, extract_metadata_on_init=extract_metadata)
+        return filename, os.getpid(), None, catalog_row(dm)
+    except Exception as e:
+        return filename, os.getpid(), repr(e), None
+
+
+def extract_and_tag_docmodel_texts(path: Path, trash_sections, n_workers: int = 1,
+                                   max_pending: Optional[int] = None, batch_size: Optional[int] = None,
+                                   cache_path: Optional[Path] = None, cache_max_entries: int = 2_000_000,
+                                   tagger_backend: str = 'treetagger', catalog_path: Optional[Path] = None) -> dict:
     """Loads and updates all DocModels in a dir by extracting and tagging abstracts and texts.
 
     Should be called after creating DocModels from XMLs to complete the extraction / tokenization / tagging process.
     Also updates abs_words, abs_tokens, text_words and text_tokens metadata.
 
+    Tagging is done by TreeTagger unless another tagger_backend is specified (see preprocess/tagging.py). The 'local'
+    backend makes it possible to run the whole pipeline where TreeTagger isn't installed, but gives different tags.
+
+    With n_workers > 1, the DocModels are spread across a pool of worker processes, each one owning its own tagger (and
+    TreeTagger subprocess). Every document is tagged by its own tag_text calls in both modes, so the updated pickles are
+    the same as with serial tagging. In both modes, a DocModel that can't be loaded or tagged doesn't stop the run: its
+    error is recorded in the returned dict and the other documents are still processed.
+
+    If batch_size is specified, the abstract and text paragraphs of each document are sent to TreeTagger in batches of
+    up to batch_size paragraphs instead of one call per paragraph (see preprocess/tagging.py). This produces the same
+    tags with far fewer round-trips to the TreeTagger subprocess.
+
+    If cache_path is specified, a TagCache stored at this location is consulted before tagging each paragraph (see
+    preprocess/tagcache.py). Repeated paragraphs, or paragraphs already tagged during a previous run, are then read from
+    the cache instead of being tagged again.
+
+    If catalog_path is specified, the token counts of each DocModel are updated in the DocCatalog stored at this
+    location (see catalog.py).
+
     Args:
         path: Folder holding the pickled DocModels
+        trash_sections: XML sections to ignore when extracting the texts, see nlp_params.TRASH_SECTIONS
+        n_workers: Number of processes (and TreeTagger instances) to use. 1 runs everything in the current process,
+            None uses all cores.
+        max_pending: Max number of DocModels submitted to the pool and not yet done, defaults to 4 per worker.
+        batch_size: Max number of paragraphs per tag_text call. None tags each paragraph with its own call.
+        cache_path: Optional path to the tag cache database, created if needed. None disables the cache.
+        cache_max_entries: Max number of paragraphs kept in the tag cache.
+        tagger_backend: Name of the tagger backend, 'treetagger' or 'local'. See preprocess.tagging.make_tagger().
+        catalog_path: Optional path to the metadata catalog, created if needed. None disables the catalog.
 
     Returns:
-
+        The errors, as a dict mapping the pid of the process that handled the files to a list of (filename, error)
+        tuples.
     """
 
-    tagger = treetaggerwrapper.TreeTagger(TAGLANG='en')
     print(f'Starting to extract and tag texts from docmodels at {path}...')
-    for i, dm in enumerate(DocModel.docmodel_generator(path)):
-        dm.extract_abstract(trash_sections)
-        dm.extract_text(trash_sections)
-        dm.treetag_abstract(tagger)
-        dm.treetag_text(tagger)
-
-        # Add token counts as metadata
-        dm.make_token_counts()
-
-        dm.to_pickle()
+    errors = defaultdict(list)
+    cache_hits = cache_misses = 0
+    catalog = _CatalogRecorder(catalog_path)
+    dm_paths = []
+    for filename in sorted(os.listdir(path)):
+        if filename.split('.')[1] != 'p':
+            print(f'Ignored [{filename}] due to wrong file extension')
+            continue
+        dm_paths.append(path / filename)
+
+    cache = None
+    if n_workers == 1:
+        tagger = make_tagger(tagger_backend)
+        cache = TagCache(cache_path, cache_max_entries) if cache_path is not None else None
+        results = map(partial(_extract_and_tag_path, trash_sections, tagger, batch_size, cache), dm_paths)
+    else:
+        results = bounded_imap(partial(_extract_and_tag_worker, trash_sections, batch_size), dm_paths,
+                               n_workers=n_workers, max_pending=max_pending, ordered=False,
+                               initializer=_init_tagger_worker,
+                               initargs=(tagger_backend, cache_path, cache_max_entries))
+    for i, (filename, pid, error, hits, misses, row) in enumerate(results):
+        if error is not None:
+            print(f'Error on {filename}')
+            errors[pid].append((filename, error))
+        else:
+            catalog.add(row)
+        cache_hits += hits
+        cache_misses += misses
         if (i+1) % 10000 == 0: print(f'Processed {i+1} docmodels...')
+
+    if cache is not None:
+        cache.close()
+    catalog.close()
+    if cache_path is not None:
+        lookups = cache_hits + cache_misses
+        print(f'Tag cache: {cache_hits} hits, {cache_misses} misses '
+              f'({100 * cache_hits / lookups if lookups else 0:.1f}% of paragraphs read from the cache)')
     print('Done!')
+    return dict(errors)
+
+
+def _extract_and_tag_docmodel(dm: DocModel, trash_sections, tagger, batch_size: Optional[int] = None,
+                              cache: Optional[TagCache] = None) -> None:
+    """Extracts, tags and counts the tokens of a single DocModel, then pickles it"""
+
+    dm.extract_abstract(trash_sections)
+    dm.extract_text(trash_sections)
+    if batch_size is None:
+        dm.treetag_abstract(tagger, cache=cache)
+        dm.treetag_text(tagger, cache=cache)
+    else:
+        dm.treetag_abstract_and_text(tagger, batch_size, cache)
+
+    # Add token counts as metadata
+    dm.make_token_counts()
+
+    dm.to_pickle()
+
+
+# Each worker process of the tagging pool holds its own TreeTagger and TagCache, set by the pool initializer
+_worker_tagger = None
+_worker_cache = None
+
+
+def _init_tagger_worker(tagger_backend: str = 'treetagger', cache_path: Optional[Path] = None,
+                        cache_max_entries: int = 2_000_000) -> None:
+    global _worker_tagger, _worker_cache
+    _worker_tagger = make_tagger(tagger_backend)
+    _worker_cache = TagCache(cache_path, cache_max_entries) if cache_path is not None else None
+
+
+def _extract_and_tag_worker(trash_sections, batch_size: Optional[int], dm_path: Path) -> tuple:
+    """Pool task, tags a pickled DocModel with the worker's tagger. See _extract_and_tag_path()"""
+
+    return _extract_and_tag_path(trash_sections, _worker_tagger, batch_size, _worker_cache, dm_path)
+
+
+def _extract_and_tag_path(trash_sections, tagger, batch_size: Optional[int], cache: Optional[TagCache],
+                          dm_path: Path) -> tuple:
+    """Loads a pickled DocModel and tags it, catching any error so that the other documents are still processed.
+
+    Returns (filename, pid, error or None, cache hits, cache misses, catalog row or None)
+    """
 
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    row = None
+    try:
+        dm = DocModel.read_pickle(dm_path)
+        _extract_and_tag_docmodel(dm, trash_sections, tagger, batch_size, cache)
+        row = catalog_row(dm)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return dm_path.name, os.getpid(), error, hits, misses, row
+
+
+class _CatalogRecorder:
+    """Buffers catalog rows and records them by chunks. Does nothing if catalog_path is None."""
+
+    def __init__(self, catalog_path: Optional[Path], chunk_size: int = 1000):
+        self.catalog = DocCatalog(catalog_path) if catalog_path is not None else None
+        self.chunk_size = chunk_size
+        self.rows = []
+
+    def add(self, row: dict) -> None:
+        if self.catalog is None:
+            return
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.catalog.record(self.rows)
+            self.rows = []
+
+    def close(self) -> None:
+        if self.catalog is not None:
+            self.catalog.record(self.rows)
+            self.catalog.close()
@@ -0,0 +1,144 @@
+"""Persistent cache of paragraph tags, to avoid tagging the same paragraph twice.
+
+Many paragraphs are repeated across the corpus (funding statements, competing interests, licence text...), and step 1
+may be run several times with small changes to the extraction parameters. Tags are stored in a sqlite database, keyed
+by a hash of the normalised paragraph text, so the cache persists across runs and can be shared by several processes.
+Keys also include a namespace, the name and version of the tagger backend (see tagging.TaggerBackend), so tags of
+different backends can share a cache file without being mixed up.
+"""
+
+import hashlib
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from srs.lib.preprocess.tagging import Tag
+
+
+class TagCache:
+    """On-disk cache mapping paragraphs to their tags, with a size cap and LRU eviction.
+
+    Attributes
+    ----------
+    path: Path
+        Path to the sqlite database file. Created if it doesn't exist.
+    max_entries: int
+        Max number of paragraphs kept in the cache. When exceeded, the least recently used entries are evicted.
+    hits: int
+        Number of paragraphs found in the cache since this object was created.
+    misses: int
+        Number of paragraphs not found in the cache since this object was created.
+    evictions: int
+        Number of entries evicted by this object.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 2_000_000, evict_every: int = 10_000):
+        """TagCache constructor
+
+        Parameters
+        ----------
+        path: Path
+            Path to the sqlite database file. Created if it doesn't exist.
+        max_entries: int
+            Max number of paragraphs kept in the cache.
+        evict_every: int
+            How many new entries to add between each check of the cache size.
+        """
+
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._inserts_since_check = 0
+
+        self._conn = sqlite3.connect(self.path, timeout=120)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS tags (key TEXT PRIMARY KEY, tags BLOB NOT NULL, '
+                           'last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tags_last_used ON tags (last_used)')
+        self._conn.commit()
+
+    @staticmethod
+    def normalise(paragraph: str) -> str:
+        """Returns the paragraph as sent to the tagger: lowered, with whitespaces collapsed (the tokenizer ignores them)"""
+
+        return ' '.join(paragraph.lower().split())
+
+    @classmethod
+    def make_key(cls, paragraph: str, namespace: str) -> str:
+        """Key of the tags of a paragraph given by a tagger backend, namespace being its name and version"""
+
+        return hashlib.sha1(f'{namespace}\0{cls.normalise(paragraph)}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, paragraphs: Iterable[str], namespace: str) -> list[Optional[list]]:
+        """Looks up paragraphs in the cache, among the tags of the namespace's tagger. Returns a list holding the tags
+        for each paragraph, or None if not found"""
+
+        keys = [self.make_key(para, namespace) for para in paragraphs]
+        found = {}
+        unique_keys = list(set(keys))
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i + 500]
+            rows = self._conn.execute(f'SELECT key, tags FROM tags WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            found.update(rows)
+
+        if found:
+            now = time.time()
+            self._conn.executemany('UPDATE tags SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+            self._conn.commit()
+
+        results = []
+        for key in keys:
+            if key in found:
+                self.hits += 1
+                results.append([Tag(*t) for t in pickle.loads(found[key])])
+            else:
+                self.misses += 1
+                results.append(None)
+        return results
+
+    def put_many(self, paragraphs: Iterable[str], tags_list: Iterable[list], namespace: str) -> None:
+        """Stores the tags of each paragraph given by the namespace's tagger, then evicts the oldest entries if needed"""
+
+        now = time.time()
+        rows = [(self.make_key(para, namespace), pickle.dumps([tuple(t) for t in tags], protocol=pickle.HIGHEST_PROTOCOL), now)
+                for para, tags in zip(paragraphs, tags_list)]
+        self._conn.executemany('INSERT OR REPLACE INTO tags VALUES (?, ?, ?)', rows)
+        self._conn.commit()
+
+        self._inserts_since_check += len(rows)
+        if self._inserts_since_check >= self.evict_every:
+            self._inserts_since_check = 0
+            self.evict()
+
+    def evict(self) -> int:
+        """Deletes the least recently used entries until the cache holds max_entries at most. Returns the number of
+        deleted entries."""
+
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return 0
+        self._conn.execute('DELETE FROM tags WHERE key IN (SELECT key FROM tags ORDER BY last_used LIMIT ?)', (excess,))
+        self._conn.commit()
+        self.evictions += excess
+        return excess
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self),
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
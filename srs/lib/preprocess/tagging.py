@@ -0,0 +1,316 @@
+"""Tagger backends and tools to tag lists of paragraphs, one paragraph per call or in batches.
+
+Two backends are available, see make_tagger():
+- 'treetagger': TreeTagger, through treetaggerwrapper. Used for the published results.
+- 'local': LocalTagger, a fast pure-Python stand-in producing TreeTagger-compatible tags. Its tags are only a rough
+  approximation, but it makes it possible to run and profile the whole pipeline where TreeTagger isn't installed.
+
+With TreeTagger, each tag_text() call is a round-trip through the pipe of the TreeTagger subprocess, which makes the
+per-paragraph approach slow on a large corpus. In batch mode, the paragraphs are pre-processed separately by the
+wrapper, then sent in a single call where they are delimited by SGML markers (passed through untouched by TreeTagger).
+After each paragraph, the batch repeats the same ending sequence the wrapper sends after each text (end flag, dot and
+dummy sentence), so TreeTagger sees the exact same token stream, and produces the same tags, as with one call per
+paragraph.
+
+A TagCache (see preprocess/tagcache.py) can also be passed, in which case only the paragraphs not found in the cache are
+sent to the tagger. Cached tags are namespaced by backend name and version (see TaggerBackend.cache_namespace), so
+backends sharing a cache never get each other's tags.
+"""
+
+import re
+from collections import namedtuple
+
+try:
+    import treetaggerwrapper
+    from treetaggerwrapper import Tag, make_tags
+except ImportError:
+    treetaggerwrapper = None
+
+    # Same structure as treetaggerwrapper's Tag, so the tags can be used the same way
+    Tag = namedtuple('Tag', 'word pos lemma')
+
+    def make_tags(result, exclude_nottags=False):
+        """Simplified version of treetaggerwrapper.make_tags, NotTags are always excluded"""
+
+        tags = []
+        for line in result:
+            items = line.split('\t')
+            if len(items) == 3:
+                tags.append(Tag(*items))
+        return tags
+
+
+# SGML markers used to delimit paragraphs within a batch
+PARA_END_MARKER = '<srs:para-end />'
+PARA_START_MARKER = '<srs:para-start />'
+
+
+def tag_paragraphs(tagger, paragraphs: list[str], batch_size: int = None, cache=None) -> list[list]:
+    """Tags a list of paragraphs and returns a list of Tag lists, one for each paragraph.
+
+    Args:
+        tagger: A TaggerBackend, or a treetaggerwrapper.TreeTagger instance
+        paragraphs: The paragraphs to tag, as str. They are lowered before tagging.
+        batch_size: Max number of paragraphs sent to the tagger in a single call. If None, each paragraph is tagged
+            with its own call.
+        cache: Optional TagCache, consulted before calling the tagger and updated with the new tags.
+
+    Returns:
+        A list [[para1 Tags], [para2 Tags], ...]
+    """
+
+    if cache is not None:
+        namespace = tagger_cache_namespace(tagger)
+        tags = cache.get_many(paragraphs, namespace)
+        missing = [i for i, para_tags in enumerate(tags) if para_tags is None]
+        if missing:
+            missing_paras = [paragraphs[i] for i in missing]
+            new_tags = tag_paragraphs(tagger, missing_paras, batch_size)
+            cache.put_many(missing_paras, new_tags, namespace)
+            for i, para_tags in zip(missing, new_tags):
+                tags[i] = para_tags
+        return tags
+
+    if isinstance(tagger, TaggerBackend):
+        return tagger.tag_paragraphs(paragraphs, batch_size)
+    return treetag_paragraphs(tagger, paragraphs, batch_size)
+
+
+def tagger_cache_namespace(tagger) -> str:
+    """Namespace of the cached tags of a tagger, see TaggerBackend.cache_namespace"""
+
+    if isinstance(tagger, TaggerBackend):
+        return tagger.cache_namespace
+    return TreeTaggerBackend.make_cache_namespace(getattr(tagger, 'lang', None))
+
+
+def treetag_paragraphs(tagger, paragraphs: list[str], batch_size: int = None) -> list[list]:
+    """Tags paragraphs with a treetaggerwrapper.TreeTagger, see tag_paragraphs()"""
+
+    if batch_size is None or batch_size <= 1:
+        return [make_tags(tagger.tag_text(para.lower()), exclude_nottags=True) for para in paragraphs]
+
+    tags = []
+    for i in range(0, len(paragraphs), batch_size):
+        tags.extend(tag_paragraph_batch(tagger, paragraphs[i:i + batch_size]))
+    return tags
+
+
+def tag_paragraph_batch(tagger, paragraphs: list[str]) -> list[list]:
+    """Tags a list of paragraphs in a single TreeTagger tag_text() call. See module docstring for details.
+
+    Falls back to one call per paragraph if a paragraph contains one of the markers, or if the output cannot be split
+    back into the right number of paragraphs.
+    """
+
+    if len(paragraphs) < 2:
+        return treetag_paragraphs(tagger, paragraphs)
+
+    para_ending = [PARA_END_MARKER, '.'] + tagger.dummysequence.split('\n') + [PARA_START_MARKER]
+    lines = []
+    for para in paragraphs:
+        para_lines = tagger.tag_text(para.lower(), prepronly=True)
+        if PARA_END_MARKER in para_lines or PARA_START_MARKER in para_lines:
+            return treetag_paragraphs(tagger, paragraphs)
+        lines.extend(para_lines)
+        lines.extend(para_ending)
+    del lines[-len(para_ending):]
+
+    chunks = split_batch_output(tagger.tag_text(lines, tagonly=True))
+    if len(chunks) != len(paragraphs):
+        print(f'Could not split batch output ({len(chunks)} chunks for {len(paragraphs)} paragraphs), '
+              f'tagging paragraphs one by one')
+        return treetag_paragraphs(tagger, paragraphs)
+
+    return [make_tags(chunk, exclude_nottags=True) for chunk in chunks]
+
+
+def split_batch_output(result: list[str]) -> list[list[str]]:
+    """Splits the tagger output of a batch into paragraphs, dropping the lines between end and start markers"""
+
+    chunks = []
+    current = []
+    in_para = True
+    for line in result:
+        if line == PARA_END_MARKER:
+            chunks.append(current)
+            current = []
+            in_para = False
+        elif line == PARA_START_MARKER:
+            in_para = True
+        elif in_para:
+            current.append(line)
+    chunks.append(current)
+    return chunks
+
+
+### Tagger backends ###
+
+class TaggerBackend:
+    """Base class for tagger backends.
+
+    Backends turn paragraphs into lists of Tag(word, pos, lemma) named tuples, using TreeTagger's english tagset (see
+    nlp_params.TT_TAGLIST). Subclasses must implement tag_text(); tag_paragraphs() can be overridden when the backend
+    has a faster way to process several paragraphs.
+
+    Subclasses also set name and version, which namespace their tags in a TagCache. The version must be changed
+    whenever the backend gives different tags.
+    """
+
+    name = None
+    version = None
+
+    @property
+    def cache_namespace(self) -> str:
+        return f'{self.name}:{self.version}'
+
+    def tag_text(self, text: str) -> list[str]:
+        """Tags a text, returns TreeTagger-like output lines ('word\\tpos\\tlemma')"""
+
+        raise NotImplementedError
+
+    def tag_paragraphs(self, paragraphs: list[str], batch_size: int = None) -> list[list]:
+        """Tags each paragraph (lowered), returns a list [[para1 Tags], [para2 Tags], ...]"""
+
+        return [make_tags(self.tag_text(para.lower()), exclude_nottags=True) for para in paragraphs]
+
+
+class TreeTaggerBackend(TaggerBackend):
+    """TreeTagger backend. Holds a treetaggerwrapper.TreeTagger (and its subprocess)."""
+
+    name = 'treetagger'
+
+    def __init__(self, lang: str = 'en', **tagger_kwargs):
+        if treetaggerwrapper is None:
+            raise ImportError('treetaggerwrapper is not installed, use the \'local\' tagger backend instead')
+        self.tagger = treetaggerwrapper.TreeTagger(TAGLANG=lang, **tagger_kwargs)
+
+    @property
+    def cache_namespace(self) -> str:
+        return self.make_cache_namespace(getattr(self.tagger, 'lang', None))
+
+    @classmethod
+    def make_cache_namespace(cls, lang) -> str:
+        """Namespace of the tags of a TreeTagger, from the wrapper version and the tagger language"""
+
+        version = getattr(treetaggerwrapper, '__version__', None)
+        return f'{cls.name}:{version}:{lang}'
+
+    def tag_text(self, text: str) -> list[str]:
+        return self.tagger.tag_text(text)
+
+    def tag_paragraphs(self, paragraphs: list[str], batch_size: int = None) -> list[list]:
+        return treetag_paragraphs(self.tagger, paragraphs, batch_size)
+
+
+class LocalTagger(TaggerBackend):
+    """Fast and deterministic pure-Python tagger, used as a stand-in for TreeTagger.
+
+    Tokens are split with a regex close to TreeTagger's tokenization. Each token then gets a POS tag and a lemma from a
+    lookup of english function words and irregular verbs, or from suffix rules for the other words. Results are
+    memoized per token. The tags are far less accurate than TreeTagger's, but they have the same structure and
+    distribution of tags is realistic enough to benchmark and test everything downstream of the tagging step.
+    """
+
+    TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|\w+(?:[-'’]\w+)*|[^\w\s]")
+
+    # (pos, lemma) for words with a fixed tag. Lemma None means the word itself.
+    LOOKUP = {
+        **{w: ('DT', None) for w in ['the', 'a', 'an', 'this', 'these', 'those', 'each', 'every', 'no',
+                                     'some', 'any', 'all', 'both', 'either', 'neither', 'another']},
+        **{w: ('IN', None) for w in ['of', 'in', 'on', 'at', 'by', 'for', 'with', 'from', 'into', 'during',
+                                     'between', 'among', 'through', 'after', 'before', 'under', 'over', 'within',
+                                     'without', 'about', 'against', 'than', 'whether', 'because', 'while', 'although',
+                                     'if', 'since', 'as', 'upon', 'via', 'per', 'across', 'towards', 'toward']},
+        **{w: ('CC', None) for w in ['and', 'or', 'but', 'nor', 'plus', 'yet']},
+        **{w: ('PP', None) for w in ['i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them',
+                                     'itself', 'themselves', 'ourselves']},
+        **{w: ('PP$', None) for w in ['my', 'your', 'his', 'its', 'our', 'their']},
+        **{w: ('MD', None) for w in ['can', 'could', 'may', 'might', 'must', 'shall', 'should', 'will', 'would']},
+        **{w: ('RB', None) for w in ['not', 'also', 'however', 'thus', 'therefore', 'very', 'more', 'most', 'only',
+                                     'then', 'here', 'further', 'well', 'even', 'still']},
+        **{w: ('WDT', None) for w in ['which', 'whatever', 'whichever']},
+        **{w: ('WP', None) for w in ['who', 'whom', 'what']},
+        **{w: ('WRB', None) for w in ['when', 'where', 'why', 'how']},
+        'that': ('IN/that', None), 'to': ('TO', None), 'there': ('EX', None), 'whose': ('WP$', None),
+        'be': ('VB', 'be'), 'is': ('VBZ', 'be'), 'are': ('VBP', 'be'), 'am': ('VBP', 'be'), 'was': ('VBD', 'be'),
+        'were': ('VBD', 'be'), 'been': ('VBN', 'be'), 'being': ('VBG', 'be'),
+        'have': ('VHP', 'have'), 'has': ('VHZ', 'have'), 'had': ('VHD', 'have'), 'having': ('VHG', 'have'),
+        'do': ('VDP', 'do'), 'does': ('VDZ', 'do'), 'did': ('VDD', 'do'), 'done': ('VDN', 'do'),
+        'doing': ('VDG', 'do'),
+        'found': ('VVN', 'find'), 'shown': ('VVN', 'show'), 'known': ('VVN', 'know'), 'made': ('VVN', 'make'),
+        'taken': ('VVN', 'take'), 'given': ('VVN', 'give'), 'seen': ('VVN', 'see'), 'led': ('VVN', 'lead'),
+        'data': ('NNS', 'datum'), 'analyses': ('NNS', 'analysis'), 'hypotheses': ('NNS', 'hypothesis'),
+        'mice': ('NNS', 'mouse'), 'children': ('NNS', 'child'), 'women': ('NNS', 'woman'), 'men': ('NNS', 'man'),
+    }
+
+    PUNCT_TAGS = {'.': 'SENT', '!': 'SENT', '?': 'SENT', ',': ',', '(': '(', ')': ')', '[': '(', ']': ')',
+                  ':': ':', ';': ':', '-': ':', '"': "''", '$': '$', '#': '#', '%': 'NN'}
+
+    ADJ_SUFFIXES = ('ous', 'ive', 'ic', 'al', 'able', 'ible', 'ful', 'less', 'ary', 'ant', 'ent')
+
+    name = 'local'
+    # Change this whenever the rules or the lookup above change
+    version = 1
+
+    def __init__(self, max_memo_size: int = 2_000_000):
+        self.max_memo_size = max_memo_size
+        self._memo = {}
+
+    def tag_word(self, word: str) -> Tag:
+        tag = self._memo.get(word)
+        if tag is None:
+            pos, lemma = self._pos_lemma(word)
+            tag = Tag(word, pos, lemma)
+            if len(self._memo) >= self.max_memo_size:
+                self._memo.clear()
+            self._memo[word] = tag
+        return tag
+
+    def tag_text(self, text: str) -> list[str]:
+        return ['\t'.join(tag) for tag in self.tag_tokens(text)]
+
+    def tag_tokens(self, text: str) -> list:
+        tag_word = self.tag_word
+        return [tag_word(word) for word in self.TOKEN_RE.findall(text)]
+
+    def tag_paragraphs(self, paragraphs: list[str], batch_size: int = None) -> list[list]:
+        return [self.tag_tokens(para.lower()) for para in paragraphs]
+
+    def _pos_lemma(self, word: str) -> tuple[str, str]:
+        if word in self.LOOKUP:
+            pos, lemma = self.LOOKUP[word]
+            return pos, lemma if lemma is not None else word
+        if not word[0].isalnum():
+            return self.PUNCT_TAGS.get(word, 'SYM'), word
+        if word[0].isdigit():
+            return 'CD', '@card@'
+        if len(word) > 4 and word.endswith('ly'):
+            return 'RB', word
+        if len(word) > 5 and word.endswith('ing'):
+            return 'VVG', word[:-3]
+        if len(word) > 4 and word.endswith('ed'):
+            return 'VVN', word[:-2] if not word.endswith('ied') else word[:-3] + 'y'
+        if len(word) > 4 and word.endswith(self.ADJ_SUFFIXES):
+            return 'JJ', word
+        if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            if word.endswith('ies'):
+                return 'NNS', word[:-3] + 'y'
+            if word.endswith(('ches', 'shes', 'xes', 'sses')):
+                return 'NNS', word[:-2]
+            return 'NNS', word[:-1]
+        return 'NN', word
+
+
+TAGGER_BACKENDS = {
+    'treetagger': TreeTaggerBackend,
+    'local': LocalTagger,
+}
+
+
+def make_tagger(backend: str = 'treetagger', **kwargs) -> TaggerBackend:
+    """Creates a tagger backend from its name, see TAGGER_BACKENDS. Extra kwargs are passed to the backend."""
+
+    if backend not in TAGGER_BACKENDS:
+        raise ValueError(f'Unknown tagger backend \'{backend}\', choose from {list(TAGGER_BACKENDS)}')
+    return TAGGER_BACKENDS[backend](**kwargs)
@@ -1,8 +1,9 @@
+from collections import Counter
 from dataclasses import dataclass, field
 from typing import Iterable, Tuple
 import re
 
-from charting.lib.utils.test_texts import OFFICE_TEST_SENTENCES
+from srs.lib.utils.test_texts import OFFICE_TEST_SENTENCES
 
 
 @dataclass
@@ -72,6 +73,25 @@ def generate_test_id_tags(texts: Iterable[str], id_prefix: str = 'doc_') -> Tupl
         yield f'{id_prefix}{i}', tag_text(s)
 
 
+class CounterDocTermModel:
+    """The previous DocTermModel counting, kept as a reference for tests and benchmarks
+
+    One Counter per document, the filter is called on each token. Only implements update(), the counts of each document
+    are in doc_word_counts.
+    """
+
+    def __init__(self, tag_attr: str = 'lemma', update_filter_fct=None):
+        self.doc_word_counts = {}
+        self.unique_words = set()
+        self.tag_attr = tag_attr
+        self.filter_fct = update_filter_fct
+
+    def update(self, doc_id: str, tag_list) -> None:
+        c = Counter(getattr(tag, self.tag_attr) for tag in tag_list if self.filter_fct(tag))
+        self.unique_words.update(c.keys())
+        self.doc_word_counts.update({doc_id: c})
+
+
 if __name__ == '__main__':
     tagged_sents = [s for s in generate_test_id_tags(OFFICE_TEST_SENTENCES)]
     print(tagged_sents[0])
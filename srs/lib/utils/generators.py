@@ -1,101 +1,243 @@
 """Generators to cycle through docmodels, and get data based on specific filters and/or properties"""
 import os
-import pickle
+from functools import partial
 from typing import Callable, Optional, Iterable
 
+from srs.lib.catalog import DocCatalog, Where, matches
+from srs.lib.corpus_store import CorpusStore
+from srs.lib.docmodel import DocModel
+from srs.lib.utils.parallel import bounded_imap
+from srs.lib.utils.sharding import ShardFilter, shard_paths
 
-def generate_docmodels_from_paths(path_list: Iterable, vocal: bool = True, filter_fct: Optional[Callable] = None):
+
+def generate_docmodels_from_paths(path_list: Iterable, vocal: bool = True, filter_fct: Optional[Callable] = None,
+                                  n_workers: int = 1, prefetch: Optional[int] = None, ordered: bool = True):
     """Base generator, yields DocModels based on a list of pickled docmodels paths.
 
+    With n_workers > 1, the DocModels are read and filtered by a pool of worker processes while the consumer works on
+    the previous ones. filter_fct must then be picklable (a top level function or e.g. a PosFilter, not a lambda). Note
+    that DocModels sent back by the workers are fully loaded (see DocModel sections), so reading only part of each
+    DocModel is better done with generate_ids_tags.
+
     Args:
         path_list: A list of pickled DocModel paths, can be generated by calling os.listdir on docmodels_path
         vocal: Whether to to print each time 5k docmodels are generated
         filter_fct: None or a function taking a docmodel as argument and returning a bool. Only docmodels for which the function returns true will be yielded.
+        n_workers: Number of reader processes. 1 reads the DocModels in the current process, None uses all cores.
+        prefetch: Max number of DocModels read in advance, defaults to 4 per worker.
+        ordered: Whether to yield the DocModels in the order of path_list, or as soon as they are read.
 
     Returns:
 
     """
 
     i = 0
-    for path in path_list:
-        if path.suffix != '.p':
-            print(f'Ignored [{path.name}] due to wrong file extension')
-            continue
-        with open(path, 'rb') as f:
-            try:
-                dm = pickle.load(f)
-                if (filter_fct is None) or filter_fct(dm):
-                    i += 1
-                    if vocal and i % 5000 == 0:
-                        print(f'Generated {i} docmodels')
-                    yield dm
-            except EOFError:
-                print(f'ERROR! Could not open docmodel at: {path}')
+    for dm in _read_from_paths(path_list, partial(_read_docmodel, filter_fct), n_workers, prefetch, ordered):
+        if dm is not None:
+            i += 1
+            if vocal and i % 5000 == 0:
+                print(f'Generated {i} docmodels')
+            yield dm
 
 
 def generate_ids_tags(path_list, function_name, flatten=True,
-                      dms_filter_fct: Optional[Callable] = None, tags_filter_fct: Optional[Callable] = None):
-    for dm in generate_docmodels_from_paths(path_list, filter_fct=dms_filter_fct):
-        if flatten:
-            yield dm.get_id(), [tag for tag in getattr(dm, function_name)(flatten=flatten)
-                                if tags_filter_fct is None or tags_filter_fct(tag)]
-        else:
-            for i, para in enumerate(getattr(dm, function_name)(flatten=flatten)):
-                yield f'{dm.get_id()}_{i}', [tag for tag in para if tags_filter_fct is None or tags_filter_fct(tag)]
-    
+                      dms_filter_fct: Optional[Callable] = None, tags_filter_fct: Optional[Callable] = None,
+                      n_workers: int = 1, prefetch: Optional[int] = None, ordered: bool = True, tag_attr: str = None):
+    """Yields (id, [tags]) pairs for each DocModel, or for each paragraph with id [doc_id]_[para_num] if flatten is False.
+
+    With n_workers > 1, unpickling and filtering is done by a pool of worker processes, see
+    generate_docmodels_from_paths(). Filters must then be picklable. If tag_attr is specified, the value of this
+    attribute is yielded instead of each tag (e.g. 'lemma').
+    """
+
+    read_fct = partial(_read_ids_tags, function_name, flatten, dms_filter_fct, tags_filter_fct, tag_attr)
+    for ids_tags in _read_from_paths(path_list, read_fct, n_workers, prefetch, ordered):
+        yield from ids_tags
+
+
+class PosFilter:
+    """Picklable tags filter, keeps tags whose pos is in pos_tags. Can replace lambda x: x.pos in pos_tags when the
+    generators use several processes."""
+
+    def __init__(self, pos_tags: Iterable[str]):
+        self.pos_tags = frozenset(pos_tags)
+
+    def __call__(self, tag) -> bool:
+        return tag.pos in self.pos_tags
+
+
+def _read_from_paths(path_list: Iterable, read_fct: Callable, n_workers: int = 1, prefetch: Optional[int] = None,
+                     ordered: bool = True):
+    """Applies read_fct to each DocModel path, in the current process or in a pool of reader processes"""
+
+    def checked_paths():
+        for path in path_list:
+            if path.suffix != '.p':
+                print(f'Ignored [{path.name}] due to wrong file extension')
+                continue
+            yield path
+
+    if n_workers == 1:
+        return map(read_fct, checked_paths())
+    return bounded_imap(read_fct, checked_paths(), n_workers=n_workers, max_pending=prefetch, ordered=ordered)
+
+
+def _read_docmodel(filter_fct: Optional[Callable], path) -> Optional[DocModel]:
+    """Returns the DocModel, or None if it is filtered out or can't be read"""
+
+    try:
+        dm = DocModel.read_pickle(path)
+    except EOFError:
+        print(f'ERROR! Could not open docmodel at: {path}')
+        return None
+    return dm if filter_fct is None or filter_fct(dm) else None
+
+
+def _read_ids_tags(function_name: str, flatten: bool, dms_filter_fct: Optional[Callable],
+                   tags_filter_fct: Optional[Callable], tag_attr: Optional[str], path) -> list:
+    """Returns the (id, [tags]) pairs of a DocModel, see generate_ids_tags()"""
+
+    dm = _read_docmodel(dms_filter_fct, path)
+    if dm is None:
+        return []
+    if flatten:
+        chunks = [(dm.get_id(), getattr(dm, function_name)(flatten=flatten))]
+    else:
+        chunks = [(f'{dm.get_id()}_{i}', para) for i, para in enumerate(getattr(dm, function_name)(flatten=flatten))]
+    return [(chunk_id, [tag if tag_attr is None else getattr(tag, tag_attr)
+                        for tag in tags if tags_filter_fct is None or tags_filter_fct(tag)])
+            for chunk_id, tags in chunks]
+
 # Shortcut generators below, based on those defined above but tuned to yield the data used in the analyses
-# dir_path param should always be the path to the folder containing the pickled docmodels (and nothing else)
+# dir_path param should always be the path to the folder containing the pickled docmodels (and nothing else), or a
+# CorpusStore (or the path to its folder), in which case the data is read from the store instead (see corpus_store.py)
+# where is an optional predicate selecting the documents, a SQL WHERE clause or a declarative dict (see catalog.py).
+# With a DocModels folder, it is evaluated by the metadata catalog at catalog_path, and only the matching DocModels are
+# opened. With a store, only declarative predicates are supported, and they are evaluated on the store metadata.
+# n_workers, prefetch and ordered set the pool of reader processes used with a DocModels folder, see
+# generate_docmodels_from_paths(). Filters must then be picklable, e.g. PosFilter. They are ignored with a store, which
+# is read sequentially by the current process.
+# shard_index and num_shards only select the documents of one shard of the corpus, to split a run across several
+# machines (see utils/sharding.py). DocModels are always read in sorted filename order.
+
+
+def as_corpus_store(dir_path) -> Optional[CorpusStore]:
+    """Returns the CorpusStore if dir_path is a store or the path to one, None if it is a DocModels folder"""
+
+    if isinstance(dir_path, CorpusStore):
+        return dir_path
+    return CorpusStore(dir_path) if CorpusStore.is_store(dir_path) else None
+
 
+def select_docmodel_paths(dir_path, where: Where = None, catalog_path=None, shard_index: int = 0,
+                          num_shards: int = 1) -> list:
+    """Paths of the DocModels matching where (all DocModels of dir_path if where is None) and belonging to the shard,
+    sorted by filename"""
 
-def generate_para_lemmas(dir_path):
-    for para_id, tags in generate_ids_tags([dir_path / f for f in os.listdir(dir_path)], 'get_text_tags', flatten=False):
-        yield para_id, [tag.lemma for tag in tags]
+    if where is None:
+        paths = [dir_path / f for f in sorted(os.listdir(dir_path))]
+    elif catalog_path is None:
+        raise ValueError('A catalog_path is needed to select DocModels with a where predicate')
+    else:
+        catalog = DocCatalog(catalog_path)
+        paths = catalog.paths(dir_path, where)
+        catalog.close()
+    return shard_paths(paths, shard_index, num_shards)
 
 
-def generate_all_docmodels(dir_path):
-    """Shortcut to generate all docmodels in a dir. All files must be DocModels"""
+def metadata_filter(where: Where, shard_index: int = 0, num_shards: int = 1) -> Optional[Callable]:
+    """Filter on the metadata dicts of a corpus store, selecting the documents matching where in the shard"""
 
-    return generate_docmodels_from_paths(dir_path / f for f in os.listdir(dir_path))
+    doc_filter_fct = partial(matches, where) if where is not None else None
+    return ShardFilter(shard_index, num_shards, doc_filter_fct) if num_shards > 1 else doc_filter_fct
 
 
-def generate_ids_abs_tags(dir_path, flatten=True):
+def generate_para_lemmas(dir_path, where: Where = None, catalog_path=None, n_workers: int = 1,
+                         prefetch: Optional[int] = None, ordered: bool = True, shard_index: int = 0,
+                         num_shards: int = 1):
+    store = as_corpus_store(dir_path)
+    if store is not None:
+        return store.generate_para_lemmas('text', doc_filter_fct=metadata_filter(where, shard_index, num_shards))
+    paths = select_docmodel_paths(dir_path, where, catalog_path, shard_index, num_shards)
+    return generate_ids_tags(paths, 'get_text_tags', flatten=False, n_workers=n_workers, prefetch=prefetch,
+                             ordered=ordered, tag_attr='lemma')
+
+
+def generate_all_docmodels(dir_path, where: Where = None, catalog_path=None, n_workers: int = 1,
+                           prefetch: Optional[int] = None, ordered: bool = True, shard_index: int = 0,
+                           num_shards: int = 1):
+    """Shortcut to generate all docmodels in a dir, or those matching where. All files must be DocModels"""
+
+    paths = select_docmodel_paths(dir_path, where, catalog_path, shard_index, num_shards)
+    return generate_docmodels_from_paths(paths, n_workers=n_workers, prefetch=prefetch, ordered=ordered)
+
+
+def generate_ids_abs_tags(dir_path, flatten=True, where: Where = None, catalog_path=None, n_workers: int = 1,
+                          prefetch: Optional[int] = None, ordered: bool = True, shard_index: int = 0,
+                          num_shards: int = 1):
     """Generator yielding (id, [tags]) pairs, for abstract tags.
 
     Args:
         dir_path: DocModel dir
         flatten: Wheter to flatten the paragraphs. If false, will yield paragraphs with id [doc_id]_[para_num]
+        where: Optional predicate selecting the documents, see above
+        catalog_path: Path to the metadata catalog, needed to use where with a DocModel dir
 
     Returns:
 
     """
 
-    return generate_ids_tags([dir_path / f for f in os.listdir(dir_path)], 'get_abs_tags', flatten=flatten)
+    store = as_corpus_store(dir_path)
+    if store is not None:
+        return store.generate_ids_tags('abs', flatten=flatten,
+                                       doc_filter_fct=metadata_filter(where, shard_index, num_shards))
+    paths = select_docmodel_paths(dir_path, where, catalog_path, shard_index, num_shards)
+    return generate_ids_tags(paths, 'get_abs_tags', flatten=flatten, n_workers=n_workers, prefetch=prefetch,
+                             ordered=ordered)
 
 
-def generate_ids_text_tags(dir_path, flatten=True):
+def generate_ids_text_tags(dir_path, flatten=True, where: Where = None, catalog_path=None, n_workers: int = 1,
+                           prefetch: Optional[int] = None, ordered: bool = True, shard_index: int = 0,
+                           num_shards: int = 1):
     """Generator yielding (id, [tags]) pairs, for text tags.
 
         Args:
             dir_path: DocModel dir
             flatten: Wheter to flatten the paragraphs. If false, will yield paragraphs with id [doc_id]_[para_num]
+            where: Optional predicate selecting the documents, see above
+            catalog_path: Path to the metadata catalog, needed to use where with a DocModel dir
 
         Returns:
 
         """
 
-    return generate_ids_tags([dir_path / f for f in os.listdir(dir_path)], 'get_text_tags', flatten=flatten)
+    store = as_corpus_store(dir_path)
+    if store is not None:
+        return store.generate_ids_tags('text', flatten=flatten,
+                                       doc_filter_fct=metadata_filter(where, shard_index, num_shards))
+    paths = select_docmodel_paths(dir_path, where, catalog_path, shard_index, num_shards)
+    return generate_ids_tags(paths, 'get_text_tags', flatten=flatten, n_workers=n_workers, prefetch=prefetch,
+                             ordered=ordered)
 
 
-def generate_ids_text_tags_filtered(dir_path, filter_fct, flatten=True):
+def generate_ids_text_tags_filtered(dir_path, filter_fct, flatten=True, where: Where = None, catalog_path=None,
+                                    n_workers: int = 1, prefetch: Optional[int] = None, ordered: bool = True,
+                                    shard_index: int = 0, num_shards: int = 1):
     """ Generator yielding (id, [tags]) pairs, for text tags filtered on a specified condition.
 
     Args:
         dir_path:
-        filter_fct: function filtering tags, should take a tag and return a bool
+        filter_fct: function filtering tags, should take a tag and return a bool. Must be picklable if n_workers > 1.
         flatten:
+        where: Optional predicate selecting the documents, see above
+        catalog_path: Path to the metadata catalog, needed to use where with a DocModel dir
 
     """
 
-    return generate_ids_tags([dir_path / f for f in os.listdir(dir_path)], 'get_text_tags', flatten=flatten, tags_filter_fct=filter_fct)
-
-
+    store = as_corpus_store(dir_path)
+    if store is not None:
+        return store.generate_ids_tags('text', flatten=flatten, tags_filter_fct=filter_fct,
+                                       doc_filter_fct=metadata_filter(where, shard_index, num_shards))
+    paths = select_docmodel_paths(dir_path, where, catalog_path, shard_index, num_shards)
+    return generate_ids_tags(paths, 'get_text_tags', flatten=flatten, tags_filter_fct=filter_fct, n_workers=n_workers,
+                             prefetch=prefetch, ordered=ordered)
@@ -55,6 +55,23 @@ def save_json(path, data):
         json.dump(data, f, ensure_ascii=False, indent=4)
 
 
+def save_json_items(path, items, encoded: bool = False):
+    """Saves (key, value) pairs as a json object, in the same format as save_json(path, dict(items)), but writes each
+    value as soon as it is generated instead of holding them all in memory. Keys must be strings. If encoded is True,
+    values are already json texts, indented as values of the object (json.dumps(value, ensure_ascii=False, indent=4)
+    with 4 more spaces after each newline)."""
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        n_items = 0
+        for key, value in items:
+            # Values are indented one level deeper, newlines inside json strings are escaped so only the layout changes
+            value_json = value if encoded else json.dumps(value, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+            f.write(f'{"," if n_items else ""}\n    {json.dumps(key, ensure_ascii=False)}: {value_json}')
+            n_items += 1
+        f.write('\n}' if n_items else '}')
+
+
 def make_list_mapping_from_csv_path(csv_path):
     """Reads a csv and makes a key: [values] mapping
 
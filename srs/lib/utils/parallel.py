@@ -0,0 +1,61 @@
+"""Helpers to spread corpus-wide work across several processes"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from typing import Callable, Iterable, Optional
+
+
+def resolve_n_workers(n_workers: Optional[int]) -> int:
+    """Returns the number of worker processes to use. None or values below 1 mean one worker per available core."""
+
+    if n_workers is None or n_workers < 1:
+        return os.cpu_count() or 1
+    return n_workers
+
+
+def bounded_imap(fct: Callable, iterable: Iterable, n_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 ordered: bool = True, initializer: Optional[Callable] = None, initargs: tuple = ()):
+    """Generator, applies fct to each item of iterable in a process pool and yields the results.
+
+    Only max_pending tasks are submitted at any given time, so the iterable is consumed lazily and the results waiting
+    to be read never pile up in memory. Functions and items must be picklable (functions should be defined at the top
+    level of a module).
+
+    Args:
+        fct: Function called on each item, in the worker processes.
+        iterable: Items to process.
+        n_workers: Number of worker processes, see resolve_n_workers().
+        max_pending: Max number of submitted tasks not yet yielded. Defaults to 4 times the number of workers.
+        ordered: Whether to yield the results in the order of iterable. If False, results are yielded as soon as they
+            are ready.
+        initializer: Optional function called once when each worker starts, e.g. to set up a per-worker resource.
+        initargs: Arguments passed to initializer.
+
+    Returns:
+        Yields fct(item) for each item.
+    """
+
+    n_workers = resolve_n_workers(n_workers)
+    max_pending = max_pending if max_pending is not None else 4 * n_workers
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque() if ordered else set()
+        for item in iterable:
+            future = executor.submit(fct, item)
+            if ordered:
+                pending.append(future)
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            else:
+                pending.add(future)
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+        if ordered:
+            while pending:
+                yield pending.popleft().result()
+        else:
+            for future in as_completed(pending):
+                yield future.result()
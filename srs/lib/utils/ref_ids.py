@@ -0,0 +1,56 @@
+"""Compact integer ids of document or paragraph ids ([doc_id]_[para_num]), used by the models holding many of them"""
+from typing import Iterable
+
+import numpy as np
+
+# Paragraph numbers are stored in the low bits of the integer ids
+REF_PARA_BASE = 2**20
+
+
+class RefIds:
+    """Encodes refs as integers: index of the document id * REF_PARA_BASE + paragraph number + 1, or + 0 if the ref is
+    a document id without paragraph number. Only the distinct document ids are stored, in order of first encoding.
+
+    Attributes
+    ----------
+    docs: list[str]
+        Document ids, by index
+    """
+
+    def __init__(self):
+        self.docs = []
+        self._doc_indices = {}
+
+    def encode(self, ref: str) -> int:
+        doc_id, _, para_num = ref.rpartition('_')
+        if doc_id and para_num.isdigit() and str(int(para_num)) == para_num and int(para_num) < REF_PARA_BASE - 1:
+            para = int(para_num) + 1
+        else:
+            doc_id, para = ref, 0
+        return self._doc_index(doc_id) * REF_PARA_BASE + para
+
+    def decode(self, ref: int) -> str:
+        doc_index, para = divmod(ref, REF_PARA_BASE)
+        return self.docs[doc_index] if para == 0 else f'{self.docs[doc_index]}_{para - 1}'
+
+    def decode_all(self, refs: Iterable[int]) -> list[str]:
+        return [self.decode(ref) for ref in refs]
+
+    def translate(self, other: 'RefIds', refs: np.ndarray) -> np.ndarray:
+        """Encodes refs encoded by other with these ids, registering the document ids not known yet"""
+
+        doc_indices = np.array([self._doc_index(doc_id) for doc_id in other.docs], dtype=np.int64)
+        refs = np.asarray(refs, dtype=np.int64)
+        if not len(doc_indices):
+            return refs.copy()
+        return doc_indices[refs // REF_PARA_BASE] * REF_PARA_BASE + refs % REF_PARA_BASE
+
+    def _doc_index(self, doc_id: str) -> int:
+        doc_index = self._doc_indices.get(doc_id)
+        if doc_index is None:
+            doc_index = self._doc_indices[doc_id] = len(self.docs)
+            self.docs.append(doc_id)
+        return doc_index
+
+    def __len__(self):
+        return len(self.docs)
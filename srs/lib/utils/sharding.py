@@ -0,0 +1,56 @@
+"""Deterministic sharding of the corpus, to split a run across several machines.
+
+Each DocModel belongs to one of num_shards shards, chosen from a hash of its filename. The assignment only depends on
+the filename, so every node computes the same shards without any coordination, whatever the order in which the file
+system lists the files. Node i processes shard_index=i, saves the partial state of its models (see
+models/partial_state.py), and the partial states are then merged.
+"""
+import hashlib
+from pathlib import Path
+from typing import Iterable
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Shard of a key (usually a DocModel filename), in [0, num_shards)"""
+
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+
+def check_shard(shard_index: int, num_shards: int) -> None:
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f'Invalid shard {shard_index} of {num_shards}')
+
+
+def shard_paths(paths: Iterable[Path], shard_index: int = 0, num_shards: int = 1) -> list[Path]:
+    """Keeps the paths belonging to the shard, in the same order"""
+
+    check_shard(shard_index, num_shards)
+    if num_shards == 1:
+        return list(paths)
+    return [path for path in paths if shard_of(path.name, num_shards) == shard_index]
+
+
+class ShardFilter:
+    """Picklable filter on a metadata dict (see corpus_store.py), True for documents belonging to the shard. Can be
+    combined with another metadata filter, which is then applied to the documents of the shard."""
+
+    def __init__(self, shard_index: int, num_shards: int, doc_filter_fct=None):
+        check_shard(shard_index, num_shards)
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.doc_filter_fct = doc_filter_fct
+
+    def __call__(self, doc: dict) -> bool:
+        if shard_of(doc['filename'], self.num_shards) != self.shard_index:
+            return False
+        return self.doc_filter_fct is None or self.doc_filter_fct(doc)
+
+
+def ref_sort_key(ref: str) -> tuple:
+    """Sort key of document or paragraph ids ([doc_id]_[para_num]), giving paragraphs in their numerical order"""
+
+    doc_id, _, para_num = ref.rpartition('_')
+    if doc_id and para_num.isdigit():
+        return doc_id, int(para_num)
+    return ref, -1
@@ -4,7 +4,10 @@ The _summary functions generate dataframes similar to the tables presented in th
 """
 from srs.lib.utils.generators import generate_all_docmodels
 from srs.lib.utils.io_utils import save_json
-from srs.config import DOCMODELS_PATH, RESULTS_PATH
+from srs.lib.corpus_store import CorpusStore, EXTRA_METADATA
+from srs.lib.models.association import CoocCounts
+from srs.lib.models.docterm import SparseDocTerm
+from srs.config import DOCMODELS_PATH, RESULTS_PATH, CORPUS_STORE_PATH
 
 import pandas as pd
 from pathlib import Path
@@ -14,8 +17,12 @@ def export_doc_refs_json(save_path):
     """Saves corpus metadata as a json file. See DocModel.metadata_to_dict for details"""
 
     docs = {}
-    for dm in generate_all_docmodels(DOCMODELS_PATH):
-        docs[dm.id] = dm.metadata_to_dict()
+    if CORPUS_STORE_PATH is not None:
+        for doc in CorpusStore(CORPUS_STORE_PATH).docs:
+            docs[doc['id']] = {key: value for key, value in doc.items() if key not in EXTRA_METADATA}
+    else:
+        for dm in generate_all_docmodels(DOCMODELS_PATH):
+            docs[dm.id] = dm.metadata_to_dict()
 
     save_json(save_path, docs)
 
@@ -48,13 +55,22 @@ def topic_summary(n_words: int = 5):
     return topics_df
 
 
-def cooc_summary(word_list, n_coocs: int = 20):
+def cooc_summary(word_list, n_coocs: int = 20, measure: str = 'count', min_count: int = 1):
     """Makes a summary of the top-n cooccurring words for each word in word_list
 
-    Words in word_list MUST be cooc df column names"""
+    Words in word_list MUST be cooc df column names. Cooccurrences are ranked by measure, one of
+    srs.lib.models.association.MEASURES ('count', 'pmi', 'npmi', 'log_likelihood', 'chi2', 't_score'), computed on the
+    sparse counts saved by step 2, ignoring the pairs seen less than min_count times"""
 
-    cc_df = load_cooc_df()
+    cooc_counts_path = RESULTS_PATH / 'cooc_counts.npz'
+    if cooc_counts_path.exists():
+        return load_cooc_counts().top_k_df(measure, k=n_coocs, min_count=min_count, words=word_list)
+    if measure != 'count':
+        raise FileNotFoundError(f'{cooc_counts_path} not found, run step 2 to rank the cooccurrences by {measure}')
 
+    cc_df = load_cooc_df()
+    if min_count > 1:
+        cc_df = cc_df.where(cc_df >= min_count)
     top_cooc_df = pd.DataFrame.from_dict({word: cc_df[word].nlargest(n_coocs).index for word in word_list})
     return top_cooc_df
 
@@ -64,10 +80,18 @@ def load_docterm_df():
     return pd.read_pickle(RESULTS_PATH / 'abstracts_docterm_df.p')
 
 
+def load_sparse_docterm():
+    return SparseDocTerm.load_npz(RESULTS_PATH / 'abstracts_docterm.npz')
+
+
 def load_cooc_df():
     return pd.read_pickle(RESULTS_PATH / 'cooc_df_corpus.p')
 
 
+def load_cooc_counts():
+    return CoocCounts.load_npz(RESULTS_PATH / 'cooc_counts.npz')
+
+
 def load_doc_topics_df():
     return pd.read_pickle(RESULTS_PATH / 'doc_topics_df.p')
 